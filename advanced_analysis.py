@@ -2,167 +2,248 @@
 Advanced Analytics for Diabetes Readmission Prediction
 Working version with proper error handling
 """
-from pymongo import MongoClient
+from concurrent.futures import ThreadPoolExecutor
+
+from connection import get_client
+from metrics import query_label
+from result_cache import analysis_collection
+
+# readmitted values counted as a readmission in the rate calculations
+READMITTED_VALUES = ["YES", ">30"]
+
+READMISSION_RISK_PIPELINE = [
+    {"$match": {"readmitted": {"$in": ["YES", "NO"]}}},
+    {"$group": {
+        "_id": "$readmitted",
+        "avg_medications": {"$avg": "$num_medications"},
+        "avg_stay": {"$avg": "$time_in_hospital"},
+        "avg_lab_procedures": {"$avg": "$num_lab_procedures"},
+        "patient_count": {"$sum": 1}
+    }},
+    {"$sort": {"patient_count": -1}}
+]
+
+MEDICATION_IMPACT_PIPELINE = [
+    {"$bucket": {
+        "groupBy": "$num_medications",
+        "boundaries": [0, 5, 10, 15, 20, 100],
+        "default": "20+",
+        "output": {
+            "total_patients": {"$sum": 1},
+            "readmitted_count": {
+                "$sum": {
+                    "$cond": [
+                        {"$in": ["$readmitted", READMITTED_VALUES]},
+                        1,
+                        0
+                    ]
+                }
+            },
+            "avg_stay": {"$avg": "$time_in_hospital"}
+        }
+    }},
+    {"$sort": {"_id": 1}}
+]
+
+AGE_GROUP_PIPELINE = [
+    {"$group": {
+        "_id": "$age",
+        "total_patients": {"$sum": 1},
+        "readmission_rate": {
+            "$avg": {
+                "$cond": [
+                    {"$in": ["$readmitted", READMITTED_VALUES]},
+                    1,
+                    0
+                ]
+            }
+        },
+        "avg_medications": {"$avg": "$num_medications"},
+        "avg_stay": {"$avg": "$time_in_hospital"}
+    }},
+    {"$sort": {"_id": 1}}
+]
+
 
 class AdvancedDiabetesAnalysis:
-    def __init__(self):
-        self.client = MongoClient('mongodb://localhost:27017/')
-        self.collection = self.client['diabetes_project']['patient_data']
-        print("✅ Advanced Analysis initialized")
+    def __init__(self, backend="mongo", strict=False):
+        # Strict callers (the CLI) get each failure raised after it is printed
+        self.strict = strict
+        # Snapshot, CSV or MongoDB, behind the on-disk result cache
+        self.collection = analysis_collection()
+        self.store = None
+        if backend == "numpy":
+            # Optional in-memory backend: one projected load, then vectorized group-bys
+            from columnar import ColumnarStore
+            self.store = ColumnarStore.from_collection(self.collection)
+        elif backend == "partitioned":
+            # Each pipeline split into key ranges that run concurrently, merged client-side
+            from partitioned import PartitionedStore
+            self.store = PartitionedStore(self.collection)
+        elif backend != "mongo":
+            raise ValueError(f"Unknown backend: {backend}")
+        print(f"✅ Advanced Analysis initialized ({backend} backend)")
+
+    @property
+    def client(self):
+        """The shared client, looked up per use so configure() never leaves a closed one here"""
+        return get_client()
+
+    def _run(self, name, pipeline):
+        """Answer an analysis from the columnar or partitioned store if set, else from MongoDB"""
+        if self.store is not None:
+            return getattr(self.store, name)()
+        with query_label(name):
+            return list(self.collection.aggregate(pipeline))
+
+    def _count_patients(self):
+        with query_label("total_patients"):
+            return self.collection.count_documents({})
     
-    def predict_readmission_risk(self):
-        """Identify factors correlated with readmission"""
-        print("\n🔍 Analyzing readmission risk factors...")
-        
+    def _analysis(self, name):
+        """Run one report section: heading, query, printed results"""
+        heading, pipeline, printer, label = self.SECTIONS[name]
+        print(heading)
+
         try:
-            pipeline = [
-                {"$match": {"readmitted": {"$in": ["YES", "NO"]}}},
-                {"$group": {
-                    "_id": "$readmitted",
-                    "avg_medications": {"$avg": "$num_medications"},
-                    "avg_stay": {"$avg": "$time_in_hospital"},
-                    "avg_lab_procedures": {"$avg": "$num_lab_procedures"},
-                    "patient_count": {"$sum": 1}
-                }},
-                {"$sort": {"patient_count": -1}}
-            ]
-            
-            results = list(self.collection.aggregate(pipeline))
-            
-            print("📊 Readmission Risk Analysis Results:")
-            for result in results:
-                readmission_status = result['_id']
-                count = result['patient_count']
-                avg_meds = result['avg_medications']
-                avg_stay = result['avg_stay']
-                avg_labs = result['avg_lab_procedures']
-                
-                print(f"   {readmission_status} patients:")
-                print(f"     Count: {count:,}")
-                print(f"     Avg Medications: {avg_meds:.1f}")
-                print(f"     Avg Hospital Stay: {avg_stay:.1f} days")
-                print(f"     Avg Lab Procedures: {avg_labs:.1f}")
-                print()
-            
-            return results
-            
+            results = self._run(name, pipeline)
+            # Printing is inside the try too: a null average fails the format, not the caller
+            getattr(self, printer)(results)
         except Exception as e:
-            print(f"❌ Error in readmission analysis: {e}")
+            print(f"❌ Error in {label}: {e}")
+            if self.strict:
+                raise
             return []
-    
+        return results
+
+    def _print_readmission_risk(self, results):
+        print("📊 Readmission Risk Analysis Results:")
+        for result in results:
+            readmission_status = result['_id']
+            count = result['patient_count']
+            avg_meds = result['avg_medications']
+            avg_stay = result['avg_stay']
+            avg_labs = result['avg_lab_procedures']
+
+            print(f"   {readmission_status} patients:")
+            print(f"     Count: {count:,}")
+            print(f"     Avg Medications: {avg_meds:.1f}")
+            print(f"     Avg Hospital Stay: {avg_stay:.1f} days")
+            print(f"     Avg Lab Procedures: {avg_labs:.1f}")
+            print()
+
+    def _print_medication_impact(self, results):
+        print("📈 Medication Impact Analysis:")
+        for result in results:
+            med_range = result['_id']
+            total = result['total_patients']
+            readmitted = result['readmitted_count']
+            readmission_rate = (readmitted / total) * 100 if total > 0 else 0
+            avg_stay = result['avg_stay']
+
+            print(f"   {med_range} medications:")
+            print(f"     Patients: {total:,}")
+            print(f"     Readmission rate: {readmission_rate:.1f}%")
+            print(f"     Avg stay: {avg_stay:.1f} days")
+            print()
+
+    def _print_age_groups(self, results):
+        print("📊 Age Group Analysis:")
+        for result in results:
+            age_group = result['_id']
+            total = result['total_patients']
+            readmission_rate = result['readmission_rate'] * 100
+            avg_meds = result['avg_medications']
+            avg_stay = result['avg_stay']
+
+            print(f"   {age_group}:")
+            print(f"     Patients: {total:,}")
+            print(f"     Readmission rate: {readmission_rate:.1f}%")
+            print(f"     Avg medications: {avg_meds:.1f}")
+            print(f"     Avg stay: {avg_stay:.1f} days")
+            print()
+
+    # name -> (heading, pipeline, printer, error label), in report order
+    SECTIONS = {
+        "predict_readmission_risk": (
+            "\n🔍 Analyzing readmission risk factors...", READMISSION_RISK_PIPELINE,
+            "_print_readmission_risk", "readmission analysis",
+        ),
+        "analyze_medication_impact": (
+            "\n💊 Analyzing medication impact on readmission...", MEDICATION_IMPACT_PIPELINE,
+            "_print_medication_impact", "medication analysis",
+        ),
+        "age_group_analysis": (
+            "\n👴 Analyzing age group patterns...", AGE_GROUP_PIPELINE,
+            "_print_age_groups", "age analysis",
+        ),
+    }
+
+    def predict_readmission_risk(self):
+        """Identify factors correlated with readmission"""
+        return self._analysis("predict_readmission_risk")
+
     def analyze_medication_impact(self):
         """Analyze how medication count affects readmission"""
-        print("\n💊 Analyzing medication impact on readmission...")
-        
-        try:
-            pipeline = [
-                {"$bucket": {
-                    "groupBy": "$num_medications",
-                    "boundaries": [0, 5, 10, 15, 20, 100],
-                    "default": "20+",
-                    "output": {
-                        "total_patients": {"$sum": 1},
-                        "readmitted_count": {
-                            "$sum": {
-                                "$cond": [
-                                    {"$in": ["$readmitted", ["YES", ">30"]]}, 
-                                    1, 
-                                    0
-                                ]
-                            }
-                        },
-                        "avg_stay": {"$avg": "$time_in_hospital"}
-                    }
-                }},
-                {"$sort": {"_id": 1}}
-            ]
-            
-            results = list(self.collection.aggregate(pipeline))
-            
-            print("📈 Medication Impact Analysis:")
-            for result in results:
-                med_range = result['_id']
-                total = result['total_patients']
-                readmitted = result['readmitted_count']
-                readmission_rate = (readmitted / total) * 100 if total > 0 else 0
-                avg_stay = result['avg_stay']
-                
-                print(f"   {med_range} medications:")
-                print(f"     Patients: {total:,}")
-                print(f"     Readmission rate: {readmission_rate:.1f}%")
-                print(f"     Avg stay: {avg_stay:.1f} days")
-                print()
-            
-            return results
-            
-        except Exception as e:
-            print(f"❌ Error in medication analysis: {e}")
-            return []
-    
+        return self._analysis("analyze_medication_impact")
+
     def age_group_analysis(self):
         """Analyze readmission patterns by age group"""
-        print("\n👴 Analyzing age group patterns...")
-        
-        try:
-            pipeline = [
-                {"$group": {
-                    "_id": "$age",
-                    "total_patients": {"$sum": 1},
-                    "readmission_rate": {
-                        "$avg": {
-                            "$cond": [
-                                {"$in": ["$readmitted", ["YES", ">30"]]}, 
-                                1, 
-                                0
-                            ]
-                        }
-                    },
-                    "avg_medications": {"$avg": "$num_medications"},
-                    "avg_stay": {"$avg": "$time_in_hospital"}
-                }},
-                {"$sort": {"_id": 1}}
-            ]
-            
-            results = list(self.collection.aggregate(pipeline))
-            
-            print("📊 Age Group Analysis:")
-            for result in results:
-                age_group = result['_id']
-                total = result['total_patients']
-                readmission_rate = result['readmission_rate'] * 100
-                avg_meds = result['avg_medications']
-                avg_stay = result['avg_stay']
-                
-                print(f"   {age_group}:")
-                print(f"     Patients: {total:,}")
-                print(f"     Readmission rate: {readmission_rate:.1f}%")
-                print(f"     Avg medications: {avg_meds:.1f}")
-                print(f"     Avg stay: {avg_stay:.1f} days")
-                print()
-            
-            return results
-            
-        except Exception as e:
-            print(f"❌ Error in age analysis: {e}")
-            return []
-    
-    def generate_summary_report(self):
+        return self._analysis("age_group_analysis")
+
+    def run_analyses(self, max_workers=4):
+        """Run the count and every analysis concurrently on one shared client
+
+        Returns {name: (results, error)}; a failing analysis only sets its own error.
+        """
+        jobs = {"total_patients": self._count_patients}
+        for name, (_, pipeline, _, _) in self.SECTIONS.items():
+            jobs[name] = lambda name=name, pipeline=pipeline: self._run(name, pipeline)
+
+        outcomes = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {name: pool.submit(job) for name, job in jobs.items()}
+            for name, future in futures.items():
+                try:
+                    outcomes[name] = (future.result(), None)
+                except Exception as e:
+                    outcomes[name] = (None, e)
+        return outcomes
+
+    def generate_summary_report(self, max_workers=4):
         """Generate a comprehensive summary report"""
         print("=" * 60)
         print("📋 DIABETES DATA ANALYSIS SUMMARY REPORT")
         print("=" * 60)
-        
-        # Get basic statistics
-        total_patients = self.collection.count_documents({})
-        print(f"Total patients analyzed: {total_patients:,}")
-        
-        # Run all analyses
-        self.predict_readmission_risk()
-        self.analyze_medication_impact() 
-        self.age_group_analysis()
-        
+
+        # Queries run in parallel; printing happens afterwards in a fixed order
+        outcomes = self.run_analyses(max_workers)
+
+        errors = {}
+        total_patients, error = outcomes["total_patients"]
+        if error is None:
+            print(f"Total patients analyzed: {total_patients:,}")
+        else:
+            print(f"❌ Error counting patients: {error}")
+            errors["total_patients"] = error
+
+        for name, (heading, _, printer, label) in self.SECTIONS.items():
+            print(heading)
+            results, error = outcomes[name]
+            if error is None:
+                try:
+                    getattr(self, printer)(results)
+                except Exception as e:
+                    error = e
+            if error is not None:
+                print(f"❌ Error in {label}: {error}")
+                errors[name] = error
+
         print("=" * 60)
+        if errors and self.strict:
+            raise RuntimeError("; ".join(f"{name}: {error}" for name, error in errors.items()))
         print("✅ Analysis complete!")
+        return {name: results for name, (results, _) in outcomes.items()}
 
 # Simple test function
 def main():
@@ -0,0 +1,263 @@
+"""
+In-process evaluation of the aggregation subset the analysis pipelines use
+Expressions, $match filters, mergeable $group/$bucket accumulators and the stages after a
+grouping, shared by the CSV engine and the client-side merge of partitioned pipelines
+"""
+import bisect
+import heapq
+
+
+def bson_sort_key(value):
+    # Null sorts before numbers, numbers before strings, like MongoDB's $sort
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, dict):
+        return (3, tuple(bson_sort_key(v) for v in value.values()))
+    return (2, str(value))
+
+
+def nested(doc, path):
+    for part in path.split("."):
+        doc = doc.get(part) if isinstance(doc, dict) else None
+    return doc
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def compare(a, b):
+    """-1, 0 or 1 in BSON order (null < numbers < strings)"""
+    a, b = bson_sort_key(a), bson_sort_key(b)
+    return (a > b) - (a < b)
+
+
+def evaluate(expr, doc):
+    """Evaluate the aggregation expressions the analysis pipelines use against one document"""
+    if isinstance(expr, str) and expr.startswith("$"):
+        if expr.startswith("$$"):
+            raise ValueError(f"Variable {expr} is not supported outside MongoDB")
+        return nested(doc, expr[1:])
+    if isinstance(expr, list):
+        return [evaluate(item, doc) for item in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if is_object(expr):
+        return {name: evaluate(value, doc) for name, value in expr.items()}
+
+    (operator, operand), = expr.items()
+    if operator == "$literal":
+        return operand
+    if operator == "$cond":
+        if isinstance(operand, dict):
+            operand = [operand["if"], operand["then"], operand["else"]]
+        test, if_true, if_false = operand
+        return evaluate(if_true if evaluate(test, doc) else if_false, doc)
+    if operator == "$ifNull":
+        *candidates, fallback = operand
+        for candidate in candidates:
+            value = evaluate(candidate, doc)
+            if value is not None:
+                return value
+        return evaluate(fallback, doc)
+    if operator == "$isNumber":
+        return is_number(evaluate(operand, doc))
+
+    args = evaluate(operand, doc)
+    if operator == "$in":
+        return args[0] in args[1]
+    comparisons = {
+        "$eq": lambda c: c == 0, "$ne": lambda c: c != 0, "$gt": lambda c: c > 0,
+        "$gte": lambda c: c >= 0, "$lt": lambda c: c < 0, "$lte": lambda c: c <= 0,
+    }
+    if operator in comparisons:
+        return comparisons[operator](compare(args[0], args[1]))
+    if operator in ("$add", "$multiply"):
+        if any(arg is None for arg in args):
+            return None
+        result = 0 if operator == "$add" else 1
+        for arg in args:
+            result = result + arg if operator == "$add" else result * arg
+        return result
+    raise ValueError(f"{operator} is not supported outside MongoDB")
+
+
+def _same_type(a, b):
+    return bson_sort_key(a)[0] == bson_sort_key(b)[0]
+
+
+def document_matches(doc, spec):
+    """Query-language $match: equality, $in/$nin, $ne, comparisons, $exists, $and/$or"""
+    for field, condition in spec.items():
+        if field == "$and":
+            if not all(document_matches(doc, part) for part in condition):
+                return False
+            continue
+        if field == "$or":
+            if not any(document_matches(doc, part) for part in condition):
+                return False
+            continue
+
+        value = nested(doc, field)
+        if not (isinstance(condition, dict) and condition and next(iter(condition)).startswith("$")):
+            if value != condition:
+                return False
+            continue
+        for operator, target in condition.items():
+            if operator == "$in":
+                ok = value in target
+            elif operator == "$nin":
+                ok = value not in target
+            elif operator == "$eq":
+                ok = value == target
+            elif operator == "$ne":
+                ok = value != target
+            elif operator == "$exists":
+                ok = (field.split(".")[0] in doc) == bool(target)
+            elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                # Query comparisons only match within one type bracket
+                if not _same_type(value, target):
+                    return False
+                c = compare(value, target)
+                ok = {"$gt": c > 0, "$gte": c >= 0, "$lt": c < 0, "$lte": c <= 0}[operator]
+            else:
+                raise ValueError(f"{operator} is not supported outside MongoDB")
+            if not ok:
+                return False
+    return True
+
+
+def parse_accumulators(output):
+    """[(name, operator, operand)] for a $group/$bucket output spec"""
+    accumulators = []
+    for name, accumulator in output.items():
+        (operator, operand), = accumulator.items()
+        if operator not in ("$sum", "$avg", "$min", "$max"):
+            raise ValueError(f"{operator} is not supported outside MongoDB")
+        accumulators.append((name, operator, operand))
+    return accumulators
+
+
+def initial(operator):
+    # $avg carries (sum, count) so partial states merge exactly
+    return [0, 0] if operator == "$avg" else (0 if operator == "$sum" else None)
+
+
+def step(operator, state, value):
+    if operator == "$sum":
+        return state + value if is_number(value) else state
+    if operator == "$avg":
+        if is_number(value):
+            state[0] += value
+            state[1] += 1
+        return state
+    # $min and $max skip nulls and missing values
+    if value is None:
+        return state
+    if state is None:
+        return value
+    c = compare(value, state)
+    return value if (c < 0 if operator == "$min" else c > 0) else state
+
+
+def merge(operator, state, other):
+    if operator == "$sum":
+        return state + other
+    if operator == "$avg":
+        return [state[0] + other[0], state[1] + other[1]]
+    return step(operator, state, other)
+
+
+def final(operator, state):
+    if operator == "$avg":
+        return state[0] / state[1] if state[1] else None
+    return state
+
+
+def is_object(spec):
+    """{"name": expr, ...} as opposed to a single {"$operator": ...} expression"""
+    return isinstance(spec, dict) and not (len(spec) == 1 and next(iter(spec)).startswith("$"))
+
+
+def group_key(grouping, doc):
+    """Hashable group key; dict _ids become tuples and are rebuilt in group_id"""
+    kind, spec = grouping
+    if kind == "$bucket":
+        value = evaluate(spec["groupBy"], doc)
+        boundaries = spec["boundaries"]
+        if is_number(value) and boundaries[0] <= value < boundaries[-1]:
+            return boundaries[bisect.bisect_right(boundaries, value) - 1]
+        if "default" not in spec:
+            raise ValueError(f"$bucket value {value!r} is outside the boundaries and has no default")
+        return spec["default"]
+    if is_object(spec):
+        return tuple(evaluate(expr, doc) for expr in spec.values())
+    return evaluate(spec, doc)
+
+
+def group_id(grouping, key):
+    kind, spec = grouping
+    if kind == "$group" and is_object(spec):
+        return dict(zip(spec, key))
+    return key
+
+
+def project(doc, projection):
+    if not projection:
+        return doc
+    included = [field for field, keep in projection.items() if keep and field != "_id"]
+    if included:
+        return {field: doc[field] for field in included if field in doc}
+    return {field: value for field, value in doc.items() if projection.get(field, 1)}
+
+
+class _Descending:
+    """Inverts comparisons so one sort key tuple can mix directions"""
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def _sort_key(sort):
+    def key(doc):
+        parts = []
+        for path, direction in sort:
+            value = bson_sort_key(nested(doc, path))
+            parts.append(_Descending(value) if direction == -1 else value)
+        return parts
+    return key
+
+
+def sort_documents(docs, sort, limit=0):
+    """Stable sort; with a limit only the top `limit` documents are ever held"""
+    key = _sort_key(sort)
+    # The row number breaks ties in file order, like insertion order in MongoDB
+    decorated = ((key(doc), n, doc) for n, doc in enumerate(docs))
+    if limit:
+        return [doc for _, _, doc in heapq.nsmallest(limit, decorated)]
+    return [doc for _, _, doc in sorted(decorated)]
+
+
+def finish_stages(docs, stages):
+    """Stages after the grouping run over its (small) output"""
+    for index, (operator, spec) in enumerate(stages):
+        if operator == "$sort":
+            following = stages[index + 1] if index + 1 < len(stages) else None
+            limit = following[1] if following and following[0] == "$limit" else 0
+            docs = sort_documents(docs, list(spec.items()), limit)
+        elif operator == "$limit":
+            docs = (doc for n, doc in zip(range(spec), docs))
+        elif operator == "$match":
+            docs = (doc for doc in docs if document_matches(doc, spec))
+        else:
+            raise ValueError(f"{operator} is not supported outside MongoDB")
+    return docs
@@ -1,454 +1,311 @@
-from flask import Flask, render_template_string, jsonify
-from pymongo import MongoClient
+import json
+import threading
+import time
+from urllib.parse import urlencode
+
+from flask import Flask, Response, render_template_string, jsonify, request, stream_with_context
 from flask_cors import CORS
 
+import metrics
+from connection import get_collection, is_healthy, ping
+from metrics import query_label
+from rollups import refresh_rollup, read_stats
+from response_cache import ResponseCache, data_version
+from indexes import ensure_indexes
+from live_updates import StatsBroadcaster
+from cube import current_cube, parse_query
+from dashboard import DASHBOARD_HTML
+import diagnoses
+import export
+import patients
+import sketches
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for API calls
 
-# Embedded HTML template
-DASHBOARD_HTML = '''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Diabetes Dashboard</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            padding: 20px;
-        }
-
-        .dashboard {
-            max-width: 1200px;
-            margin: 0 auto;
-        }
-
-        .header {
-            text-align: center;
-            color: white;
-            margin-bottom: 30px;
-        }
-
-        .header h1 {
-            font-size: 2.5rem;
-            margin-bottom: 10px;
-            text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
-        }
-
-        .header p {
-            font-size: 1.1rem;
-            opacity: 0.9;
-        }
-
-        .stats-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
-            gap: 20px;
-            margin-bottom: 30px;
-        }
-
-        .stat-card {
-            background: white;
-            border-radius: 15px;
-            padding: 25px;
-            box-shadow: 0 10px 30px rgba(0,0,0,0.2);
-            transition: transform 0.3s ease, box-shadow 0.3s ease;
-            border-left: 5px solid #667eea;
-        }
-
-        .stat-card:hover {
-            transform: translateY(-5px);
-            box-shadow: 0 15px 40px rgba(0,0,0,0.3);
-        }
-
-        .stat-header {
-            display: flex;
-            align-items: center;
-            margin-bottom: 15px;
-        }
-
-        .stat-icon {
-            font-size: 2rem;
-            margin-right: 10px;
-        }
-
-        .stat-title {
-            font-size: 1.2rem;
-            font-weight: 600;
-            color: #333;
-        }
-
-        .stat-value {
-            font-size: 2.5rem;
-            font-weight: bold;
-            color: #667eea;
-            margin-bottom: 5px;
-        }
-
-        .stat-description {
-            color: #666;
-            font-size: 0.9rem;
-        }
-
-        .chart-container {
-            background: white;
-            border-radius: 15px;
-            padding: 25px;
-            box-shadow: 0 10px 30px rgba(0,0,0,0.2);
-            margin-bottom: 20px;
-        }
-
-        .chart-title {
-            font-size: 1.3rem;
-            font-weight: 600;
-            margin-bottom: 20px;
-            color: #333;
-            text-align: center;
-        }
-
-        .readmission-bars {
-            display: flex;
-            align-items: end;
-            justify-content: space-around;
-            height: 200px;
-            margin: 20px 0;
-        }
-
-        .bar {
-            display: flex;
-            flex-direction: column;
-            align-items: center;
-            min-width: 100px;
-        }
-
-        .bar-fill {
-            width: 60px;
-            border-radius: 8px 8px 0 0;
-            margin-bottom: 10px;
-            transition: all 0.5s ease;
-            display: flex;
-            align-items: end;
-            justify-content: center;
-            color: white;
-            font-weight: bold;
-            padding-bottom: 10px;
-        }
-
-        .bar-label {
-            font-weight: 600;
-            color: #333;
-            text-align: center;
-            line-height: 1.2;
-        }
-
-        .loading {
-            text-align: center;
-            color: #666;
-            font-style: italic;
-            padding: 20px;
-        }
-
-        .error {
-            background: #fee;
-            color: #c33;
-            padding: 15px;
-            border-radius: 8px;
-            border-left: 4px solid #c33;
-            margin: 20px 0;
-        }
-
-        .footer {
-            text-align: center;
-            color: rgba(255,255,255,0.8);
-            margin-top: 40px;
-            font-size: 0.9rem;
-        }
-
-        /* Responsive design */
-        @media (max-width: 768px) {
-            .header h1 {
-                font-size: 2rem;
-            }
-            
-            .stats-grid {
-                grid-template-columns: 1fr;
-            }
-            
-            .readmission-bars {
-                height: 150px;
-            }
-            
-            .stat-value {
-                font-size: 2rem;
-            }
-        }
-
-        /* Loading animation */
-        .loading-spinner {
-            border: 3px solid #f3f3f3;
-            border-top: 3px solid #667eea;
-            border-radius: 50%;
-            width: 40px;
-            height: 40px;
-            animation: spin 1s linear infinite;
-            margin: 20px auto;
-        }
-
-        @keyframes spin {
-            0% { transform: rotate(0deg); }
-            100% { transform: rotate(360deg); }
-        }
-    </style>
-</head>
-<body>
-    <div class="dashboard">
-        <div class="header">
-            <h1>🏥 Diabetes Dashboard</h1>
-            <p>Real-time Patient Analytics & Readmission Insights</p>
-        </div>
-
-        <div class="stats-grid">
-            <div class="stat-card">
-                <div class="stat-header">
-                    <span class="stat-icon">👥</span>
-                    <span class="stat-title">Total Patients</span>
-                </div>
-                <div class="stat-value" id="totalPatients">-</div>
-                <div class="stat-description">Patients in database</div>
-            </div>
-
-            <div class="stat-card">
-                <div class="stat-header">
-                    <span class="stat-icon">🏨</span>
-                    <span class="stat-title">Avg Hospital Stay</span>
-                </div>
-                <div class="stat-value" id="avgStay">-</div>
-                <div class="stat-description">Days per admission</div>
-            </div>
-
-            <div class="stat-card">
-                <div class="stat-header">
-                    <span class="stat-icon">💊</span>
-                    <span class="stat-title">Avg Medications</span>
-                </div>
-                <div class="stat-value" id="avgMeds">-</div>
-                <div class="stat-description">Per patient visit</div>
-            </div>
-
-            <div class="stat-card">
-                <div class="stat-header">
-                    <span class="stat-icon">🧪</span>
-                    <span class="stat-title">Avg Lab Tests</span>
-                </div>
-                <div class="stat-value" id="avgLabs">-</div>
-                <div class="stat-description">Per patient visit</div>
-            </div>
-        </div>
-
-        <div class="chart-container">
-            <div class="chart-title">📊 Patient Readmission Analysis</div>
-            <div id="readmissionChart">
-                <div class="loading">
-                    <div class="loading-spinner"></div>
-                    Loading readmission data...
-                </div>
-            </div>
-        </div>
-
-        <div class="footer">
-            <p>Healthcare Analytics Dashboard • Real-time MongoDB Integration</p>
-        </div>
-    </div>
-
-    <script>
-        // API call to get statistics
-        async function loadDashboardData() {
-            try {
-                const response = await fetch('/api/stats');
-                if (!response.ok) {
-                    throw new Error(`HTTP error! status: ${response.status}`);
-                }
-                const data = await response.json();
-                
-                // Update basic stats
-                document.getElementById('totalPatients').textContent = data.total_patients?.toLocaleString() || '0';
-                document.getElementById('avgStay').textContent = (data.averages?.avg_stay || 0) + ' days';
-                document.getElementById('avgMeds').textContent = data.averages?.avg_meds || '0';
-                document.getElementById('avgLabs').textContent = data.averages?.avg_labs || '0';
-                
-                // Create readmission chart
-                createReadmissionChart(data.readmission_stats || []);
-                
-            } catch (error) {
-                console.error('Error loading dashboard data:', error);
-                showError('Failed to load dashboard data: ' + error.message);
-            }
-        }
-
-        function createReadmissionChart(readmissionStats) {
-            const chartContainer = document.getElementById('readmissionChart');
-            
-            if (!readmissionStats || readmissionStats.length === 0) {
-                chartContainer.innerHTML = '<div class="error">No readmission data available</div>';
-                return;
-            }
-
-            // Calculate total for percentages
-            const total = readmissionStats.reduce((sum, item) => sum + item.count, 0);
-            
-            // Map readmission values to labels
-            const readmissionLabels = {
-                'NO': 'No Readmission',
-                '<30': 'Within 30 Days',
-                '>30': 'After 30 Days'
-            };
-
-            // Create bars HTML
-            let barsHTML = '<div class="readmission-bars">';
-            
-            readmissionStats.forEach((item, index) => {
-                const percentage = ((item.count / total) * 100).toFixed(1);
-                const height = (item.count / Math.max(...readmissionStats.map(s => s.count))) * 150;
-                const colors = ['#667eea', '#f093fb', '#4facfe'];
-                const color = colors[index % colors.length];
-                
-                barsHTML += `
-                    <div class="bar">
-                        <div class="bar-fill" style="height: ${height}px; background: ${color};">
-                            ${item.count}
-                        </div>
-                        <div class="bar-label">
-                            ${readmissionLabels[item._id] || item._id}<br>
-                            <small>${percentage}%</small>
-                        </div>
-                    </div>
-                `;
-            });
-            
-            barsHTML += '</div>';
-            chartContainer.innerHTML = barsHTML;
-        }
-
-        function showError(message) {
-            const chartContainer = document.getElementById('readmissionChart');
-            chartContainer.innerHTML = `<div class="error">${message}</div>`;
-            
-            // Reset stats to show error state
-            ['totalPatients', 'avgStay', 'avgMeds', 'avgLabs'].forEach(id => {
-                document.getElementById(id).textContent = 'Error';
-            });
-        }
-
-        // Load data when page loads
-        document.addEventListener('DOMContentLoaded', function() {
-            loadDashboardData();
-            
-            // Refresh data every 30 seconds
-            setInterval(loadDashboardData, 30000);
-        });
-
-        // Test connection on page load
-        fetch('/test')
-            .then(response => response.json())
-            .then(data => {
-                console.log('Flask connection test:', data);
-            })
-            .catch(error => {
-                console.error('Connection test failed:', error);
-            });
-    </script>
-</body>
-</html>
-'''
-
-# MongoDB connection with error handling
-try:
-    client = MongoClient('mongodb://localhost:27017/', serverSelectionTimeoutMS=5000)
-    # Test the connection
-    client.server_info()
-    db = client['diabetes_project']
-    collection = db['patient_data']
-    print("✅ MongoDB connection successful")
-except Exception as e:
-    print(f"❌ MongoDB connection failed: {e}")
-    collection = None
+# Shared response cache for API endpoints
+response_cache = ResponseCache(max_entries=128, ttl=10, stale_ttl=60)
+
+def prepare_database(retry_seconds=30):
+    """Probe MongoDB and create indexes off the startup path, retrying until it is up"""
+    while True:
+        if ping():
+            print("✅ MongoDB connection successful")
+            try:
+                # Create or verify the indexes the API and analysis queries rely on
+                for index_name in ensure_indexes(get_collection()):
+                    print(f"🗂️  Created index {index_name}")
+            except Exception as e:
+                print(f"❌ Index setup failed: {e}")
+            try:
+                # Build or catch up the cube so the first drill-down does not pay for it
+                with query_label("api_cube"):
+                    current_cube(get_collection())
+            except Exception as e:
+                print(f"❌ Cube setup failed: {e}")
+            try:
+                # Same for the timelines: /api/stats only reads their stored patient count
+                with query_label("api_patients"):
+                    patients.refresh_timelines(get_collection())
+            except Exception as e:
+                print(f"❌ Timeline setup failed: {e}")
+            try:
+                # Backfill dx_* arrays for encounters loaded by older tools; GETs only read them
+                with query_label("api_diagnoses"):
+                    indexed = diagnoses.index_diagnoses(get_collection())
+                if indexed:
+                    print(f"✅ Diagnosis groups indexed on {indexed:,} encounters")
+            except Exception as e:
+                print(f"❌ Diagnosis backfill failed: {e}")
+            return
+        print(f"❌ MongoDB not reachable, retrying in {retry_seconds}s (requests reconnect on their own)")
+        time.sleep(retry_seconds)
+
+_prepared = False
+_prepare_lock = threading.Lock()
+
+def start_prepare_database(background=True):
+    """Run prepare_database once per process, on a daemon thread unless background=False"""
+    global _prepared
+    with _prepare_lock:
+        if _prepared:
+            return
+        _prepared = True
+    if background:
+        threading.Thread(target=prepare_database, daemon=True).start()
+    else:
+        prepare_database()
+
+@app.before_request
+def prepare_on_first_request():
+    # Not at import time, so importing the app (tests, benchmarks, WSGI servers) never
+    # spawns threads; the first request of a process that did not start it does
+    start_prepare_database()
 
 @app.route('/')
 def dashboard():
     """Main dashboard page"""
     return render_template_string(DASHBOARD_HTML)
 
+def compute_stats():
+    # Labels are set here because the cache may call this from a background thread
+    with query_label("api_stats"):
+        collection = get_collection()
+        stats = read_stats(refresh_rollup(collection))
+        # total_patients counts encounters; this is the number of distinct patient_nbr,
+        # as stored (None before the first build), while the timelines catch up in the background
+        stats["unique_patients"] = patients.unique_patients(patients.timeline_meta(collection))
+        refresh_timelines_in_background()
+        return stats
+
+_timeline_refresh = threading.Lock()
+
+def refresh_timelines_in_background():
+    """Fold new encounters into the timelines off the request path, one refresh at a time"""
+    if not _timeline_refresh.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            with query_label("api_patients"):
+                patients.refresh_timelines(get_collection())
+        except Exception as e:
+            print(f"❌ Timeline refresh failed: {e}")
+        finally:
+            _timeline_refresh.release()
+
+    threading.Thread(target=run, daemon=True).start()
+
+def stats_version():
+    with query_label("api_stats.data_version"):
+        collection = get_collection()
+        # The timeline version moves when a background refresh changes the patient count
+        return f"{data_version(collection)}:{patients.timeline_meta(collection).get('version')}"
+
 @app.route('/api/stats')
 def get_stats():
     """API endpoint for basic statistics"""
     try:
-        if collection is None:
-            return jsonify({"error": "Database connection not available"}), 500
-            
-        # Total patients
-        total_patients = collection.count_documents({})
-        
-        # Readmission rates
-        readmission_pipeline = [
-            {"$group": {
-                "_id": "$readmitted", 
-                "count": {"$sum": 1}
-            }}
-        ]
-        readmission_stats = list(collection.aggregate(readmission_pipeline))
-        
-        # Average metrics - with error handling for empty collection
-        avg_pipeline = [
-            {"$group": {
-                "_id": None,
-                "avg_stay": {"$avg": "$time_in_hospital"},
-                "avg_meds": {"$avg": "$num_medications"},
-                "avg_labs": {"$avg": "$num_lab_procedures"}
-            }}
-        ]
-        avg_result = list(collection.aggregate(avg_pipeline))
-        
-        if avg_result:
-            avg_stats = avg_result[0]
-            averages = {
-                "avg_stay": round(avg_stats.get('avg_stay', 0) or 0, 1),
-                "avg_meds": round(avg_stats.get('avg_meds', 0) or 0, 1),
-                "avg_labs": round(avg_stats.get('avg_labs', 0) or 0, 1)
-            }
-        else:
-            averages = {
-                "avg_stay": 0,
-                "avg_meds": 0,
-                "avg_labs": 0
-            }
-        
-        return jsonify({
-            "total_patients": total_patients,
-            "readmission_stats": readmission_stats,
-            "averages": averages
-        })
+        # One rollup read per data version, shared by every polling dashboard
+        return response_cache.json_response(
+            "/api/stats", compute=compute_stats, version_fn=stats_version,
+        )
         
     except Exception as e:
         print(f"Error in get_stats: {e}")
         return jsonify({"error": str(e)}), 500
 
+def fetch_live_stats():
+    """Producer-side read for the live stream, shared with polling clients via the cache"""
+    entry = response_cache.get("/api/stats", compute_stats, stats_version, label="get_stats")
+    return entry.payload, entry.etag
+
+live_stats = StatsBroadcaster(fetch_live_stats, interval=2.0)
+
+@app.route('/api/stream')
+def stream_stats():
+    """Server-sent events: a snapshot on connect, then deltas when the data changes"""
+    return Response(
+        live_stats.stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route('/api/cube')
+def get_cube():
+    """Any slice or roll-up of the precomputed cube, e.g. ?dims=age,readmitted&filter={"insulin":"Up"}"""
+    try:
+        dims, measures, filters = parse_query(
+            request.args.get("dims"), request.args.get("measures"), request.args.get("filter")
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def compute():
+        with query_label("api_cube"):
+            cube = current_cube(get_collection())
+        return {"dims": dims, "cells": cube.query(dims, measures, filters)}
+
+    try:
+        # Normalized key so equivalent query strings share a cache entry
+        key = "/api/cube?" + urlencode({
+            "dims": ",".join(dims),
+            "measures": ",".join(measures or []),
+            "filter": json.dumps(filters, sort_keys=True),
+        })
+        return response_cache.json_response(key, compute=compute, version_fn=stats_version)
+    except Exception as e:
+        print(f"Error in get_cube: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/diagnoses')
+def get_diagnoses():
+    """Readmission rate and stay by ICD-9 diagnosis, e.g. ?level=category&parent=Circulatory&position=any"""
+    try:
+        level, position, parent = diagnoses.parse_query(
+            request.args.get("level"), request.args.get("position"), request.args.get("parent")
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def compute():
+        # Read-only: dx_* arrays are stored by ingest, synthetic seeding and prepare_database
+        rows = diagnoses.diagnosis_analysis(get_collection(), level, position, parent)
+        return {"level": level, "position": position, "parent": parent, "groups": rows}
+
+    try:
+        key = "/api/diagnoses?" + urlencode({"level": level, "position": position, "parent": parent or ""})
+        return response_cache.json_response(key, compute=compute, version_fn=stats_version)
+    except Exception as e:
+        print(f"Error in get_diagnoses: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/distributions')
+def get_distributions():
+    """Percentiles and equal-frequency buckets from quantile sketches, e.g. ?measure=labs&by=age&percentiles=50,90"""
+    try:
+        measure, by, percentiles, buckets = sketches.parse_query(
+            request.args.get("measure"), request.args.get("by"),
+            request.args.get("percentiles"), request.args.get("buckets"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def compute():
+        with query_label("api_distributions"):
+            current = sketches.current_sketches(get_collection())
+        groups = sketches.distribution(current, measure, by, percentiles, buckets)
+        return {"measure": measure, "by": by, "groups": groups}
+
+    try:
+        key = "/api/distributions?" + urlencode({
+            "measure": measure, "by": by or "",
+            "percentiles": ",".join(f"{p:g}" for p in percentiles), "buckets": buckets,
+        })
+        return response_cache.json_response(key, compute=compute, version_fn=stats_version)
+    except Exception as e:
+        print(f"Error in get_distributions: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/export')
+def export_encounters():
+    """Encounters as NDJSON, e.g. ?fields=patient_nbr,age&filter={"readmitted":"<30"}&sort=-time_in_hospital
+
+    A page ends with {"next": cursor} when more rows follow; pass it back as ?after=.
+    """
+    try:
+        fields, query, sort_key, direction, after, limit = export.parse_query(
+            request.args.get("fields"), request.args.get("filter"), request.args.get("sort"),
+            request.args.get("after"), request.args.get("limit"),
+        )
+        with query_label("api_export"):
+            cursor = export.open_export(get_collection(), fields, query, sort_key, direction, after, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error in export_encounters: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    def generate():
+        try:
+            yield from export.ndjson_lines(cursor, fields, sort_key, limit)
+        finally:
+            # Frees the server-side cursor when the client disconnects mid-page
+            cursor.close()
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route('/api/patients')
+def get_patient_summary():
+    """Unique and repeat patient counts from the timeline index"""
+    def compute():
+        with query_label("api_patients"):
+            summary = patients.patient_summary(get_collection(), refresh=False)
+        refresh_timelines_in_background()
+        return summary
+
+    try:
+        return response_cache.json_response("/api/patients", compute=compute, version_fn=stats_version)
+    except Exception as e:
+        print(f"Error in get_patient_summary: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/patients/<int:patient_nbr>')
+def get_patient(patient_nbr):
+    """One patient's encounters in order, with readmission chains"""
+    try:
+        with query_label("api_patient"):
+            # Read as stored: new encounters are folded in off the request path
+            timeline = patients.patient_timeline(get_collection(), patient_nbr)
+        refresh_timelines_in_background()
+        if timeline is None:
+            return jsonify({"error": f"No encounters for patient {patient_nbr}"}), 404
+        return jsonify(timeline)
+    except Exception as e:
+        print(f"Error in get_patient: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/test')
 def test():
     """Test endpoint to verify Flask is running"""
-    return jsonify({"status": "Flask is running", "mongodb_connected": collection is not None})
+    return jsonify({"status": "Flask is running", "mongodb_connected": is_healthy()})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics for every instrumented MongoDB call"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == '__main__':
     print("🚀 Starting Flask dashboard...")
     print("📊 Open http://localhost:5000 in your browser")
     print("🔍 Test API at http://localhost:5000/test")
     print("📈 Stats API at http://localhost:5000/api/stats")
+    print("📡 Live stream at http://localhost:5000/api/stream")
+    print("🧊 Cube API at http://localhost:5000/api/cube?dims=age,readmitted")
+    print("🩺 Diagnosis API at http://localhost:5000/api/diagnoses?level=group")
+    print("📐 Distribution API at http://localhost:5000/api/distributions?measure=stay&by=age")
+    print("📤 NDJSON export at http://localhost:5000/api/export?fields=patient_nbr,age,readmitted")
+    print("🧑 Patient API at http://localhost:5000/api/patients")
+    print("📏 Metrics at http://localhost:5000/metrics")
+    start_prepare_database()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""
+Async (ASGI) serving mode for the dashboard API
+Same endpoints as app.py, served by Quart with pymongo's AsyncMongoClient
+
+Run with:  hypercorn async_app:app --bind 0.0.0.0:5001
+"""
+import asyncio
+
+from pymongo import AsyncMongoClient
+from quart import Quart, jsonify, render_template_string, request
+
+from compact import DICTIONARY_COLLECTION, CompactCollection, Dictionary
+from connection import cached_dictionary, client_options, dictionary_due, remember_dictionary, settings
+from dashboard import DASHBOARD_HTML
+from response_cache import ResponseCache, data_version_async
+from rollups import refresh_rollup_async, read_stats
+
+app = Quart(__name__)
+# Same policy as app.py: polling dashboards share one rollup read per data version
+response_cache = ResponseCache(max_entries=128, ttl=10, stale_ttl=60)
+
+client = None
+collection = None
+decoded = None
+
+
+@app.before_serving
+async def connect():
+    """Create the client when the server starts; it connects on first use"""
+    global client, collection
+    config = settings()
+    client = AsyncMongoClient(config["uri"], **client_options())
+    collection = client[config["database"]][config["collection"]]
+
+
+async def patient_collection():
+    """The collection behind the compact-schema decoding layer, set up on first use
+
+    The dictionary is re-read on the same TTL as connection.get_collection() uses.
+    """
+    global decoded
+    if dictionary_due(collection.name):
+        cursor = collection.database[DICTIONARY_COLLECTION].find({"collection": collection.name})
+        remember_dictionary(collection.name, Dictionary.from_documents(await cursor.to_list(None)))
+    if decoded is None:
+        decoded = CompactCollection(collection, lambda: cached_dictionary(collection.name))
+    return decoded
+
+
+@app.after_serving
+async def disconnect():
+    if client is not None:
+        await client.close()
+
+
+@app.after_request
+async def allow_cors(response):
+    # Mirrors flask_cors in app.py
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
+@app.route('/')
+async def dashboard():
+    """Main dashboard page"""
+    return await render_template_string(DASHBOARD_HTML)
+
+
+@app.route('/api/stats')
+async def get_stats():
+    """API endpoint for basic statistics"""
+    async def compute():
+        return read_stats(await refresh_rollup_async(await patient_collection()))
+
+    async def version():
+        return await data_version_async(collection)
+
+    try:
+        entry = await response_cache.get_async("/api/stats", compute, version, label="get_stats")
+        response = jsonify(entry.payload)
+        response.set_etag(entry.etag)
+        response.headers["Cache-Control"] = response_cache.cache_control()
+        return await response.make_conditional(request)
+    except Exception as e:
+        print(f"Error in get_stats: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/test')
+async def test():
+    """Test endpoint to verify the server is running"""
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), timeout=2)
+        connected = True
+    except Exception:
+        connected = False
+    return jsonify({"status": "Quart is running", "mongodb_connected": connected})
+
+
+if __name__ == '__main__':
+    print("🚀 Starting async dashboard...")
+    print("📊 Open http://localhost:5001 in your browser")
+    app.run(host='0.0.0.0', port=5001)
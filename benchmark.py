@@ -0,0 +1,200 @@
+"""
+Benchmark runner for every query in the project
+Times each analysis against a local mongod (or an in-process stand-in) and emits JSON
+that can be compared between commits to catch performance regressions
+
+Usage:
+    python benchmark.py --generate 1000000 --output bench.json
+    python benchmark.py --output new.json --compare bench.json
+    python benchmark.py --stand-in --generate 20000        # mongomock, no server needed
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import connection
+
+CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py")
+
+
+def _quiet(fn):
+    """Wrap an analysis so its printed report does not distort the timing output"""
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn()
+    return run
+
+
+def build_benchmarks():
+    """name -> zero-argument callable; modules are imported after the client is set up"""
+    import analyze_data
+    import specific_queries
+    from advanced_analysis import AdvancedDiabetesAnalysis
+    import app as web
+    from rollups import rebuild_rollup, reset_rollup
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        analyzer = AdvancedDiabetesAnalysis()
+    client = web.app.test_client()
+    # Fold freshly generated encounters in now, so the rollup is not still counting them live
+    rebuild_rollup(connection.get_collection())
+
+    def api_stats_response_cache_cleared():
+        # Still reads the maintained rollup, so this is the per-data-version cost
+        web.response_cache.clear()
+        client.get("/api/stats")
+
+    def api_stats_rollup_reset():
+        # Nothing precomputed: the request folds the whole collection into a new summary
+        web.response_cache.clear()
+        reset_rollup(connection.get_collection())
+        client.get("/api/stats")
+
+    def api_stats_cached():
+        client.get("/api/stats")
+
+    return {
+        "specific_queries.question_1_long_stay_patients": specific_queries.question_1_long_stay_patients,
+        "specific_queries.question_2_readmission_by_age": specific_queries.question_2_readmission_by_age,
+        "specific_queries.question_3_medication_analysis": specific_queries.question_3_medication_analysis,
+        "specific_queries.question_4_insulin_impact": specific_queries.question_4_insulin_impact,
+        "specific_queries.question_5_race_analysis": specific_queries.question_5_race_analysis,
+        "advanced_analysis.predict_readmission_risk": analyzer.predict_readmission_risk,
+        "advanced_analysis.analyze_medication_impact": analyzer.analyze_medication_impact,
+        "advanced_analysis.age_group_analysis": analyzer.age_group_analysis,
+        "advanced_analysis.generate_summary_report": analyzer.generate_summary_report,
+        "analyze_data.basic_statistics": analyze_data.basic_statistics,
+        "app./api/stats (response cache cleared)": api_stats_response_cache_cleared,
+        "app./api/stats (rollup reset)": api_stats_rollup_reset,
+        "app./api/stats (cached)": api_stats_cached,
+        # A fresh interpreter each time: imports and argument parsing, no queries
+        "cli cold start (--help)": lambda: _cold_start("--help"),
+        "cli cold start (list)": lambda: _cold_start("list"),
+    }
+
+
+def _cold_start(*args):
+    subprocess.run([sys.executable, CLI, *args], check=True, stdout=subprocess.DEVNULL)
+
+
+def time_call(fn, repeat, warmup):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {
+        "min_s": min(samples),
+        "median_s": statistics.median(samples),
+        "mean_s": statistics.mean(samples),
+        "max_s": max(samples),
+        "repeat": repeat,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def run_benchmarks(repeat=5, warmup=1, only=None):
+    benchmarks = build_benchmarks()
+    results = {}
+    for name, fn in benchmarks.items():
+        if only and not any(pattern in name for pattern in only):
+            continue
+        try:
+            results[name] = time_call(_quiet(fn), repeat, warmup)
+        except Exception as e:
+            results[name] = {"error": str(e)}
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "documents": connection.get_collection().estimated_document_count(),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """Print median ratios against a baseline and return the regressed query names"""
+    regressions = []
+    print(f"\n{'query':<55} {'base ms':>9} {'new ms':>9} {'ratio':>7}")
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+        if not old or "median_s" not in old or "median_s" not in result:
+            continue
+        ratio = result["median_s"] / old["median_s"] if old["median_s"] else float("inf")
+        flag = "  ⚠️" if ratio > 1 + threshold else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<55} {old['median_s'] * 1000:>9.1f} {result['median_s'] * 1000:>9.1f} {ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every analysis query")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--only", nargs="*", help="substrings of benchmark names to run")
+    parser.add_argument("--generate", type=int, default=0,
+                        help="replace the collection with N synthetic encounters first")
+    parser.add_argument("--stand-in", action="store_true",
+                        help="run against an in-process mongomock client")
+    parser.add_argument("--output", default=None, help="write JSON results here")
+    parser.add_argument("--compare", default=None, help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="median slowdown counted as a regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    # Every sample must run its queries; a result cache hit would time a file read
+    os.environ["DIABETES_RESULT_CACHE"] = "off"
+    if args.stand_in:
+        import mongomock
+        connection.use_client(mongomock.MongoClient())
+
+    if args.generate:
+        from synthetic import seed_collection
+        print(f"🧪 Seeding {args.generate:,} synthetic encounters...")
+        seed_collection(connection.get_collection(), args.generate, reset=True)
+
+    print("⏱️  Running benchmarks...")
+    report = run_benchmarks(args.repeat, args.warmup, args.only)
+    for name, result in report["results"].items():
+        if "error" in result:
+            print(f"   ❌ {name}: {result['error']}")
+        else:
+            print(f"   {name:<55} {result['median_s'] * 1000:>9.1f} ms (median)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
+        print("\n✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
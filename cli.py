@@ -0,0 +1,250 @@
+"""
+diabetes-analytics: one command line for every analysis and tool in the project
+Modules (and with them pymongo, numpy and pyarrow) are imported only when a subcommand
+runs, so --help, list and quick queries start fast; nothing connects until a query does
+
+Usage:
+    python cli.py list
+    python cli.py summary --json
+    python cli.py run long-stays insulin race --jobs 3
+    python cli.py all --jobs 4 --json > report.json
+    python cli.py report --backend numpy --timing
+    python cli.py ingest diabetic_data.csv --workers 8
+"""
+import argparse
+import importlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+PROG = "diabetes-analytics"
+
+# name -> (module, function, description); advanced_analysis functions are methods of
+# one AdvancedDiabetesAnalysis shared by every analysis in the run
+ANALYSES = {
+    "summary": ("analyze_data", "basic_statistics", "Encounters, readmission split and average stay"),
+    "long-stays": ("specific_queries", "question_1_long_stay_patients", "Ten longest hospital stays"),
+    "readmission-by-age": ("specific_queries", "question_2_readmission_by_age", "Readmission rate per age group"),
+    "medications": ("specific_queries", "question_3_medication_analysis", "Medication count distribution"),
+    "insulin": ("specific_queries", "question_4_insulin_impact", "Readmission rate by insulin use"),
+    "race": ("specific_queries", "question_5_race_analysis", "Stay, medications and labs by race"),
+    "readmission-risk": ("advanced_analysis", "predict_readmission_risk", "Averages per readmission outcome"),
+    "medication-impact": ("advanced_analysis", "analyze_medication_impact", "Readmission by medication range"),
+    "age-groups": ("advanced_analysis", "age_group_analysis", "Readmission, medications and stay by age"),
+    "report": ("advanced_analysis", "generate_summary_report", "The full advanced summary report"),
+    "explore": ("explore_data", "explore", "Check the MongoDB connection and count encounters"),
+}
+# `all` skips report (it repeats the advanced sections) and the connectivity check
+ALL = [name for name in ANALYSES if name not in ("report", "explore")]
+
+# name -> (module, description); the rest of the command line goes to the module's main()
+TOOLS = {
+    "ingest": ("ingest", "Load diabetic_data.csv into MongoDB"),
+    "synthetic": ("synthetic", "Generate synthetic encounters"),
+    "snapshot": ("snapshot", "Write or query a Parquet snapshot"),
+    "csv": ("csv_engine", "Run the summary report straight from a CSV file"),
+    "rollup": ("rollups", "Refresh the patient_stats rollup"),
+    "cube": ("cube", "Refresh or query the pre-aggregated cube"),
+    "estimate": ("sampling", "Approximate answers from a sample"),
+    "diagnoses": ("diagnoses", "Diagnosis group analysis"),
+    "co-prescription": ("medications", "Medication co-prescription analysis"),
+    "patients": ("patients", "Patient timelines and readmission chains"),
+    "distributions": ("sketches", "Quantiles from the distribution sketches"),
+    "export": ("export", "Export encounters as NDJSON"),
+    "indexes": ("indexes", "Create the query indexes"),
+    "compact": ("compact", "Compact the collection's storage"),
+    "partitioned": ("partitioned", "Compare single and partitioned pipelines"),
+    "benchmark": ("benchmark", "Benchmark every analysis query"),
+    "loadtest": ("loadtest", "Simulate dashboard viewers against app.py"),
+    "compare-servers": ("compare_servers", "Compare app.py and async_app.py"),
+}
+
+
+class ThreadOutput:
+    """sys.stdout stand-in that sends each job thread's prints to that job's buffer"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffers = {}
+
+    def capture(self):
+        buffer = io.StringIO()
+        self.buffers[threading.get_ident()] = buffer
+        return buffer
+
+    def release(self):
+        return self.buffers.pop(threading.get_ident()).getvalue()
+
+    def write(self, text):
+        buffer = self.buffers.get(threading.get_ident())
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Runner:
+    """Runs analyses by name, importing each module on first use"""
+
+    def __init__(self, backend="mongo"):
+        self.backend = backend
+        self._analyzer = None
+        self._lock = threading.Lock()
+
+    def analyzer(self):
+        with self._lock:
+            if self._analyzer is None:
+                from advanced_analysis import AdvancedDiabetesAnalysis
+                # Strict, so a failing section reaches the outcome and the exit status
+                self._analyzer = AdvancedDiabetesAnalysis(self.backend, strict=True)
+            return self._analyzer
+
+    def function(self, name):
+        module, attribute, _ = ANALYSES[name]
+        if module == "advanced_analysis":
+            return getattr(self.analyzer(), attribute)
+        return getattr(importlib.import_module(module), attribute)
+
+    def run(self, name, output=None):
+        """{"result", "error", "seconds"} for one analysis, plus its prints when output captures them"""
+        if output is not None:
+            output.capture()
+        started = time.perf_counter()
+        try:
+            outcome = {"result": self.function(name)(), "error": None}
+        except Exception as e:
+            outcome = {"result": None, "error": f"{type(e).__name__}: {e}"}
+        outcome["seconds"] = time.perf_counter() - started
+        if output is not None:
+            outcome["output"] = output.release()
+        return outcome
+
+
+def run_analyses(names, jobs=1, backend="mongo", capture=False):
+    """name -> outcome, in the order given; prints stream straight through unless captured"""
+    runner = Runner(backend)
+    if jobs <= 1 and not capture:
+        return {name: runner.run(name) for name in names}
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    stdout = sys.stdout
+    # Prints from other threads (e.g. slow-query explains) must not land inside JSON output
+    output = ThreadOutput(sys.stderr if capture else stdout)
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            futures = {name: pool.submit(runner.run, name, output) for name in names}
+            return {name: future.result() for name, future in futures.items()}
+    finally:
+        sys.stdout = stdout
+
+
+def print_outcomes(outcomes, timing=False):
+    for name, outcome in outcomes.items():
+        # Captured output is replayed in request order, whatever order the jobs finished in
+        sys.stdout.write(outcome.get("output", ""))
+        if outcome["error"] is not None:
+            print(f"❌ {name} failed: {outcome['error']}")
+        if timing:
+            print(f"⏱️  {name}: {outcome['seconds'] * 1000:.1f} ms")
+
+
+def print_json(outcomes, backend):
+    report = {
+        "backend": backend,
+        "analyses": {
+            name: {key: outcome[key] for key in ("result", "error", "seconds")}
+            for name, outcome in outcomes.items()
+        },
+    }
+    print(json.dumps(report, indent=2, default=str))
+
+
+def run_tool(name, argv):
+    """Hand the remaining arguments to the tool module's own main()"""
+    module, _ = TOOLS[name]
+    sys.argv = [f"{PROG} {name}"] + list(argv)
+    importlib.import_module(module).main()
+
+
+def list_commands():
+    print("Analyses (python cli.py <name> | run <name>... | all):")
+    for name, (_, _, description) in ANALYSES.items():
+        print(f"   {name:<20} {description}")
+    print("\nTools (python cli.py <tool> --help for their options):")
+    for name, (_, description) in TOOLS.items():
+        print(f"   {name:<20} {description}")
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--json", action="store_true", help="print results as JSON instead of the report")
+    common.add_argument("--jobs", type=int, default=1, help="analyses to run concurrently")
+    common.add_argument("--backend", choices=["mongo", "numpy", "partitioned"], default="mongo",
+                        help="engine for the advanced analyses")
+    common.add_argument("--timing", action="store_true", help="print each analysis's wall time")
+    common.add_argument("--uri", default=None, help="overrides DIABETES_MONGO_URI")
+    common.add_argument("--csv", default=None, help="read this CSV file instead of MongoDB")
+    common.add_argument("--snapshot", default=None, help="read this Parquet snapshot instead of MongoDB")
+    common.add_argument("--no-cache", action="store_true", help="skip the on-disk result cache")
+
+    parser = argparse.ArgumentParser(prog=PROG, description="Diabetes readmission analytics")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.add_parser("list", help="list every analysis and tool")
+    run = commands.add_parser("run", parents=[common], help="run the named analyses")
+    run.add_argument("names", nargs="+", choices=list(ANALYSES), metavar="name")
+    commands.add_parser("all", parents=[common], help=f"run {', '.join(ALL)}")
+    for name, (_, _, description) in ANALYSES.items():
+        commands.add_parser(name, parents=[common], help=description)
+    for name, (_, description) in TOOLS.items():
+        commands.add_parser(name, help=description, add_help=False)
+    return parser
+
+
+def configure_source(args):
+    """Point the analyses at their data before any module that reads it is imported"""
+    if args.csv:
+        os.environ["DIABETES_CSV"] = args.csv
+    if args.snapshot:
+        os.environ["DIABETES_SNAPSHOT"] = args.snapshot
+    if args.no_cache:
+        os.environ["DIABETES_RESULT_CACHE"] = "off"
+    if args.uri:
+        from connection import configure
+        configure(uri=args.uri)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in TOOLS:
+        return run_tool(argv[0], argv[1:])
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return
+    if args.command == "list":
+        list_commands()
+        return
+
+    names = args.names if args.command == "run" else ALL if args.command == "all" else [args.command]
+    configure_source(args)
+    outcomes = run_analyses(names, args.jobs, args.backend, capture=args.json)
+    if args.json:
+        print_json(outcomes, args.backend)
+    else:
+        print_outcomes(outcomes, args.timing)
+    if any(outcome["error"] is not None for outcome in outcomes.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+In-memory columnar engine for the advanced analyses
+Loads the needed columns once into NumPy arrays and answers with vectorized group-bys
+"""
+import numpy as np
+
+from advanced_analysis import READMITTED_VALUES
+
+CATEGORICAL_FIELDS = ["age", "readmitted", "insulin"]
+NUMERIC_FIELDS = ["time_in_hospital", "num_medications", "num_lab_procedures"]
+MEDICATION_BOUNDARIES = [0, 5, 10, 15, 20, 100]
+MEDICATION_DEFAULT = "20+"
+
+
+def _bson_sort_key(value):
+    # Null sorts before numbers, numbers before strings, like MongoDB's $sort
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    return (2, str(value))
+
+
+def _to_number(value):
+    # $avg skips anything that is not a number
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return np.nan
+
+
+def _python(value):
+    """Convert NumPy scalars so results compare equal to the Mongo backend's"""
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    return value
+
+
+class Categorical:
+    """Small-integer codes plus the dictionary of labels they stand for"""
+
+    def __init__(self, raw_values):
+        labels = sorted(set(raw_values), key=_bson_sort_key)
+        lookup = {label: code for code, label in enumerate(labels)}
+        dtype = np.uint8 if len(labels) <= 256 else np.uint16
+        self.labels = labels
+        self.codes = np.fromiter((lookup[v] for v in raw_values), dtype=dtype, count=len(raw_values))
+
+    def mask_in(self, values):
+        """Boolean mask of rows whose label is one of values"""
+        wanted = [code for code, label in enumerate(self.labels) if label in values]
+        return np.isin(self.codes, wanted)
+
+
+class ColumnarStore:
+    def __init__(self, columns, numeric):
+        self.columns = columns
+        self.numeric = numeric
+        self.size = len(next(iter(numeric.values()))) if numeric else 0
+
+    @classmethod
+    def from_collection(cls, collection, batch_size=10000):
+        """Single projected pass over the collection"""
+        projection = {field: 1 for field in CATEGORICAL_FIELDS + NUMERIC_FIELDS}
+        projection["_id"] = 0
+
+        raw = {field: [] for field in CATEGORICAL_FIELDS}
+        numeric = {field: [] for field in NUMERIC_FIELDS}
+        for doc in collection.find({}, projection, batch_size=batch_size):
+            for field in CATEGORICAL_FIELDS:
+                raw[field].append(doc.get(field))
+            for field in NUMERIC_FIELDS:
+                numeric[field].append(_to_number(doc.get(field)))
+
+        columns = {field: Categorical(values) for field, values in raw.items()}
+        arrays = {field: np.asarray(values, dtype=np.float64) for field, values in numeric.items()}
+        return cls(columns, arrays)
+
+    def _group_mean(self, codes, field, groups):
+        values = self.numeric[field]
+        valid = ~np.isnan(values)
+        sums = np.bincount(codes[valid], weights=values[valid], minlength=groups)
+        counts = np.bincount(codes[valid], minlength=groups)
+        return [float(s / c) if c else None for s, c in zip(sums, counts)]
+
+    def _readmitted_flags(self):
+        return self.columns["readmitted"].mask_in(READMITTED_VALUES)
+
+    def predict_readmission_risk(self, mask=None):
+        readmitted = self.columns["readmitted"]
+        rows = readmitted.mask_in(["YES", "NO"])
+        if mask is not None:
+            rows &= mask
+
+        groups = len(readmitted.labels)
+        codes = readmitted.codes.astype(np.intp)
+        # Rows outside the $match go to an extra trailing group that is dropped
+        codes = np.where(rows, codes, groups)
+        counts = np.bincount(codes, minlength=groups + 1)[:groups]
+        avg_meds = self._group_mean(codes, "num_medications", groups + 1)
+        avg_stay = self._group_mean(codes, "time_in_hospital", groups + 1)
+        avg_labs = self._group_mean(codes, "num_lab_procedures", groups + 1)
+
+        results = [
+            {
+                "_id": readmitted.labels[code],
+                "avg_medications": avg_meds[code],
+                "avg_stay": avg_stay[code],
+                "avg_lab_procedures": avg_labs[code],
+                "patient_count": int(counts[code]),
+            }
+            for code in range(groups) if counts[code]
+        ]
+        results.sort(key=lambda r: -r["patient_count"])
+        return results
+
+    def analyze_medication_impact(self, mask=None):
+        meds = self.numeric["num_medications"]
+        boundaries = np.asarray(MEDICATION_BOUNDARIES, dtype=np.float64)
+        buckets = len(MEDICATION_BOUNDARIES) - 1
+
+        # searchsorted puts values in [b[i], b[i+1]) at i; out-of-range and
+        # non-numeric values land in the default bucket at index `buckets`
+        codes = np.searchsorted(boundaries, meds, side="right") - 1
+        outside = np.isnan(meds) | (meds < boundaries[0]) | (meds >= boundaries[-1])
+        codes = np.where(outside, buckets, codes).astype(np.intp)
+        if mask is not None:
+            codes = np.where(mask, codes, buckets + 1)
+
+        counts = np.bincount(codes, minlength=buckets + 2)
+        readmitted = np.bincount(codes, weights=self._readmitted_flags(), minlength=buckets + 2)
+        avg_stay = self._group_mean(codes, "time_in_hospital", buckets + 2)
+
+        results = []
+        for code in range(buckets + 1):
+            if not counts[code]:
+                continue
+            label = MEDICATION_DEFAULT if code == buckets else MEDICATION_BOUNDARIES[code]
+            results.append({
+                "_id": label,
+                "total_patients": int(counts[code]),
+                "readmitted_count": int(readmitted[code]),
+                "avg_stay": avg_stay[code],
+            })
+        results.sort(key=lambda r: _bson_sort_key(r["_id"]))
+        return results
+
+    def age_group_analysis(self, mask=None):
+        age = self.columns["age"]
+        groups = len(age.labels)
+        codes = age.codes.astype(np.intp)
+        if mask is not None:
+            codes = np.where(mask, codes, groups)
+
+        counts = np.bincount(codes, minlength=groups + 1)
+        readmitted = np.bincount(codes, weights=self._readmitted_flags(), minlength=groups + 1)
+        avg_meds = self._group_mean(codes, "num_medications", groups + 1)
+        avg_stay = self._group_mean(codes, "time_in_hospital", groups + 1)
+
+        # Labels are already in BSON order, so no extra sort is needed
+        return [
+            {
+                "_id": age.labels[code],
+                "total_patients": int(counts[code]),
+                "readmission_rate": _python(readmitted[code] / counts[code]),
+                "avg_medications": avg_meds[code],
+                "avg_stay": avg_stay[code],
+            }
+            for code in range(groups) if counts[code]
+        ]
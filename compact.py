@@ -0,0 +1,395 @@
+"""
+Compact storage schema for patient_data
+Categorical strings are stored as small-int codes backed by a dictionary table, and missing
+values are dropped instead of stored as '?'. CompactCollection decodes on the way out, so
+queries and API responses keep their human-readable labels.
+"""
+import argparse
+import inspect
+import operator
+import threading
+import time
+
+from pymongo import ReturnDocument
+
+from connection import forget_dictionaries, get_database, settings
+from ingest import MEDICATION_FIELDS, MISSING
+from result_cache import note_writes
+
+DICTIONARY_COLLECTION = "patient_dictionary"
+# Low-cardinality string fields; diag_1..3 keep their ICD-9 strings for prefix matching
+COMPACT_FIELDS = [
+    "race", "gender", "age", "weight", "payer_code", "medical_specialty",
+    "max_glu_serum", "A1Cresult",
+] + MEDICATION_FIELDS + ["change", "diabetesMed", "readmitted"]
+
+_lock = threading.Lock()
+# Range operators, answered on coded fields as $in over the labels in range
+RANGE_OPERATORS = {"$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le}
+
+
+class Dictionary:
+    """field -> labels, where a label's code is its position in the list"""
+
+    def __init__(self, labels, table=None, name=None):
+        self.labels = {field: list(values) for field, values in labels.items()}
+        self.codes = {field: self._lookup(values) for field, values in self.labels.items()}
+        # Where the labels came from, so labels another process adds can be re-read
+        self.table = table
+        self.name = name
+
+    @staticmethod
+    def _lookup(values):
+        return {label: code for code, label in enumerate(values)}
+
+    @classmethod
+    def from_documents(cls, docs, table=None, name=None):
+        labels = {doc["field"]: doc["labels"] for doc in docs}
+        return cls(labels, table, name) if labels else None
+
+    @classmethod
+    def load(cls, collection):
+        """The dictionary of a migrated collection, or None if it was never compacted"""
+        table = collection.database[DICTIONARY_COLLECTION]
+        return cls.from_documents(table.find({"collection": collection.name}), table, collection.name)
+
+    def reload_field(self, field):
+        """Re-read one field's labels after meeting a code or label this copy lacks
+
+        Other processes append labels with grow(); returns True if any were new.
+        """
+        if self.table is None:
+            return False
+        doc = self.table.find_one({"_id": f"{self.name}.{field}"})
+        if doc is None or len(doc["labels"]) <= len(self.labels.get(field, [])):
+            return False
+        with _lock:
+            self.labels[field] = doc["labels"]
+            self.codes[field] = self._lookup(doc["labels"])
+        return True
+
+    def save(self, database, name):
+        table = database[DICTIONARY_COLLECTION]
+        for field, values in self.labels.items():
+            table.replace_one(
+                {"_id": f"{name}.{field}"},
+                {"collection": name, "field": field, "labels": values},
+                upsert=True,
+            )
+
+    def code(self, field, value):
+        """Code for a query literal; unknown labels stay as-is and match nothing"""
+        if value is None or value == MISSING:
+            # Missing values are not stored, and null matches a missing field
+            return None
+        if value not in self.codes[field] and isinstance(value, str):
+            self.reload_field(field)
+        return self.codes[field].get(value, value)
+
+    def grow(self, database, name, field, label):
+        """Append a label seen for the first time; $addToSet keeps codes stable across writers"""
+        doc = database[DICTIONARY_COLLECTION].find_one_and_update(
+            {"_id": f"{name}.{field}"},
+            {"$addToSet": {"labels": label}, "$setOnInsert": {"collection": name, "field": field}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        with _lock:
+            self.labels[field] = doc["labels"]
+            self.codes[field] = self._lookup(doc["labels"])
+        return self.codes[field][label]
+
+    def encode_document(self, doc, grow=None):
+        """Compact one document: drop missing values and swap labels for codes"""
+        encoded = {}
+        for field, value in doc.items():
+            if value is None or value == MISSING:
+                continue
+            if field in self.codes and isinstance(value, str):
+                code = self.codes[field].get(value)
+                if code is None:
+                    if grow is None:
+                        raise KeyError(f"No code for {field}={value!r}")
+                    code = grow(field, value)
+                value = code
+            encoded[field] = value
+        return encoded
+
+    def decode_document(self, doc):
+        if doc is None:
+            return None
+        for field, labels in self.labels.items():
+            value = doc.get(field)
+            if isinstance(value, int) and value >= len(labels) and self.reload_field(field):
+                labels = self.labels[field]
+            if isinstance(value, int) and 0 <= value < len(labels):
+                doc[field] = labels[value]
+        return doc
+
+    def decode_expression(self, field):
+        # Codes become labels; anything else (a missing field) passes through unchanged
+        return {"$cond": [
+            {"$isNumber": f"${field}"}, {"$arrayElemAt": [self.labels[field], f"${field}"]}, f"${field}",
+        ]}
+
+    def encode_filter(self, query):
+        """Query with label literals swapped for codes, or None if it cannot be translated"""
+        encoded = {}
+        for key, value in (query or {}).items():
+            if key in ("$and", "$or", "$nor"):
+                parts = [self.encode_filter(part) for part in value]
+                if any(part is None for part in parts):
+                    return None
+                encoded[key] = parts
+            elif key.startswith("$"):
+                # $expr and friends compare decoded values
+                return None
+            elif key not in self.codes:
+                encoded[key] = value
+            elif isinstance(value, dict) and any(op.startswith("$") for op in value):
+                operators = {}
+                ranges = {}
+                for op, operand in value.items():
+                    if op in ("$eq", "$ne"):
+                        operators[op] = self.code(key, operand)
+                    elif op in ("$in", "$nin"):
+                        operators[op] = [self.code(key, item) for item in operand]
+                    elif op == "$exists":
+                        operators[op] = operand
+                    elif op in RANGE_OPERATORS:
+                        ranges[op] = operand
+                    else:
+                        return None
+                if ranges:
+                    codes = self.codes_in_range(key, ranges)
+                    if "$in" in operators:
+                        codes = [code for code in operators["$in"] if code in codes]
+                    operators["$in"] = codes
+                encoded[key] = operators
+            else:
+                encoded[key] = self.code(key, value)
+        return encoded
+
+    def codes_in_range(self, field, ranges):
+        """Codes whose labels satisfy every {"$gt": ...} style bound, compared as labels
+
+        Codes follow first-seen order, not label order, so a range over codes would be wrong.
+        Like MongoDB, a bound only matches labels of its own type.
+        """
+        if any(isinstance(bound, str) for bound in ranges.values()):
+            self.reload_field(field)
+        return [
+            code for code, label in enumerate(self.labels[field])
+            if all(
+                isinstance(label, str) == isinstance(bound, str) and RANGE_OPERATORS[op](label, bound)
+                for op, bound in ranges.items()
+            )
+        ]
+
+    def _referenced(self, value, found):
+        if isinstance(value, str):
+            if value.startswith("$") and not value.startswith("$$"):
+                found.add(value[1:].split(".")[0])
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                found.add(key.split(".")[0])
+                self._referenced(item, found)
+        elif isinstance(value, list):
+            for item in value:
+                self._referenced(item, found)
+
+    def rewrite_pipeline(self, pipeline):
+        """Keep leading $match/$sample stages on the stored codes, then decode what the rest reads"""
+        stages = list(pipeline)
+        head = []
+        while stages and ("$match" in stages[0] or "$sample" in stages[0]):
+            if "$match" in stages[0]:
+                encoded = self.encode_filter(stages[0]["$match"])
+                if encoded is None:
+                    break
+                head.append({"$match": encoded})
+            else:
+                head.append(stages[0])
+            stages.pop(0)
+
+        found = set()
+        self._referenced(stages, found)
+        fields = [field for field in self.labels if field in found]
+        if not fields:
+            return head + stages
+        decode = {"$addFields": {field: self.decode_expression(field) for field in fields}}
+        return head + [decode] + stages
+
+
+class DecodingCursor:
+    def __init__(self, cursor, dictionary):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    def sort(self, *args, **kwargs):
+        # Coded fields sort by code, i.e. the order labels were first seen, not
+        # alphabetically; sort them in an aggregate() after decoding instead
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, limit):
+        self._cursor = self._cursor.limit(limit)
+        return self
+
+    def __iter__(self):
+        for doc in self._cursor:
+            yield self._dictionary.decode_document(doc)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class CompactCollection:
+    """Proxy that reads and writes the compact schema while callers see labels
+
+    Collections that were never migrated have no dictionary and pass straight through.
+    """
+
+    def __init__(self, collection, dictionary_fn):
+        self._collection = collection
+        self._dictionary_fn = dictionary_fn
+
+    @property
+    def dictionary(self):
+        return self._dictionary_fn()
+
+    def _filter(self, query):
+        dictionary = self.dictionary
+        if dictionary is None:
+            return query
+        encoded = dictionary.encode_filter(query)
+        if encoded is None:
+            raise ValueError(f"Filter cannot be translated to the compact schema: {query}")
+        return encoded
+
+    def rewrite_pipeline(self, pipeline):
+        dictionary = self.dictionary
+        return pipeline if dictionary is None else dictionary.rewrite_pipeline(pipeline)
+
+    def aggregate(self, pipeline, **kwargs):
+        # Decoding happens inside the pipeline, so this works for async collections too
+        return self._collection.aggregate(self.rewrite_pipeline(pipeline), **kwargs)
+
+    def find(self, filter=None, *args, **kwargs):
+        cursor = self._collection.find(self._filter(filter), *args, **kwargs)
+        dictionary = self.dictionary
+        return cursor if dictionary is None else DecodingCursor(cursor, dictionary)
+
+    def find_one(self, filter=None, *args, **kwargs):
+        result = self._collection.find_one(self._filter(filter), *args, **kwargs)
+        dictionary = self.dictionary
+        if dictionary is None:
+            return result
+        if inspect.isawaitable(result):
+            return self._decode_later(result, dictionary)
+        return dictionary.decode_document(result)
+
+    async def _decode_later(self, result, dictionary):
+        return dictionary.decode_document(await result)
+
+    def count_documents(self, filter, **kwargs):
+        return self._collection.count_documents(self._filter(filter), **kwargs)
+
+    def insert_many(self, documents, **kwargs):
+        dictionary = self.dictionary
+        if dictionary is not None:
+            database, name = self._collection.database, self._collection.name
+
+            def grow(field, label):
+                return dictionary.grow(database, name, field, label)
+
+            documents = [dictionary.encode_document(doc, grow) for doc in documents]
+        return self._collection.insert_many(documents, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+def collect_labels(collection, fields, existing=None):
+    """Every label per field in one pass; existing codes keep their positions"""
+    group = {"_id": None}
+    for field in fields:
+        group[field] = {"$addToSet": f"${field}"}
+    found = next(iter(collection.aggregate([{"$group": group}])), {})
+
+    labels = {}
+    for field in fields:
+        known = list(existing.labels.get(field, [])) if existing else []
+        new = sorted(
+            value for value in found.get(field, [])
+            if isinstance(value, str) and value != MISSING and value not in known
+        )
+        labels[field] = known + new
+    return Dictionary(labels)
+
+
+def _data_size(database, name):
+    try:
+        return database.command("collStats", name).get("size")
+    except Exception:
+        return None
+
+
+def migrate(collection, target=None, batch_size=5000, replace=False):
+    """Copy `collection` into the compact schema and return the target collection name
+
+    collection must be the raw (undecoded) collection. With replace=True the original is
+    kept as <name>_uncompacted and the compact copy takes its name.
+    """
+    database, name = collection.database, collection.name
+    target_name = target or f"{name}_compact"
+    existing = Dictionary.load(collection)
+    dictionary = collect_labels(collection, COMPACT_FIELDS, existing)
+
+    destination = database[target_name]
+    destination.drop()
+    batch = []
+    for doc in collection.find({}, batch_size=batch_size):
+        batch.append(dictionary.encode_document(doc))
+        if len(batch) == batch_size:
+            destination.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        destination.insert_many(batch, ordered=False)
+
+    if replace:
+        collection.rename(f"{name}_uncompacted")
+        destination.rename(name)
+        target_name = name
+        from indexes import ensure_indexes  # indexes imports the analysis modules
+        ensure_indexes(database[name])
+
+    dictionary.save(database, target_name)
+    forget_dictionaries()
+    # Same _ids and count as before, so only the write counter tells cached results apart
+    note_writes(database[target_name])
+    return target_name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rewrite patient_data into the compact schema")
+    parser.add_argument("--target", default=None, help="defaults to <collection>_compact")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--replace", action="store_true",
+                        help="swap the compact copy in, keeping the original as <collection>_uncompacted")
+    args = parser.parse_args()
+
+    database = get_database()
+    source = database[settings()["collection"]]
+    before = _data_size(database, source.name)
+
+    start = time.perf_counter()
+    print(f"🗜️  Compacting {source.name}...")
+    target = migrate(source, args.target, args.batch_size, args.replace)
+    after = _data_size(database, target)
+    print(f"✅ Wrote {target} in {time.perf_counter() - start:.1f}s")
+    if before and after:
+        print(f"   Data size {before / 1e6:,.1f} MB -> {after / 1e6:,.1f} MB ({after / before:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Latency/throughput comparison between the sync (app.py) and async (async_app.py) servers
+Fires the same request mix at each server and reports p50/p99 latency and requests/sec
+
+Usage:
+    python app.py                                        # sync, port 5000
+    hypercorn async_app:app --bind 0.0.0.0:5001          # async, port 5001
+    python compare_servers.py http://localhost:5000 http://localhost:5001
+"""
+import argparse
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def timed_get(url, timeout):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            ok = response.status == 200
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def run(base_url, path, requests, concurrency, timeout):
+    """Send `requests` GETs with `concurrency` in flight and summarize them"""
+    url = base_url.rstrip("/") + path
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: timed_get(url, timeout), range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, ok in results if ok)
+    return {
+        "server": base_url,
+        "requests": requests,
+        "errors": sum(1 for _, ok in results if not ok),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "rps": requests / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sync and async dashboard servers")
+    parser.add_argument("servers", nargs="+", help="base URLs, e.g. http://localhost:5000")
+    parser.add_argument("--path", default="/api/stats")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    args = parser.parse_args()
+
+    print(f"📈 {args.requests} x GET {args.path}, {args.concurrency} concurrent\n")
+    print(f"{'server':<30} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9} {'errors':>7}")
+    for server in args.servers:
+        # One warm-up request so connection setup is not counted
+        timed_get(server.rstrip("/") + args.path, args.timeout)
+        result = run(server, args.path, args.requests, args.concurrency, args.timeout)
+        print(f"{result['server']:<30} {result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+              f"{result['rps']:>9.1f} {result['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Shared MongoDB connection for every module in the project
+One lazily-created, pool-configured MongoClient per process, driven by env settings
+"""
+import os
+import threading
+import time
+
+from pymongo import MongoClient
+
+from metrics import InstrumentedCollection
+
+# Environment variable -> (setting, default, type)
+ENVIRONMENT = {
+    "DIABETES_MONGO_URI": ("uri", "mongodb://localhost:27017/", str),
+    "DIABETES_DB": ("database", "diabetes_project", str),
+    "DIABETES_COLLECTION": ("collection", "patient_data", str),
+    "DIABETES_MAX_POOL_SIZE": ("maxPoolSize", 100, int),
+    "DIABETES_MIN_POOL_SIZE": ("minPoolSize", 0, int),
+    "DIABETES_SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", 5000, int),
+    "DIABETES_CONNECT_TIMEOUT_MS": ("connectTimeoutMS", 5000, int),
+    "DIABETES_SOCKET_TIMEOUT_MS": ("socketTimeoutMS", 30000, int),
+}
+
+_settings = None
+_client = None
+_lock = threading.Lock()
+# collection name -> (compact-schema Dictionary or None if never migrated, time loaded)
+_dictionaries = {}
+# Dictionaries are re-read this often, for migrations and labels from other processes;
+# codes and labels met in between are re-read on the spot
+DICTIONARY_TTL_S = 60
+
+
+def settings():
+    """Current settings: defaults, overridden by the environment and configure()"""
+    global _settings
+    if _settings is None:
+        _settings = {}
+        for variable, (name, default, cast) in ENVIRONMENT.items():
+            value = os.environ.get(variable)
+            _settings[name] = cast(value) if value is not None else default
+    return _settings
+
+
+def configure(**overrides):
+    """Override settings in code (e.g. from a --uri flag); drops any existing client"""
+    settings().update({name: value for name, value in overrides.items() if value is not None})
+    reset_client()
+
+
+def client_options():
+    """Keyword arguments for MongoClient/AsyncMongoClient, without the URI"""
+    return {
+        name: value for name, value in settings().items()
+        if name not in ("uri", "database", "collection")
+    }
+
+
+def get_client():
+    """Return the process-wide client, creating it on first use
+
+    MongoClient connects in the background, so this never blocks on the server.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = MongoClient(settings()["uri"], **client_options())
+    return _client
+
+
+def get_database():
+    return get_client()[settings()["database"]]
+
+
+def dictionary_due(name):
+    """True if a collection's dictionary was never read or is older than DICTIONARY_TTL_S"""
+    entry = _dictionaries.get(name)
+    return entry is None or time.monotonic() - entry[1] > DICTIONARY_TTL_S
+
+
+def remember_dictionary(name, dictionary):
+    """Store a freshly read dictionary (None if never migrated) and restart its TTL"""
+    _dictionaries[name] = (dictionary, time.monotonic())
+
+
+def cached_dictionary(name):
+    """The dictionary as last read, without checking its age"""
+    entry = _dictionaries.get(name)
+    return entry[0] if entry is not None else None
+
+
+def _dictionary_loader(collection):
+    """Read a collection's compact-schema dictionary on first use, not at import time"""
+    def load():
+        if dictionary_due(collection.name):
+            from compact import Dictionary
+            remember_dictionary(collection.name, Dictionary.load(collection))
+        return cached_dictionary(collection.name)
+    return load
+
+
+def get_collection(name=None):
+    """The configured collection, instrumented, and decoded if it uses the compact schema"""
+    from compact import CompactCollection  # compact imports ingest, which imports this module
+    collection = InstrumentedCollection(get_database()[name or settings()["collection"]])
+    return CompactCollection(collection, _dictionary_loader(collection))
+
+
+def forget_dictionaries():
+    """Re-read compact-schema dictionaries on next use, e.g. after a migration"""
+    with _lock:
+        _dictionaries.clear()
+
+
+def use_client(client):
+    """Install an already-built client, e.g. an in-process stand-in for benchmarks"""
+    global _client
+    with _lock:
+        _client = client
+        _dictionaries.clear()
+
+
+def reset_client():
+    """Close the current client so the next get_client() reconnects from scratch"""
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+        _dictionaries.clear()
+
+
+def is_healthy():
+    """Non-blocking health check from the driver's current view of the topology
+
+    Clients without a topology (e.g. an in-process stand-in) are pinged instead.
+    """
+    try:
+        return get_client().topology_description.has_readable_server()
+    except Exception:
+        return ping()
+
+
+def ping():
+    """Blocking health probe, bounded by serverSelectionTimeoutMS"""
+    try:
+        get_client().admin.command("ping")
+        return True
+    except Exception:
+        return False
@@ -0,0 +1,197 @@
+"""
+Out-of-core analytics straight from diabetic_data.csv
+Streams the file in chunks through one-pass, mergeable accumulators, so the analysis scripts
+run without MongoDB in memory bounded by the chunk size, not the file size
+"""
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from aggregation import (
+    document_matches, evaluate, final, finish_stages, group_id, group_key, initial, merge,
+    parse_accumulators, project, sort_documents, step,
+)
+from ingest import coerce_row, read_chunks
+
+CSV_ENV = "DIABETES_CSV"
+WORKERS_ENV = "DIABETES_CSV_WORKERS"
+CHUNK_ENV = "DIABETES_CSV_CHUNK_SIZE"
+CHUNK_SIZE = 10000
+
+
+def _aggregate_chunk(header, rows, matches, grouping, accumulators):
+    """Partial group states for one chunk, keyed in first-seen order"""
+    groups = {}
+    for row in rows:
+        doc = coerce_row(header, row)
+        if not all(document_matches(doc, match) for match in matches):
+            continue
+        key = group_key(grouping, doc)
+        states = groups.get(key)
+        if states is None:
+            states = groups[key] = [initial(operator) for _, operator, _ in accumulators]
+        for i, (_, operator, operand) in enumerate(accumulators):
+            states[i] = step(operator, states[i], evaluate(operand, doc))
+    return groups
+
+
+def _filter_chunk(header, rows, matches, projection):
+    docs = []
+    for row in rows:
+        doc = coerce_row(header, row)
+        if all(document_matches(doc, match) for match in matches):
+            docs.append(project(doc, projection))
+    return docs
+
+
+def _count_chunk(header, rows, matches):
+    return sum(1 for row in rows if all(document_matches(coerce_row(header, row), match) for match in matches))
+
+
+class CsvCursor:
+    """The subset of pymongo's Cursor API the analysis scripts use"""
+
+    def __init__(self, collection, matches, projection):
+        self.collection = collection
+        self.matches = matches
+        self.projection = projection
+        self._sort = []
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None):
+        if isinstance(key_or_list, str):
+            key_or_list = [(key_or_list, direction or 1)]
+        self._sort = list(key_or_list)
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def _docs(self):
+        for docs in self.collection._map_chunks(_filter_chunk, self.matches, self.projection):
+            yield from docs
+
+    def __iter__(self):
+        if self._sort:
+            return iter(sort_documents(self._docs(), self._sort, self._limit))
+        if self._limit:
+            return (doc for n, doc in zip(range(self._limit), self._docs()))
+        return self._docs()
+
+
+class CsvCollection:
+    """Read-only stand-in for patient_data that streams a diabetic_data.csv extract
+
+    Rows are typed exactly as ingest.py stores them, so every result matches what the
+    same pipeline returns after loading the file into MongoDB.
+    """
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE, workers=1):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.chunk_size = chunk_size
+        self.workers = workers
+
+    def _map_chunks(self, fn, *args):
+        """Yield fn(header, rows, *args) per chunk in file order, in worker processes if workers > 1"""
+        chunks = read_chunks(self.path, self.chunk_size)
+        if self.workers <= 1:
+            for header, rows in chunks:
+                yield fn(header, rows, *args)
+            return
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            for header, rows in chunks:
+                # Two chunks per worker in flight bounds memory, as in ingest.load_csv
+                if len(pending) >= self.workers * 2:
+                    yield pending.popleft().result()
+                pending.append(pool.submit(fn, header, rows, *args))
+            while pending:
+                yield pending.popleft().result()
+
+    def estimated_document_count(self):
+        return self.count_documents({})
+
+    def count_documents(self, filter):
+        matches = [filter] if filter else []
+        return sum(self._map_chunks(_count_chunk, matches))
+
+    def find(self, filter=None, projection=None, **kwargs):
+        return CsvCursor(self, [filter] if filter else [], projection)
+
+    def aggregate(self, pipeline, **kwargs):
+        matches, grouping, rest = [], None, []
+        for stage in pipeline:
+            (operator, spec), = stage.items()
+            if grouping is None and not rest and operator == "$match":
+                matches.append(spec)
+            elif grouping is None and not rest and operator in ("$group", "$bucket"):
+                grouping = (operator, spec)
+            else:
+                rest.append((operator, spec))
+
+        if grouping is None:
+            return iter(finish_stages(CsvCursor(self, matches, None)._docs(), rest))
+
+        operator, spec = grouping
+        if operator == "$group":
+            spec = dict(spec)
+            grouping = (operator, spec.pop("_id"))
+            accumulators = parse_accumulators(spec)
+        else:
+            accumulators = parse_accumulators(spec.get("output", {"count": {"$sum": 1}}))
+
+        groups = {}
+        for partial in self._map_chunks(_aggregate_chunk, matches, grouping, accumulators):
+            for key, states in partial.items():
+                if key not in groups:
+                    groups[key] = states
+                    continue
+                merged = groups[key]
+                for i, (_, accumulator, _) in enumerate(accumulators):
+                    merged[i] = merge(accumulator, merged[i], states[i])
+
+        rows = []
+        for key, states in groups.items():
+            row = {"_id": group_id(grouping, key)}
+            for (name, accumulator, _), state in zip(accumulators, states):
+                row[name] = final(accumulator, state)
+            rows.append(row)
+        if operator == "$bucket":
+            rows = sort_documents(rows, [("_id", 1)])
+        return iter(finish_stages(rows, rest))
+
+
+def csv_collection():
+    """Return a CsvCollection when DIABETES_CSV points at a CSV extract"""
+    path = os.environ.get(CSV_ENV)
+    if not path:
+        return None
+    return CsvCollection(
+        path,
+        chunk_size=int(os.environ.get(CHUNK_ENV, CHUNK_SIZE)),
+        workers=int(os.environ.get(WORKERS_ENV, "1")),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the analysis reports straight from a CSV extract")
+    parser.add_argument("csv_path")
+    parser.add_argument("--workers", type=int, default=1, help="processes used to parse chunks")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    # The analysis scripts pick the CSV up from the environment, like a Parquet snapshot
+    os.environ[CSV_ENV] = args.csv_path
+    os.environ[WORKERS_ENV] = str(args.workers)
+    os.environ[CHUNK_ENV] = str(args.chunk_size)
+    from advanced_analysis import AdvancedDiabetesAnalysis
+
+    print(f"📄 Streaming {args.csv_path} ({args.workers} worker(s), {args.chunk_size:,} rows per chunk)")
+    AdvancedDiabetesAnalysis().generate_summary_report()
+
+if __name__ == "__main__":
+    main()
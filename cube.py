@@ -0,0 +1,184 @@
+"""
+OLAP cube over the categorical dimensions of patient_data
+Stores count, sum and sum of squares per dimension combination in patient_cube, and answers
+any slice or roll-up from an in-memory copy without reading patient_data
+"""
+import json
+import threading
+
+import numpy as np
+from pymongo import UpdateOne
+
+from columnar import Categorical
+from connection import get_collection
+from rollups import MEASURES, WINDOW_LAG_S, _delta_match, apply_once, refresh_window
+
+CUBE_ID = "patient_cube"
+DIMENSIONS = ["age", "race", "gender", "insulin", "readmitted", "A1Cresult", "admission_type_id"]
+
+_lock = threading.Lock()
+_loaded = None
+
+
+def _cube_collection(collection):
+    return collection.database['patient_cube']
+
+
+def _meta_collection(collection):
+    # The watermark sits with the other rollup summaries
+    return collection.database['patient_stats']
+
+
+def cell_pipeline(match):
+    """One group per dimension combination, with mergeable partial aggregates"""
+    # $ifNull keeps missing fields in the key as null instead of dropping them
+    group = {"_id": {dim: {"$ifNull": [f"${dim}", None]} for dim in DIMENSIONS}, "count": {"$sum": 1}}
+    for name, field in MEASURES.items():
+        value = f"${field}"
+        group[f"count_{name}"] = {"$sum": {"$cond": [{"$isNumber": value}, 1, 0]}}
+        group[f"sum_{name}"] = {"$sum": value}
+        group[f"sq_{name}"] = {"$sum": {"$multiply": [value, value]}}
+    return [{"$match": match}, {"$group": group}]
+
+
+def _cell_update(cell, high):
+    increments = {key: value for key, value in cell.items() if key != "_id"}
+    # Skipped (as a duplicate key) when a retry of the same window already reached this cell
+    return UpdateOne(
+        {"_id": cell["_id"], "window": {"$ne": high}},
+        {"$inc": increments, "$set": {"window": high}},
+        upsert=True,
+    )
+
+
+def refresh_cube(collection, batch_size=1000, lag=WINDOW_LAG_S):
+    """Fold encounters inserted since the cube's watermark into its cells"""
+    cells = _cube_collection(collection)
+
+    def apply(watermark, high):
+        batch = []
+        for cell in collection.aggregate(cell_pipeline(_delta_match(watermark, high))):
+            batch.append(_cell_update(cell, high))
+            if len(batch) == batch_size:
+                apply_once(cells, batch)
+                batch = []
+        apply_once(cells, batch)
+
+    return refresh_window(collection, CUBE_ID, apply, lag=lag)
+
+
+def rebuild_cube(collection):
+    """Drop the cube and recompute it from scratch (needed after updates or deletes)"""
+    _cube_collection(collection).drop()
+    # Keep counting versions up so processes holding the old cube reload it
+    _meta_collection(collection).update_one(
+        {"_id": CUBE_ID}, {"$set": {"watermark": None, "pending": None}, "$inc": {"version": 1}}
+    )
+    # Rebuilds run once the writers are done, so fold in everything
+    return refresh_cube(collection, lag=0)
+
+
+class Cube:
+    """In-memory cube cells: a categorical code column per dimension plus measure arrays"""
+
+    def __init__(self, cells):
+        self.size = len(cells)
+        self.dimensions = {
+            dim: Categorical([cell["_id"].get(dim) for cell in cells]) for dim in DIMENSIONS
+        }
+        self.counts = np.asarray([cell["count"] for cell in cells], dtype=np.float64)
+        self.measures = {}
+        for name in MEASURES:
+            self.measures[name] = {
+                part: np.asarray([cell.get(f"{part}_{name}", 0) for cell in cells], dtype=np.float64)
+                for part in ("count", "sum", "sq")
+            }
+
+    @classmethod
+    def from_collection(cls, collection):
+        return cls(list(_cube_collection(collection).find()))
+
+    def query(self, dims=(), measures=None, filters=None):
+        """Roll up to `dims`, keeping only cells whose dimensions match `filters`
+
+        filters maps a dimension to one value or a list of accepted values.
+        Returns one row per non-empty combination with count, avg_<m> and std_<m>.
+        """
+        measures = list(MEASURES) if measures is None else list(measures)
+        rows = np.ones(self.size, dtype=bool)
+        for dim, values in (filters or {}).items():
+            accepted = values if isinstance(values, list) else [values]
+            rows &= self.dimensions[dim].mask_in(accepted)
+
+        shape = [len(self.dimensions[dim].labels) for dim in dims]
+        if dims and self.size:
+            codes = np.ravel_multi_index(
+                [self.dimensions[dim].codes.astype(np.intp) for dim in dims], shape
+            )
+        else:
+            codes = np.zeros(self.size, dtype=np.intp)
+        groups = int(np.prod(shape)) if dims else 1
+        codes = codes[rows]
+
+        def total(values):
+            return np.bincount(codes, weights=values[rows], minlength=groups)
+
+        counts = total(self.counts)
+        parts = {name: {part: total(values) for part, values in self.measures[name].items()}
+                 for name in measures}
+
+        results = []
+        # Labels are in BSON order, so ravelled codes come out sorted by dims
+        for code in np.flatnonzero(counts):
+            positions = np.unravel_index(code, shape) if dims else ()
+            row = {dim: self.dimensions[dim].labels[pos] for dim, pos in zip(dims, positions)}
+            row["count"] = int(counts[code])
+            for name in measures:
+                n, s, sq = (parts[name][part][code] for part in ("count", "sum", "sq"))
+                mean = s / n if n else None
+                row[f"avg_{name}"] = float(mean) if n else None
+                row[f"std_{name}"] = float(max(sq / n - mean * mean, 0.0) ** 0.5) if n else None
+            results.append(row)
+        return results
+
+
+def parse_query(dims=None, measures=None, filters=None):
+    """Validate query-string style arguments: comma-separated names and a JSON filter"""
+    dim_list = [d for d in (dims or "").split(",") if d]
+    measure_list = [m for m in measures.split(",") if m] if measures else None
+    filter_map = json.loads(filters) if filters else {}
+
+    if not isinstance(filter_map, dict):
+        raise ValueError("filter must be a JSON object of dimension -> value(s)")
+    unknown = [d for d in dim_list + list(filter_map) if d not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown dimension(s) {unknown}, expected some of {DIMENSIONS}")
+    if measure_list:
+        unknown = [m for m in measure_list if m not in MEASURES]
+        if unknown:
+            raise ValueError(f"Unknown measure(s) {unknown}, expected some of {list(MEASURES)}")
+    return dim_list, measure_list, filter_map
+
+
+def current_cube(collection):
+    """Bring the stored cube up to date and return the in-memory copy, reloading only on change"""
+    global _loaded
+    meta = refresh_cube(collection)
+    with _lock:
+        if _loaded is None or _loaded[0] != meta.get("version"):
+            _loaded = (meta.get("version"), Cube.from_collection(collection))
+        return _loaded[1]
+
+
+def main():
+    """Rebuild the cube from the full collection"""
+    collection = get_collection()
+
+    print("🔄 Rebuilding patient_cube...")
+    rebuild_cube(collection)
+    cube = Cube.from_collection(collection)
+    print(f"✅ Cube has {cube.size:,} cells covering {int(cube.counts.sum()):,} encounters")
+
+
+if __name__ == "__main__":
+    main()
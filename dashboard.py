@@ -0,0 +1,430 @@
+"""
+The dashboard page served at / by both app.py and async_app.py
+Kept apart so the async server can serve it without importing the Flask app
+"""
+DASHBOARD_HTML = '''
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Diabetes Dashboard</title>
+    <style>
+        * {
+            margin: 0;
+            padding: 0;
+            box-sizing: border-box;
+        }
+
+        body {
+            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            min-height: 100vh;
+            padding: 20px;
+        }
+
+        .dashboard {
+            max-width: 1200px;
+            margin: 0 auto;
+        }
+
+        .header {
+            text-align: center;
+            color: white;
+            margin-bottom: 30px;
+        }
+
+        .header h1 {
+            font-size: 2.5rem;
+            margin-bottom: 10px;
+            text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
+        }
+
+        .header p {
+            font-size: 1.1rem;
+            opacity: 0.9;
+        }
+
+        .stats-grid {
+            display: grid;
+            grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
+            gap: 20px;
+            margin-bottom: 30px;
+        }
+
+        .stat-card {
+            background: white;
+            border-radius: 15px;
+            padding: 25px;
+            box-shadow: 0 10px 30px rgba(0,0,0,0.2);
+            transition: transform 0.3s ease, box-shadow 0.3s ease;
+            border-left: 5px solid #667eea;
+        }
+
+        .stat-card:hover {
+            transform: translateY(-5px);
+            box-shadow: 0 15px 40px rgba(0,0,0,0.3);
+        }
+
+        .stat-header {
+            display: flex;
+            align-items: center;
+            margin-bottom: 15px;
+        }
+
+        .stat-icon {
+            font-size: 2rem;
+            margin-right: 10px;
+        }
+
+        .stat-title {
+            font-size: 1.2rem;
+            font-weight: 600;
+            color: #333;
+        }
+
+        .stat-value {
+            font-size: 2.5rem;
+            font-weight: bold;
+            color: #667eea;
+            margin-bottom: 5px;
+        }
+
+        .stat-description {
+            color: #666;
+            font-size: 0.9rem;
+        }
+
+        .chart-container {
+            background: white;
+            border-radius: 15px;
+            padding: 25px;
+            box-shadow: 0 10px 30px rgba(0,0,0,0.2);
+            margin-bottom: 20px;
+        }
+
+        .chart-title {
+            font-size: 1.3rem;
+            font-weight: 600;
+            margin-bottom: 20px;
+            color: #333;
+            text-align: center;
+        }
+
+        .readmission-bars {
+            display: flex;
+            align-items: end;
+            justify-content: space-around;
+            height: 200px;
+            margin: 20px 0;
+        }
+
+        .bar {
+            display: flex;
+            flex-direction: column;
+            align-items: center;
+            min-width: 100px;
+        }
+
+        .bar-fill {
+            width: 60px;
+            border-radius: 8px 8px 0 0;
+            margin-bottom: 10px;
+            transition: all 0.5s ease;
+            display: flex;
+            align-items: end;
+            justify-content: center;
+            color: white;
+            font-weight: bold;
+            padding-bottom: 10px;
+        }
+
+        .bar-label {
+            font-weight: 600;
+            color: #333;
+            text-align: center;
+            line-height: 1.2;
+        }
+
+        .loading {
+            text-align: center;
+            color: #666;
+            font-style: italic;
+            padding: 20px;
+        }
+
+        .error {
+            background: #fee;
+            color: #c33;
+            padding: 15px;
+            border-radius: 8px;
+            border-left: 4px solid #c33;
+            margin: 20px 0;
+        }
+
+        .footer {
+            text-align: center;
+            color: rgba(255,255,255,0.8);
+            margin-top: 40px;
+            font-size: 0.9rem;
+        }
+
+        /* Responsive design */
+        @media (max-width: 768px) {
+            .header h1 {
+                font-size: 2rem;
+            }
+            
+            .stats-grid {
+                grid-template-columns: 1fr;
+            }
+            
+            .readmission-bars {
+                height: 150px;
+            }
+            
+            .stat-value {
+                font-size: 2rem;
+            }
+        }
+
+        /* Loading animation */
+        .loading-spinner {
+            border: 3px solid #f3f3f3;
+            border-top: 3px solid #667eea;
+            border-radius: 50%;
+            width: 40px;
+            height: 40px;
+            animation: spin 1s linear infinite;
+            margin: 20px auto;
+        }
+
+        @keyframes spin {
+            0% { transform: rotate(0deg); }
+            100% { transform: rotate(360deg); }
+        }
+    </style>
+</head>
+<body>
+    <div class="dashboard">
+        <div class="header">
+            <h1>🏥 Diabetes Dashboard</h1>
+            <p>Real-time Patient Analytics & Readmission Insights</p>
+        </div>
+
+        <div class="stats-grid">
+            <div class="stat-card">
+                <div class="stat-header">
+                    <span class="stat-icon">👥</span>
+                    <span class="stat-title">Total Patients</span>
+                </div>
+                <div class="stat-value" id="totalPatients">-</div>
+                <div class="stat-description" id="totalEncounters">Patients in database</div>
+            </div>
+
+            <div class="stat-card">
+                <div class="stat-header">
+                    <span class="stat-icon">🏨</span>
+                    <span class="stat-title">Avg Hospital Stay</span>
+                </div>
+                <div class="stat-value" id="avgStay">-</div>
+                <div class="stat-description">Days per admission</div>
+            </div>
+
+            <div class="stat-card">
+                <div class="stat-header">
+                    <span class="stat-icon">💊</span>
+                    <span class="stat-title">Avg Medications</span>
+                </div>
+                <div class="stat-value" id="avgMeds">-</div>
+                <div class="stat-description">Per patient visit</div>
+            </div>
+
+            <div class="stat-card">
+                <div class="stat-header">
+                    <span class="stat-icon">🧪</span>
+                    <span class="stat-title">Avg Lab Tests</span>
+                </div>
+                <div class="stat-value" id="avgLabs">-</div>
+                <div class="stat-description">Per patient visit</div>
+            </div>
+        </div>
+
+        <div class="chart-container">
+            <div class="chart-title">📊 Patient Readmission Analysis</div>
+            <div id="readmissionChart">
+                <div class="loading">
+                    <div class="loading-spinner"></div>
+                    Loading readmission data...
+                </div>
+            </div>
+        </div>
+
+        <div class="footer">
+            <p>Healthcare Analytics Dashboard • Real-time MongoDB Integration</p>
+        </div>
+    </div>
+
+    <script>
+        // Latest /api/stats payload, kept so stream deltas can be applied to it
+        let currentStats = null;
+
+        function renderStats(data) {
+            // Update basic stats
+            // Unique patients when the server reports them; total_patients counts encounters.
+            // null means the patient timelines are still being built for the first time
+            const encounters = data.total_patients?.toLocaleString() || 0;
+            if (data.unique_patients === null) {
+                document.getElementById('totalPatients').textContent = '…';
+                document.getElementById('totalEncounters').textContent =
+                    `Counting unique patients over ${encounters} encounters`;
+            } else {
+                const patients = data.unique_patients ?? data.total_patients;
+                document.getElementById('totalPatients').textContent = patients?.toLocaleString() || '0';
+                if (data.unique_patients !== undefined) {
+                    document.getElementById('totalEncounters').textContent =
+                        `Unique patients, over ${encounters} encounters`;
+                }
+            }
+            document.getElementById('avgStay').textContent = (data.averages?.avg_stay || 0) + ' days';
+            document.getElementById('avgMeds').textContent = data.averages?.avg_meds || '0';
+            document.getElementById('avgLabs').textContent = data.averages?.avg_labs || '0';
+            
+            // Create readmission chart
+            createReadmissionChart(data.readmission_stats || []);
+        }
+
+        function applyDelta(delta) {
+            if (!currentStats) {
+                return;
+            }
+            ['total_patients', 'unique_patients'].forEach(key => {
+                if (delta[key] !== undefined) {
+                    currentStats[key] = delta[key];
+                }
+            });
+            if (delta.averages) {
+                currentStats.averages = Object.assign({}, currentStats.averages, delta.averages);
+            }
+            if (delta.readmission_counts) {
+                const counts = {};
+                // Keyed as live_updates._readmission_map keys them, with a missing value as 'unknown'
+                (currentStats.readmission_stats || []).forEach(item => { counts[readmissionKey(item._id)] = item.count; });
+                Object.assign(counts, delta.readmission_counts);
+                currentStats.readmission_stats = Object.entries(counts).map(([id, count]) => ({ _id: id, count: count }));
+            }
+            renderStats(currentStats);
+        }
+
+        // API call to get statistics (used when the live stream is unavailable)
+        async function loadDashboardData() {
+            try {
+                const response = await fetch('/api/stats');
+                if (!response.ok) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
+                currentStats = await response.json();
+                renderStats(currentStats);
+                
+            } catch (error) {
+                console.error('Error loading dashboard data:', error);
+                showError('Failed to load dashboard data: ' + error.message);
+            }
+        }
+
+        let pollTimer = null;
+
+        function startPolling() {
+            if (pollTimer === null) {
+                loadDashboardData();
+                // Refresh data every 30 seconds
+                pollTimer = setInterval(loadDashboardData, 30000);
+            }
+        }
+
+        function startLiveUpdates() {
+            if (!window.EventSource) {
+                startPolling();
+                return;
+            }
+            const source = new EventSource('/api/stream');
+            source.addEventListener('snapshot', event => {
+                currentStats = JSON.parse(event.data);
+                renderStats(currentStats);
+            });
+            source.addEventListener('delta', event => {
+                applyDelta(JSON.parse(event.data));
+            });
+            source.onerror = () => {
+                // EventSource reconnects on its own; poll only if it has given up
+                if (source.readyState === EventSource.CLOSED) {
+                    startPolling();
+                }
+            };
+        }
+
+        function readmissionKey(id) {
+            return id === null || id === undefined ? 'unknown' : String(id);
+        }
+
+        function createReadmissionChart(readmissionStats) {
+            const chartContainer = document.getElementById('readmissionChart');
+            
+            if (!readmissionStats || readmissionStats.length === 0) {
+                chartContainer.innerHTML = '<div class="error">No readmission data available</div>';
+                return;
+            }
+
+            // Calculate total for percentages
+            const total = readmissionStats.reduce((sum, item) => sum + item.count, 0);
+            
+            // Map readmission values to labels
+            const readmissionLabels = {
+                'NO': 'No Readmission',
+                '<30': 'Within 30 Days',
+                '>30': 'After 30 Days',
+                'unknown': 'Unknown'
+            };
+
+            // Create bars HTML
+            let barsHTML = '<div class="readmission-bars">';
+            
+            readmissionStats.forEach((item, index) => {
+                const percentage = ((item.count / total) * 100).toFixed(1);
+                const height = (item.count / Math.max(...readmissionStats.map(s => s.count))) * 150;
+                const colors = ['#667eea', '#f093fb', '#4facfe'];
+                const color = colors[index % colors.length];
+                
+                barsHTML += `
+                    <div class="bar">
+                        <div class="bar-fill" style="height: ${height}px; background: ${color};">
+                            ${item.count}
+                        </div>
+                        <div class="bar-label">
+                            ${readmissionLabels[readmissionKey(item._id)] || item._id}<br>
+                            <small>${percentage}%</small>
+                        </div>
+                    </div>
+                `;
+            });
+            
+            barsHTML += '</div>';
+            chartContainer.innerHTML = barsHTML;
+        }
+
+        function showError(message) {
+            const chartContainer = document.getElementById('readmissionChart');
+            chartContainer.innerHTML = `<div class="error">${message}</div>`;
+            
+            // Reset stats to show error state
+            ['totalPatients', 'avgStay', 'avgMeds', 'avgLabs'].forEach(id => {
+                document.getElementById(id).textContent = 'Error';
+            });
+        }
+
+        // Subscribe to pushed updates when the page loads
+        document.addEventListener('DOMContentLoaded', startLiveUpdates);
+    </script>
+</body>
+</html>
+'''
@@ -0,0 +1,217 @@
+"""
+ICD-9 diagnosis hierarchy for diag_1, diag_2 and diag_3
+A prefix trie maps each code to its group and category once per encounter, so grouped
+analytics read precomputed dx_* arrays instead of parsing strings on every query
+"""
+import argparse
+from functools import lru_cache
+
+from pymongo import UpdateOne
+
+from advanced_analysis import READMITTED_VALUES
+from connection import get_collection
+from metrics import query_label
+from result_cache import note_writes
+
+DIAGNOSIS_FIELDS = ["diag_1", "diag_2", "diag_3"]
+# Coarsest to finest; each level's value determines the one above it
+LEVELS = ["group", "category", "code"]
+POSITIONS = ["primary", "any"]
+
+# Diagnosis groups used in the readmission literature for this dataset
+# (Strack et al., 2014); anything unlisted, including V and E codes, is "Other"
+GROUPS = {
+    "Circulatory": [(390, 459), (785, 785)],
+    "Respiratory": [(460, 519), (786, 786)],
+    "Digestive": [(520, 579), (787, 787)],
+    "Diabetes": [(250, 250)],
+    "Injury": [(800, 999)],
+    "Musculoskeletal": [(710, 739)],
+    "Genitourinary": [(580, 629), (788, 788)],
+    "Neoplasms": [(140, 239)],
+}
+OTHER = "Other"
+_LABEL = ""
+
+
+class PrefixTrie:
+    """Longest-prefix lookup: the deepest labelled node on a code's path wins"""
+
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, prefix, label):
+        node = self.root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[_LABEL] = label
+
+    def lookup(self, code, default=None):
+        node, label = self.root, default
+        for char in code:
+            node = node.get(char)
+            if node is None:
+                break
+            label = node.get(_LABEL, label)
+        return label
+
+
+def build_trie():
+    trie = PrefixTrie()
+    for group, ranges in GROUPS.items():
+        for low, high in ranges:
+            for category in range(low, high + 1):
+                trie.insert(f"{category:03d}", group)
+    return trie
+
+
+TRIE = build_trie()
+
+
+def normalize(code):
+    """Canonical ICD-9 string: '8' -> '008', '250.83' unchanged; None for '?' or blanks"""
+    if code is None:
+        return None
+    code = str(code).strip()
+    if not code or code == "?":
+        return None
+    head, dot, tail = code.partition(".")
+    if head.isdigit():
+        head = head.zfill(3)
+    return head + dot + tail
+
+
+@lru_cache(maxsize=None)
+def classify(code):
+    """{level: value} for one raw code, or None when the diagnosis is missing"""
+    code = normalize(code)
+    if code is None:
+        return None
+    return {
+        "group": TRIE.lookup(code, OTHER),
+        "category": code.partition(".")[0],
+        "code": code,
+    }
+
+
+def encounter_index(doc):
+    """Positional dx_<level> arrays for one encounter, aligned with diag_1..diag_3"""
+    paths = [classify(doc.get(field)) for field in DIAGNOSIS_FIELDS]
+    return {f"dx_{level}": [path[level] if path else None for path in paths] for level in LEVELS}
+
+
+def index_diagnoses(collection, batch_size=1000, rebuild=False):
+    """Store dx_* arrays on encounters that lack them; returns the number updated"""
+    query = {} if rebuild else {"dx_group": {"$exists": False}}
+    projection = {field: 1 for field in DIAGNOSIS_FIELDS}
+
+    updated = 0
+    updates = []
+    for doc in collection.find(query, projection, batch_size=batch_size):
+        updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": encounter_index(doc)}))
+        if len(updates) == batch_size:
+            collection.bulk_write(updates, ordered=False)
+            updated += len(updates)
+            updates = []
+    if updates:
+        collection.bulk_write(updates, ordered=False)
+        updated += len(updates)
+    if updated:
+        note_writes(collection)
+    return updated
+
+
+def parse_query(level="group", position="primary", parent=None):
+    """Validate query arguments; parent narrows to one value of the level above"""
+    level = level or "group"
+    position = position or "primary"
+    if level not in LEVELS:
+        raise ValueError(f"Unknown level {level!r}, expected one of {LEVELS}")
+    if position not in POSITIONS:
+        raise ValueError(f"Unknown position {position!r}, expected one of {POSITIONS}")
+    if parent and level == LEVELS[0]:
+        raise ValueError(f"parent needs a level below {LEVELS[0]!r}")
+    return level, position, parent or None
+
+
+def analysis_pipeline(level="group", position="primary", parent=None):
+    """Encounters, readmission rate and average stay per diagnosis value at one level
+
+    primary groups by diag_1 only; any counts an encounter once under each distinct
+    value among its three diagnoses.
+    """
+    field = f"dx_{level}"
+    stages = []
+    if parent:
+        parent_field = f"dx_{LEVELS[LEVELS.index(level) - 1]}"
+        # The array match can use the dx_group index; the positional one narrows to diag_1
+        match = {parent_field: parent}
+        if position == "primary":
+            match[f"{parent_field}.0"] = parent
+        stages.append({"$match": match})
+
+    if position == "primary":
+        key = {"$arrayElemAt": [f"${field}", 0]}
+    else:
+        values = f"${field}"
+        if parent:
+            # Per diagnosis position, keep the value only if its parent matches;
+            # the nulls left behind are dropped after grouping
+            values = {"$map": {
+                "input": list(range(len(DIAGNOSIS_FIELDS))),
+                "as": "i",
+                "in": {"$cond": [
+                    {"$eq": [{"$arrayElemAt": [f"${parent_field}", "$$i"]}, parent]},
+                    {"$arrayElemAt": [f"${field}", "$$i"]},
+                    None,
+                ]},
+            }}
+        stages += [
+            {"$project": {"value": {"$setUnion": [values, []]}, "readmitted": 1, "time_in_hospital": 1}},
+            {"$unwind": "$value"},
+        ]
+        key = "$value"
+
+    stages += [
+        {"$group": {
+            "_id": key,
+            "encounters": {"$sum": 1},
+            "readmission_rate": {"$avg": {"$cond": [{"$in": ["$readmitted", READMITTED_VALUES]}, 1, 0]}},
+            "avg_stay": {"$avg": "$time_in_hospital"},
+        }},
+        # Missing diagnoses have no place in the hierarchy
+        {"$match": {"_id": {"$ne": None}}},
+        {"$sort": {"encounters": -1, "_id": 1}},
+    ]
+    return stages
+
+
+def diagnosis_analysis(collection, level="group", position="primary", parent=None):
+    level, position, parent = parse_query(level, position, parent)
+    with query_label(f"diagnoses.{level}.{position}"):
+        return list(collection.aggregate(analysis_pipeline(level, position, parent)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Readmission and stay by ICD-9 diagnosis group")
+    parser.add_argument("--level", choices=LEVELS, default="group")
+    parser.add_argument("--position", choices=POSITIONS, default="primary")
+    parser.add_argument("--parent", default=None, help="e.g. Circulatory for --level category")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--rebuild", action="store_true", help="recompute dx_* on every encounter")
+    args = parser.parse_args()
+
+    collection = get_collection()
+    updated = index_diagnoses(collection, rebuild=args.rebuild)
+    if updated:
+        print(f"🗂️  Indexed diagnoses on {updated:,} encounters")
+
+    scope = f" in {args.parent}" if args.parent else ""
+    print(f"\n🩺 Readmission by diagnosis {args.level}{scope} ({args.position} diagnosis):")
+    for row in diagnosis_analysis(collection, args.level, args.position, args.parent)[:args.limit]:
+        print(f"   {row['_id']}: {row['encounters']:,} encounters, "
+              f"{row['readmission_rate'] * 100:.1f}% readmitted, avg stay {row['avg_stay']:.1f} days")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,16 @@
 # explore_data.py
-import pandas as pd
-from pymongo import MongoClient
+from connection import get_collection
 
-# Connect to MongoDB
-client = MongoClient('mongodb://localhost:27017/')
-db = client['diabetes_project']
-collection = db['patient_data']
 
-print("Connected to MongoDB!")
-print(f"Total patients: {collection.count_documents({})}")
+def explore():
+    """Connectivity check: count the encounters in MongoDB"""
+    collection = get_collection()
+    total = collection.count_documents({})
+
+    print("Connected to MongoDB!")
+    print(f"Total patients: {total}")
+    return {"total_patients": total}
+
+
+if __name__ == "__main__":
+    explore()
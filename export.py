@@ -0,0 +1,168 @@
+"""
+Streaming NDJSON export of encounter records
+Keyset pagination over (sort key, _id) and a lazily-iterated cursor keep every request at
+constant memory and constant cost per page, however deep the client pages
+"""
+import argparse
+import base64
+import json
+import sys
+
+from bson import json_util
+
+from connection import get_collection
+from ingest import DATASET_FIELDS
+from metrics import query_label, unexplained
+
+# Sort keys with an index that ends in _id, or a unique index, so each page is an index range scan
+SORT_KEYS = ["_id", "encounter_id", "time_in_hospital"]
+# Unique on their own, so pages need no _id tie-break
+UNIQUE_SORT_KEYS = {"_id", "encounter_id"}
+# Query operators a client may use in a filter; anything else ($where, $expr, ...) is refused
+FILTER_OPERATORS = {"$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin"}
+DEFAULT_LIMIT = 10000
+MAX_LIMIT = 1000000
+BATCH_SIZE = 1000
+
+
+def encode_cursor(sort_value, _id):
+    return base64.urlsafe_b64encode(json_util.dumps([sort_value, _id]).encode()).decode()
+
+
+def decode_cursor(token):
+    try:
+        sort_value, _id = json_util.loads(base64.urlsafe_b64decode(token.encode()))
+    except Exception:
+        raise ValueError("after is not a cursor returned by this endpoint")
+    return sort_value, _id
+
+
+def _parse_filter(text):
+    query = json.loads(text) if text else {}
+    if not isinstance(query, dict):
+        raise ValueError("filter must be a JSON object of field -> value or {operator: value}")
+    for field, condition in query.items():
+        if field not in DATASET_FIELDS:
+            raise ValueError(f"Unknown filter field {field!r}")
+        if isinstance(condition, dict):
+            unknown = [op for op in condition if op not in FILTER_OPERATORS]
+            if unknown:
+                raise ValueError(f"Unsupported operator(s) {unknown}, expected some of {sorted(FILTER_OPERATORS)}")
+    return query
+
+
+def parse_query(fields=None, filter=None, sort=None, after=None, limit=None):
+    """Validate query-string style arguments into (fields, filter, sort key, direction, after, limit)"""
+    field_list = [f for f in (fields or "").split(",") if f] or list(DATASET_FIELDS)
+    unknown = [f for f in field_list if f not in DATASET_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s) {unknown}")
+
+    sort = sort or "_id"
+    direction = -1 if sort.startswith("-") else 1
+    sort_key = sort.lstrip("-")
+    if sort_key not in SORT_KEYS:
+        raise ValueError(f"sort must be one of {SORT_KEYS}, optionally prefixed with '-'")
+
+    try:
+        limit = int(limit) if limit else DEFAULT_LIMIT
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+
+    return field_list, _parse_filter(filter), sort_key, direction, decode_cursor(after) if after else None, limit
+
+
+def export_query(filter, sort_key, direction, after):
+    """find() filter and sort for one page: everything strictly past `after` in sort order"""
+    unique = sort_key in UNIQUE_SORT_KEYS
+    order = [(sort_key, direction)] if unique else [(sort_key, direction), ("_id", direction)]
+    if after is None:
+        return filter, order
+
+    past = "$gt" if direction == 1 else "$lt"
+    sort_value, _id = after
+    if sort_key == "_id":
+        keyset = {"_id": {past: _id}}
+    elif unique:
+        keyset = {sort_key: {past: sort_value}}
+    else:
+        keyset = {"$or": [
+            {sort_key: {past: sort_value}},
+            {sort_key: sort_value, "_id": {past: _id}},
+        ]}
+    return ({"$and": [filter, keyset]} if filter else keyset), order
+
+
+def open_export(collection, fields, filter, sort_key, direction, after, limit):
+    """Start the page's cursor; raises ValueError up front for filters the store cannot run"""
+    query, order = export_query(filter, sort_key, direction, after)
+    projection = {field: 1 for field in fields}
+    projection[sort_key] = 1
+    # The cursor is read as fast as the client takes lines, so its timing says little about
+    # the plan; re-running a whole page to explain it would double the cost of a slow page
+    with unexplained():
+        # One more row than the page tells whether a next page exists, without a count
+        return collection.find(query, projection, batch_size=BATCH_SIZE).sort(order).limit(limit + 1)
+
+
+def page_records(cursor, fields, sort_key, limit):
+    """Yield (record, None) per row of the page, then (None, next cursor) if more rows follow"""
+    last = None
+    for count, doc in enumerate(cursor):
+        if count == limit:
+            yield None, encode_cursor(last.get(sort_key), last["_id"])
+            return
+        yield {field: doc.get(field) for field in fields}, None
+        last = doc
+
+
+def ndjson_lines(cursor, fields, sort_key, limit):
+    """One JSON line per record, then {"next": cursor} if more records follow
+
+    Records are pulled from the cursor a batch at a time only as lines are consumed,
+    so a slow reader slows the query rather than filling memory.
+    """
+    for record, next_cursor in page_records(cursor, fields, sort_key, limit):
+        if record is None:
+            yield json.dumps({"next": next_cursor}) + "\n"
+        else:
+            yield json.dumps(record, default=str) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export encounters as NDJSON, page by page")
+    parser.add_argument("--fields", default=None, help="comma-separated, default every field")
+    parser.add_argument("--filter", default=None, help='JSON, e.g. {"readmitted": "<30"}')
+    parser.add_argument("--sort", default="_id", help=f"one of {SORT_KEYS}, '-' for descending")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_LIMIT)
+    parser.add_argument("--output", default=None, help="file to write, default stdout")
+    args = parser.parse_args()
+
+    collection = get_collection()
+    fields, query, sort_key, direction, after, limit = parse_query(
+        args.fields, args.filter, args.sort, None, str(args.page_size)
+    )
+    out = open(args.output, "w") if args.output else sys.stdout
+    rows = 0
+    try:
+        while True:
+            with query_label("export"):
+                cursor = open_export(collection, fields, query, sort_key, direction, after, limit)
+            next_cursor = None
+            for record, next_cursor in page_records(cursor, fields, sort_key, limit):
+                if record is not None:
+                    out.write(json.dumps(record, default=str) + "\n")
+                    rows += 1
+            if next_cursor is None:
+                break
+            after = decode_cursor(next_cursor)
+    finally:
+        if args.output:
+            out.close()
+    print(f"✅ Exported {rows:,} encounters", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Streaming CSV bulk loader for diabetic_data.csv
+Replaces the mongoimport step with typed, batched, resumable parallel inserts
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from pymongo.errors import BulkWriteError
+
+from connection import configure, get_collection
+from rollups import rebuild_rollup
+
+MISSING = "?"
+MEDICATION_FIELDS = [
+    "metformin", "repaglinide", "nateglinide", "chlorpropamide", "glimepiride",
+    "acetohexamide", "glipizide", "glyburide", "tolbutamide", "pioglitazone",
+    "rosiglitazone", "acarbose", "miglitol", "troglitazone", "tolazamide",
+    "examide", "citoglipton", "insulin", "glyburide-metformin", "glipizide-metformin",
+    "glimepiride-pioglitazone", "metformin-rosiglitazone", "metformin-pioglitazone",
+]
+DATASET_FIELDS = [
+    "encounter_id", "patient_nbr", "race", "gender", "age", "weight",
+    "admission_type_id", "discharge_disposition_id", "admission_source_id",
+    "time_in_hospital", "payer_code", "medical_specialty", "num_lab_procedures",
+    "num_procedures", "num_medications", "number_outpatient", "number_emergency",
+    "number_inpatient", "diag_1", "diag_2", "diag_3", "number_diagnoses",
+    "max_glu_serum", "A1Cresult",
+] + MEDICATION_FIELDS + ["change", "diabetesMed", "readmitted"]
+INT_FIELDS = {
+    "encounter_id", "patient_nbr", "admission_type_id", "discharge_disposition_id",
+    "admission_source_id", "time_in_hospital", "num_lab_procedures", "num_procedures",
+    "num_medications", "number_outpatient", "number_emergency", "number_inpatient",
+    "number_diagnoses",
+}
+DUPLICATE_KEY = 11000
+
+
+def coerce_row(header, row):
+    """Turn one CSV row into a typed document, with '?' stored as null"""
+    doc = {}
+    for field, value in zip(header, row):
+        if value == MISSING or value == "":
+            doc[field] = None
+        elif field in INT_FIELDS:
+            try:
+                doc[field] = int(value)
+            except ValueError:
+                doc[field] = None
+        else:
+            doc[field] = value
+    return doc
+
+
+def read_chunks(path, chunk_size):
+    """Yield (header, rows) of raw CSV rows without holding the file in memory"""
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        chunk = []
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield header, chunk
+                chunk = []
+        if chunk:
+            yield header, chunk
+
+
+def read_batches(path, batch_size, skip_batches=0):
+    """Yield (batch_number, documents) without holding the file in memory"""
+    for batch_number, (header, rows) in enumerate(read_chunks(path, batch_size)):
+        if batch_number >= skip_batches:
+            yield batch_number, [coerce_row(header, r) for r in rows]
+
+
+def insert_batch(collection, docs):
+    """Unordered insert that treats already-loaded encounters as success"""
+    try:
+        return len(collection.insert_many(docs, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != DUPLICATE_KEY for err in errors):
+            raise
+        return e.details.get("nInserted", 0)
+
+
+class Checkpoint:
+    """Remembers the highest contiguous batch that has been fully written"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.contiguous = 0
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.contiguous = json.load(f).get("completed_batches", 0)
+
+    def mark(self, batch_number):
+        self.done.add(batch_number)
+        while self.contiguous in self.done:
+            self.done.discard(self.contiguous)
+            self.contiguous += 1
+        if self.path:
+            with open(self.path, "w") as f:
+                json.dump({"completed_batches": self.contiguous}, f)
+
+
+def load_csv(collection, path, batch_size=5000, workers=4, checkpoint_path=None):
+    """Stream a CSV into the collection and return (rows_inserted, seconds)"""
+    # encounter_id is unique per row, so a resumed load cannot duplicate encounters
+    collection.create_index("encounter_id", unique=True)
+
+    checkpoint = Checkpoint(checkpoint_path)
+    if checkpoint.contiguous:
+        print(f"↩️  Resuming after batch {checkpoint.contiguous:,}")
+
+    start = time.perf_counter()
+    inserted = 0
+    pending = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch_number, docs in read_batches(path, batch_size, checkpoint.contiguous):
+            # Keep at most two batches per worker in flight to bound memory
+            while len(pending) >= workers * 2:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    inserted += future.result()
+                    checkpoint.mark(pending.pop(future))
+
+            pending[pool.submit(insert_batch, collection, docs)] = batch_number
+
+            elapsed = time.perf_counter() - start
+            if batch_number % 10 == 0 and elapsed > 0:
+                print(f"   {inserted:,} rows ({inserted / elapsed:,.0f} rows/sec)")
+
+        for future in list(pending):
+            inserted += future.result()
+            checkpoint.mark(pending.pop(future))
+
+    return inserted, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load diabetic_data.csv into MongoDB")
+    parser.add_argument("csv_path")
+    parser.add_argument("--uri", default=None, help="overrides DIABETES_MONGO_URI")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--checkpoint", default=None,
+                        help="file used to resume an interrupted load")
+    args = parser.parse_args()
+
+    configure(uri=args.uri)
+    collection = get_collection()
+
+    print(f"📥 Loading {args.csv_path}...")
+    inserted, seconds = load_csv(
+        collection, args.csv_path, args.batch_size, args.workers, args.checkpoint
+    )
+    rate = inserted / seconds if seconds > 0 else 0
+    print(f"✅ Inserted {inserted:,} rows in {seconds:.1f}s ({rate:,.0f} rows/sec)")
+
+    # Parallel batches commit out of _id order, so refresh everything from scratch
+    rebuild_derived(collection)
+
+
+def rebuild_derived(collection):
+    """Recompute every collection derived from patient_data, e.g. after a load or a reset"""
+    # Memoized report results describe the old data
+    from result_cache import clear_results, note_writes
+    clear_results()
+    note_writes(collection)
+    rebuild_rollup(collection)
+    print("✅ patient_stats rollup rebuilt")
+    from sketches import rebuild_sketches
+    rebuild_sketches(collection)
+    print("✅ patient_sketches rebuilt")
+    from patients import rebuild_timelines
+    rebuild_timelines(collection)
+    print("✅ patient_timelines rebuilt")
+    from diagnoses import index_diagnoses
+    index_diagnoses(collection)
+    print("✅ Diagnosis groups indexed")
+    from cube import rebuild_cube  # cube imports this module's field lists
+    rebuild_cube(collection)
+    print("✅ patient_cube rebuilt")
+
+
+if __name__ == "__main__":
+    main()
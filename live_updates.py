@@ -0,0 +1,145 @@
+"""
+Server-sent events for the dashboard
+One producer thread watches the stats data version and fans deltas out to every subscriber
+"""
+import json
+import queue
+import threading
+
+# Queued in place of a lagging subscriber's backlog: its stream ends and EventSource reconnects
+CLOSE = ("close", None, None)
+
+# Delta key for a null readmitted value; the dashboard's readmissionKey() matches it
+UNKNOWN_KEY = "unknown"
+
+
+def format_event(event, data, event_id=None):
+    """Encode one SSE message"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def _readmission_map(stats):
+    """Readmission counts by value; a missing value is keyed as the dashboard keys it"""
+    return {
+        UNKNOWN_KEY if item["_id"] is None else str(item["_id"]): item["count"]
+        for item in stats.get("readmission_stats", [])
+    }
+
+
+def diff_stats(old, new):
+    """Only the parts of an /api/stats payload that changed"""
+    delta = {}
+    for key in ("total_patients", "unique_patients"):
+        if old.get(key) != new.get(key):
+            delta[key] = new.get(key)
+
+    averages = {
+        key: value for key, value in new.get("averages", {}).items()
+        if old.get("averages", {}).get(key) != value
+    }
+    if averages:
+        delta["averages"] = averages
+
+    old_counts, new_counts = _readmission_map(old), _readmission_map(new)
+    readmission = {key: count for key, count in new_counts.items() if old_counts.get(key) != count}
+    if readmission:
+        delta["readmission_counts"] = readmission
+    return delta
+
+
+class StatsBroadcaster:
+    def __init__(self, fetch, interval=2.0, heartbeat=15.0, max_queue=16):
+        """fetch() returns (payload, version); it is called only by the producer thread"""
+        self.fetch = fetch
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.max_queue = max_queue
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._latest = None
+        self._version = None
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._latest is not None:
+                subscriber.put(("snapshot", self._latest, self._version))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._produce, daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _publish(self, event, data, version):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, data, version))
+            except queue.Full:
+                # A client that stopped reading is dropped; closing its stream makes the
+                # browser reconnect and start again from a fresh snapshot
+                self.unsubscribe(subscriber)
+                self._close(subscriber)
+
+    def _close(self, subscriber):
+        while True:
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            subscriber.put_nowait(CLOSE)
+        except queue.Full:
+            pass
+
+    def _produce(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                payload, version = self.fetch()
+                if self._latest is None:
+                    self._latest, self._version = payload, version
+                    self._publish("snapshot", payload, version)
+                elif version != self._version:
+                    delta = diff_stats(self._latest, payload)
+                    self._latest, self._version = payload, version
+                    if delta:
+                        self._publish("delta", delta, version)
+            except Exception as e:
+                print(f"❌ Live update failed: {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def stream(self):
+        """Generator of SSE text for one client, used as a streaming response body"""
+        subscriber = self.subscribe()
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event, data, version = subscriber.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                if event == CLOSE[0]:
+                    return
+                yield format_event(event, data, version)
+        finally:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,244 @@
+"""
+Load generator that simulates dashboard viewers against app.py
+Each virtual client follows the page's request pattern (/ and /test once, then /api/stats
+every poll interval, or one /api/stream connection), started gradually over a ramp-up.
+Polls go out at a fixed rate and latency counts from each poll's scheduled time, so a
+stalled server shows up in the percentiles instead of just slowing the generator down.
+With --serve the generator and the server share one process and one GIL; measure against
+a separate server process for numbers that reflect the server alone.
+
+Usage:
+    python loadtest.py --serve --stand-in --seed 20000 --clients 200 --interval 5 --duration 60
+    python loadtest.py --url http://localhost:5000 --clients 500 --ramp-up 60 --output load.json
+    python loadtest.py --url http://localhost:5001 --clients 500 --ramp-up 60   # async_app
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.request
+
+import connection
+from compare_servers import percentile
+
+PAGE_LOAD = ["/", "/test"]
+POLL_PATH = "/api/stats"
+STREAM_PATH = "/api/stream"
+# A poll sent this long after its scheduled time counts as late
+LATE_S = 0.01
+
+
+class Recorder:
+    """Thread-safe log of (path, started, latency, ok, late) samples and missed sends per path"""
+
+    def __init__(self):
+        self.samples = []
+        self.missed = {}
+        self._lock = threading.Lock()
+
+    def add(self, path, started, latency, ok, late=False):
+        with self._lock:
+            self.samples.append((path, started, latency, ok, late))
+
+    def miss(self, path, count):
+        with self._lock:
+            self.missed[path] = self.missed.get(path, 0) + count
+
+
+def timed_get(base_url, path, timeout, recorder, scheduled=None):
+    """GET one path; latency runs from `scheduled` when given, else from the send"""
+    sent = time.perf_counter()
+    started = sent if scheduled is None else scheduled
+    try:
+        with urllib.request.urlopen(base_url + path, timeout=timeout) as response:
+            response.read()
+            ok = response.status == 200
+    except Exception:
+        ok = False
+    recorder.add(path, started, time.perf_counter() - started, ok, sent - started > LATE_S)
+    return ok
+
+
+def poll_client(base_url, stop_at, interval, timeout, recorder):
+    """A dashboard tab on the polling fallback
+
+    The k-th poll is due at first + k * interval however long earlier polls took, so
+    waiting on a slow response cannot thin out the requests that would have seen it.
+    """
+    for path in PAGE_LOAD:
+        timed_get(base_url, path, timeout, recorder)
+    due = time.perf_counter()
+    while due < stop_at:
+        time.sleep(max(0.0, due - time.perf_counter()))
+        timed_get(base_url, POLL_PATH, timeout, recorder, scheduled=due)
+        due += interval
+        behind = time.perf_counter() - due
+        if behind >= interval:
+            # The page's timer does not queue up ticks missed during a slow request
+            skipped = int(behind // interval)
+            recorder.miss(POLL_PATH, skipped)
+            due += skipped * interval
+
+
+def stream_client(base_url, stop_at, interval, timeout, recorder):
+    """A dashboard tab on live updates: latency is time to the snapshot event"""
+    for path in PAGE_LOAD:
+        timed_get(base_url, path, timeout, recorder)
+    while time.perf_counter() < stop_at:
+        started = time.perf_counter()
+        try:
+            # Reads may idle until the server's 15s heartbeat
+            with urllib.request.urlopen(base_url + STREAM_PATH, timeout=max(timeout, 20.0)) as response:
+                first = True
+                for line in response:
+                    if first and line.startswith(b"data:"):
+                        recorder.add(STREAM_PATH, started, time.perf_counter() - started, True)
+                        first = False
+                    if time.perf_counter() >= stop_at:
+                        return
+        except Exception:
+            recorder.add(STREAM_PATH, started, time.perf_counter() - started, False)
+            # EventSource waits before reconnecting
+            time.sleep(min(3.0, max(0.0, stop_at - time.perf_counter())))
+
+
+CLIENTS = {"poll": poll_client, "stream": stream_client}
+
+
+def summarize(samples, seconds, missed=0):
+    latencies = sorted(latency for _, _, latency, ok, _ in samples if ok)
+    errors = sum(1 for _, _, _, ok, _ in samples if not ok)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": errors / len(samples) if samples else 0.0,
+        "late_sends": sum(1 for *_, late in samples if late),
+        "missed_sends": missed,
+        "throughput_rps": len(samples) / seconds if seconds > 0 else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+
+def run_load(base_url, clients=50, ramp_up=10.0, duration=60.0, interval=30.0, mode="poll", timeout=10.0):
+    """Start `clients` virtual viewers evenly over `ramp_up` seconds and run for `duration`"""
+    base_url = base_url.rstrip("/")
+    recorder = Recorder()
+    start = time.perf_counter()
+    stop_at = start + duration
+    target = CLIENTS[mode]
+
+    threads = []
+    for i in range(clients):
+        delay = ramp_up * i / clients
+        # Jitter the first poll so clients started together do not stay in lockstep
+        offset = random.uniform(0, min(interval, 1.0))
+
+        def client(delay=delay + offset):
+            time.sleep(delay)
+            if time.perf_counter() < stop_at:
+                target(base_url, stop_at, interval, timeout, recorder)
+
+        thread = threading.Thread(target=client, daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join(timeout=max(0.0, stop_at - time.perf_counter()) + timeout + 5)
+    # Open streams only notice the deadline at their next event or heartbeat
+    elapsed = min(time.perf_counter() - start, duration)
+
+    samples = list(recorder.samples)
+    paths = sorted({path for path, *_ in samples})
+    return {
+        "config": {
+            "url": base_url, "clients": clients, "ramp_up_s": ramp_up, "duration_s": duration,
+            "interval_s": interval, "mode": mode,
+        },
+        "elapsed_s": elapsed,
+        "overall": summarize(samples, elapsed, sum(recorder.missed.values())),
+        "endpoints": {
+            path: summarize([s for s in samples if s[0] == path], elapsed, recorder.missed.get(path, 0))
+            for path in paths
+        },
+    }
+
+
+def print_table(report):
+    config = report["config"]
+    print(f"\n📈 {config['clients']} {config['mode']} clients against {config['url']} "
+          f"for {report['elapsed_s']:.0f}s (ramp-up {config['ramp_up_s']:.0f}s, every {config['interval_s']:.0f}s)\n")
+    print(f"{'endpoint':<15} {'requests':>9} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>8}"
+          f" {'late':>6} {'missed':>7}")
+    rows = list(report["endpoints"].items()) + [("all", report["overall"])]
+    for path, stats in rows:
+        print(f"{path:<15} {stats['requests']:>9} {stats['throughput_rps']:>8.1f} {stats['p50_ms']:>9.1f} "
+              f"{stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['error_rate']:>7.1%}"
+              f" {stats['late_sends']:>6} {stats['missed_sends']:>7}")
+
+
+def serve_in_background(port):
+    """Run app.py's Flask app on a threaded WSGI server inside this process"""
+    from werkzeug.serving import make_server
+    import app as web
+
+    web.start_prepare_database(background=False)
+    server = make_server("127.0.0.1", port, web.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate dashboard viewers and measure the API under load")
+    parser.add_argument("--url", default="http://localhost:5000", help="server to load")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="seconds to start every client")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds from the first client")
+    parser.add_argument("--interval", type=float, default=30.0, help="poll interval, 30s in the dashboard")
+    parser.add_argument("--mode", choices=list(CLIENTS), default="poll",
+                        help="poll /api/stats, or hold an /api/stream connection")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--serve", action="store_true", help="start app.py in-process instead of using --url")
+    parser.add_argument("--port", type=int, default=5050, help="port for --serve")
+    parser.add_argument("--stand-in", action="store_true", help="with --serve, use an in-process mongomock client")
+    parser.add_argument("--seed", type=int, default=0, help="replace the collection with N synthetic encounters first")
+    parser.add_argument("--json", action="store_true", help="print the JSON report instead of the table")
+    parser.add_argument("--output", default=None, help="write the JSON report here")
+    args = parser.parse_args()
+
+    if args.stand_in:
+        import mongomock
+        connection.use_client(mongomock.MongoClient())
+    if args.seed:
+        from synthetic import seed_collection
+        print(f"🧪 Seeding {args.seed:,} synthetic encounters...")
+        seed_collection(connection.get_collection(), args.seed, reset=True)
+
+    url = args.url
+    server = None
+    if args.serve:
+        server, url = serve_in_background(args.port)
+        print(f"🚀 Serving app.py at {url}")
+        print("⚠️  The server shares this process and its GIL with the load generator; "
+              "use --url against a separate server for server-only numbers")
+
+    try:
+        report = run_load(url, args.clients, args.ramp_up, args.duration, args.interval, args.mode, args.timeout)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_table(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Medication bitsets and co-prescription analysis
+Packs each encounter's prescribed drugs and dose changes into bits, then answers pairwise
+co-prescription and per-combination readmission questions with AND + popcount
+"""
+import argparse
+
+import numpy as np
+
+from advanced_analysis import READMITTED_VALUES
+from connection import get_collection
+from ingest import MEDICATION_FIELDS
+
+NOT_PRESCRIBED = "No"
+DOSE_CHANGES = ("Up", "Down")
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:
+    # NumPy < 2.0: count bits a byte at a time
+    _BYTE_COUNTS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(words):
+        return _BYTE_COUNTS[np.ascontiguousarray(words).view(np.uint8)]
+
+
+def _pack(flags):
+    """(drugs, encounters) booleans -> (drugs, words) uint64 bit matrix"""
+    drugs, size = flags.shape
+    padded = np.zeros((drugs, -(-size // 64) * 64), dtype=bool)
+    padded[:, :size] = flags
+    return np.packbits(padded, axis=1, bitorder="little").view(np.uint64)
+
+
+def _row_masks(flags):
+    """One uint32 per encounter with bit i set for drug i (23 drugs fit)"""
+    weights = (1 << np.arange(flags.shape[0], dtype=np.uint32)).astype(np.uint32)
+    return (flags.T.astype(np.uint32) * weights).sum(axis=1, dtype=np.uint32)
+
+
+class MedicationBitsets:
+    """Drug-major packed bits for pairwise counts, plus a per-encounter drug mask"""
+
+    def __init__(self, prescribed, changed, readmitted, drugs=MEDICATION_FIELDS):
+        self.drugs = list(drugs)
+        self.size = readmitted.shape[0]
+        self.prescribed = _pack(prescribed)
+        self.changed = _pack(changed)
+        self.readmitted = _pack(readmitted[np.newaxis, :])[0]
+        self.masks = _row_masks(prescribed)
+        self.readmitted_flags = readmitted
+
+    @classmethod
+    def from_collection(cls, collection, batch_size=10000):
+        """Single projected pass over the collection"""
+        projection = {field: 1 for field in MEDICATION_FIELDS + ["readmitted"]}
+        projection["_id"] = 0
+
+        prescribed, changed, readmitted = [], [], []
+        for doc in collection.find({}, projection, batch_size=batch_size):
+            values = [doc.get(drug) for drug in MEDICATION_FIELDS]
+            prescribed.append([v is not None and v != NOT_PRESCRIBED for v in values])
+            changed.append([v in DOSE_CHANGES for v in values])
+            readmitted.append(doc.get("readmitted") in READMITTED_VALUES)
+
+        shape = (len(readmitted), len(MEDICATION_FIELDS))
+        return cls(
+            np.asarray(prescribed, dtype=bool).reshape(shape).T,
+            np.asarray(changed, dtype=bool).reshape(shape).T,
+            np.asarray(readmitted, dtype=bool),
+        )
+
+    def save(self, path):
+        np.savez_compressed(
+            path, drugs=np.asarray(self.drugs), size=self.size,
+            prescribed=self.prescribed, changed=self.changed, readmitted=self.readmitted,
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        size = int(data["size"])
+
+        def unpack(words):
+            return np.unpackbits(words.view(np.uint8), axis=-1, bitorder="little")[..., :size].astype(bool)
+
+        return cls(unpack(data["prescribed"]), unpack(data["changed"]),
+                   unpack(data["readmitted"]), drugs=data["drugs"].tolist())
+
+    def pair_counts(self, kind="prescribed", readmitted_only=False):
+        """drugs x drugs matrix of encounters with both drugs; the diagonal is each drug alone"""
+        bits = getattr(self, kind)
+        if readmitted_only:
+            bits = bits & self.readmitted
+        counts = np.empty((len(self.drugs), len(self.drugs)), dtype=np.int64)
+        for i in range(len(self.drugs)):
+            # One broadcast AND per drug covers its whole row of the matrix
+            counts[i] = _popcount(bits[i] & bits).sum(axis=-1, dtype=np.int64)
+        return counts
+
+    def co_prescription(self, kind="prescribed"):
+        """Pairwise encounter counts and readmission rates"""
+        counts = self.pair_counts(kind)
+        readmitted = self.pair_counts(kind, readmitted_only=True)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rates = np.where(counts > 0, readmitted / counts, np.nan)
+        return {"drugs": self.drugs, "counts": counts, "readmitted": readmitted, "rates": rates}
+
+    def top_pairs(self, kind="prescribed", limit=10, min_count=1):
+        matrix = self.co_prescription(kind)
+        pairs = []
+        for i, j in zip(*np.triu_indices(len(self.drugs), k=1)):
+            count = int(matrix["counts"][i, j])
+            if count >= min_count:
+                pairs.append({
+                    "drugs": [self.drugs[i], self.drugs[j]],
+                    "encounters": count,
+                    "readmission_rate": float(matrix["rates"][i, j]),
+                })
+        pairs.sort(key=lambda p: -p["encounters"])
+        return pairs[:limit]
+
+    def combinations(self, min_count=1):
+        """Readmission rate for every exact set of prescribed drugs, most common first"""
+        masks, inverse, counts = np.unique(self.masks, return_inverse=True, return_counts=True)
+        readmitted = np.bincount(inverse, weights=self.readmitted_flags, minlength=len(masks))
+        results = []
+        for mask, count, hits in zip(masks, counts, readmitted):
+            if count < min_count:
+                continue
+            results.append({
+                "drugs": [drug for bit, drug in enumerate(self.drugs) if int(mask) >> bit & 1],
+                "encounters": int(count),
+                "readmission_rate": float(hits / count),
+            })
+        results.sort(key=lambda r: -r["encounters"])
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Co-prescription analysis over medication bitsets")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--min-count", type=int, default=30,
+                        help="skip pairs and combinations seen fewer times than this")
+    parser.add_argument("--changes", action="store_true", help="pair dose changes instead of prescriptions")
+    parser.add_argument("--save", default=None, help="write the bitsets to an .npz file")
+    parser.add_argument("--load", default=None, help="read bitsets from an .npz file instead of MongoDB")
+    args = parser.parse_args()
+
+    if args.load:
+        bitsets = MedicationBitsets.load(args.load)
+    else:
+        bitsets = MedicationBitsets.from_collection(get_collection())
+    print(f"💊 {bitsets.size:,} encounters x {len(bitsets.drugs)} drugs packed into bitsets")
+    if args.save:
+        bitsets.save(args.save)
+        print(f"💾 Bitsets written to {args.save}")
+
+    kind = "changed" if args.changes else "prescribed"
+    print(f"\n🔗 Most common drug pairs ({kind}):")
+    for pair in bitsets.top_pairs(kind, args.limit, args.min_count):
+        print(f"   {' + '.join(pair['drugs'])}: {pair['encounters']:,} encounters, "
+              f"{pair['readmission_rate'] * 100:.1f}% readmitted")
+
+    print("\n🧩 Most common drug combinations:")
+    for combo in bitsets.combinations(args.min_count)[:args.limit]:
+        label = " + ".join(combo["drugs"]) or "no diabetes drugs"
+        print(f"   {label}: {combo['encounters']:,} encounters, "
+              f"{combo['readmission_rate'] * 100:.1f}% readmitted")
+
+
+if __name__ == "__main__":
+    main()
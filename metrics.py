@@ -0,0 +1,377 @@
+"""
+Per-query instrumentation for every MongoDB call
+Duration histograms, documents returned/examined, cache hits and a slow-query log,
+exposed in the Prometheus text format
+"""
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DURATION_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+SLOW_QUERY_MS = float(os.environ.get("DIABETES_SLOW_QUERY_MS", 500))
+SLOW_QUERY_LOG = os.environ.get("DIABETES_SLOW_QUERY_LOG", "slow_queries.log")
+# Fraction of ordinary calls that are also explained to sample documents examined
+EXPLAIN_SAMPLE_RATE = float(os.environ.get("DIABETES_EXPLAIN_SAMPLE_RATE", 0))
+# Explaining re-runs the query: each query shape at most once per interval, on a few threads
+EXPLAIN_INTERVAL_S = float(os.environ.get("DIABETES_EXPLAIN_INTERVAL_S", 300))
+EXPLAIN_WORKERS = 2
+EXPLAIN_BACKLOG = 8
+
+_label = contextvars.ContextVar("query_label", default=None)
+_explainable = contextvars.ContextVar("explainable", default=True)
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_explained = {}
+_explain_pending = 0
+_explainer = None
+
+
+def _inc(metric, labels, amount=1):
+    key = (metric, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(query, operation, seconds, returned):
+    """Record one completed MongoDB call"""
+    labels = (("operation", operation), ("query", query))
+    with _lock:
+        histogram = _histograms.setdefault(labels, {
+            "buckets": [0] * len(DURATION_BUCKETS), "sum": 0.0, "count": 0,
+        })
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+    if returned is not None:
+        _inc("diabetes_query_documents_returned_total", dict(labels), returned)
+
+
+def record_cache(cache, label, hit):
+    """Count a cache lookup; label must come from a small fixed set (endpoint, query kind)"""
+    _inc("diabetes_cache_requests_total",
+         {"cache": cache, "label": label, "result": "hit" if hit else "miss"})
+
+
+@contextlib.contextmanager
+def query_label(name):
+    """Label every MongoDB call made inside the block with a query name"""
+    token = _label.set(name)
+    try:
+        yield
+    finally:
+        _label.reset(token)
+
+
+@contextlib.contextmanager
+def unexplained():
+    """Never explain the calls made inside the block, e.g. exports paced by their reader"""
+    token = _explainable.set(False)
+    try:
+        yield
+    finally:
+        _explainable.reset(token)
+
+
+def labelled(fn):
+    """Decorator form of query_label, using the function name"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with query_label(fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def _explain_stats(explain):
+    """Pull totalDocsExamined/nReturned out of executionStats, wherever it sits"""
+    if isinstance(explain, dict):
+        stats = explain.get("executionStats")
+        if isinstance(stats, dict) and "totalDocsExamined" in stats:
+            return stats["totalDocsExamined"], stats.get("nReturned")
+        for value in explain.values():
+            found = _explain_stats(value)
+            if found:
+                return found
+    elif isinstance(explain, list):
+        for item in explain:
+            found = _explain_stats(item)
+            if found:
+                return found
+    return None
+
+
+def _log_slow(query, operation, seconds, plan):
+    _inc("diabetes_slow_queries_total", {"operation": operation, "query": query})
+    print(f"🐢 Slow query {query} ({operation}): {seconds * 1000:.0f} ms")
+    entry = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "query": query,
+        "operation": operation,
+        "duration_ms": round(seconds * 1000, 1),
+        "plan": plan,
+    }
+    with _lock, open(SLOW_QUERY_LOG, "a") as f:
+        f.write(json.dumps(entry, default=str) + "\n")
+
+
+def _explain(query, operation, explain_fn, seconds, slow):
+    global _explain_pending
+    try:
+        try:
+            plan = explain_fn()
+        except Exception as e:
+            plan = {"error": str(e)}
+        stats = _explain_stats(plan)
+        labels = {"operation": operation, "query": query}
+        if stats:
+            _inc("diabetes_query_documents_examined_total", labels, stats[0])
+            _inc("diabetes_query_explained_total", labels)
+        if slow:
+            _log_slow(query, operation, seconds, plan)
+    finally:
+        with _lock:
+            _explain_pending -= 1
+
+
+def _claim_explain(query, operation):
+    """True when this query shape may be explained now; starts the explain pool on first use"""
+    global _explain_pending, _explainer
+    now = time.monotonic()
+    with _lock:
+        last = _explained.get((query, operation))
+        if last is not None and now - last < EXPLAIN_INTERVAL_S:
+            return False
+        if _explain_pending >= EXPLAIN_BACKLOG:
+            return False
+        _explained[(query, operation)] = now
+        _explain_pending += 1
+        if _explainer is None:
+            _explainer = ThreadPoolExecutor(max_workers=EXPLAIN_WORKERS, thread_name_prefix="explain")
+        return True
+
+
+def _after_call(query, operation, seconds, returned, explain_fn):
+    observe(query, operation, seconds, returned)
+    slow = seconds * 1000 >= SLOW_QUERY_MS
+    sampled = EXPLAIN_SAMPLE_RATE and random.random() < EXPLAIN_SAMPLE_RATE
+    if explain_fn is not None and (slow or sampled) and _claim_explain(query, operation):
+        # Keep the re-run off the request path
+        _explainer.submit(_explain, query, operation, explain_fn, seconds, slow)
+    elif slow:
+        # Explained recently (or too many explains queued): log without a plan
+        _log_slow(query, operation, seconds, None)
+
+
+class InstrumentedCursor:
+    """Times a find() cursor's fetches, leaving out the time the caller spends between rows"""
+
+    def __init__(self, collection, cursor, filter, projection, query):
+        self._collection = collection
+        self._cursor = cursor
+        self._spec = {"filter": filter or {}, "projection": projection, "sort": None, "limit": 0}
+        self._query = query
+        self._explainable = _explainable.get()
+
+    def sort(self, key_or_list, direction=None):
+        self._cursor = self._cursor.sort(key_or_list, direction)
+        self._spec["sort"] = key_or_list if direction is None else [(key_or_list, direction)]
+        return self
+
+    def limit(self, limit):
+        self._cursor = self._cursor.limit(limit)
+        self._spec["limit"] = limit
+        return self
+
+    def _explain(self):
+        cursor = self._collection.find(self._spec["filter"], self._spec["projection"])
+        if self._spec["sort"]:
+            cursor = cursor.sort(self._spec["sort"])
+        if self._spec["limit"]:
+            cursor = cursor.limit(self._spec["limit"])
+        return cursor.explain()
+
+    def __iter__(self):
+        cursor = iter(self._cursor)
+        seconds = 0
+        returned = 0
+        while True:
+            # Only time spent inside the driver counts; a slow reader is not a slow query
+            start = time.perf_counter()
+            try:
+                doc = next(cursor)
+            except StopIteration:
+                break
+            finally:
+                seconds += time.perf_counter() - start
+            returned += 1
+            yield doc
+        _after_call(self._query, "find", seconds, returned, self._explain if self._explainable else None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedCommandCursor:
+    """Wraps an aggregate() CommandCursor, timed over the command and every batch fetch"""
+
+    def __init__(self, cursor, query, seconds, explain_fn):
+        self._cursor = cursor
+        self._query = query
+        self._seconds = seconds
+        self._explain_fn = explain_fn if _explainable.get() else None
+        self._returned = 0
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            doc = next(self._cursor)
+        except StopIteration:
+            self._seconds += time.perf_counter() - start
+            if not self._done:
+                self._done = True
+                _after_call(self._query, "aggregate", self._seconds, self._returned, self._explain_fn)
+            raise
+        self._seconds += time.perf_counter() - start
+        self._returned += 1
+        return doc
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedCollection:
+    """Proxy for a pymongo Collection that records every read it serves"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def _query(self, operation):
+        return _label.get() or f"{self._collection.name}.{operation}"
+
+    def _timed(self, operation, call, returned_fn, explain_fn=None):
+        start = time.perf_counter()
+        result = call()
+        returned = returned_fn(result)
+        if not _explainable.get():
+            explain_fn = None
+        _after_call(self._query(operation), operation, time.perf_counter() - start, returned, explain_fn)
+        return result
+
+    def aggregate(self, pipeline, **kwargs):
+        collection = self._collection
+
+        def explain():
+            return collection.database.command(
+                "explain", {"aggregate": collection.name, "pipeline": pipeline, "cursor": {}},
+                verbosity="executionStats",
+            )
+
+        # Recorded when the caller exhausts the cursor, so the timing covers every batch
+        started = time.perf_counter()
+        cursor = collection.aggregate(pipeline, **kwargs)
+        return InstrumentedCommandCursor(cursor, self._query("aggregate"), time.perf_counter() - started, explain)
+
+    def find(self, filter=None, projection=None, *args, **kwargs):
+        cursor = self._collection.find(filter, projection, *args, **kwargs)
+        return InstrumentedCursor(self._collection, cursor, filter, projection, self._query("find"))
+
+    def find_one(self, *args, **kwargs):
+        return self._timed("find_one", lambda: self._collection.find_one(*args, **kwargs),
+                           lambda doc: 0 if doc is None else 1)
+
+    def count_documents(self, filter, **kwargs):
+        return self._timed("count_documents", lambda: self._collection.count_documents(filter, **kwargs),
+                           lambda count: 1)
+
+    def estimated_document_count(self, **kwargs):
+        return self._timed("estimated_document_count",
+                           lambda: self._collection.estimated_document_count(**kwargs), lambda count: 1)
+
+    def update_one(self, *args, **kwargs):
+        return self._timed("update_one", lambda: self._collection.update_one(*args, **kwargs),
+                           lambda result: None)
+
+    @property
+    def database(self):
+        return InstrumentedDatabase(self._collection.database)
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+class InstrumentedDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name):
+        return InstrumentedCollection(self._database[name])
+
+    def __getattr__(self, name):
+        return getattr(self._database, name)
+
+
+def _format_labels(labels):
+    inner = ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in labels)
+    return "{" + inner + "}" if inner else ""
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = [
+        "# HELP diabetes_query_duration_seconds Duration of MongoDB calls by query",
+        "# TYPE diabetes_query_duration_seconds histogram",
+    ]
+    with _lock:
+        histograms = {k: dict(v, buckets=list(v["buckets"])) for k, v in _histograms.items()}
+        counters = dict(_counters)
+
+    for labels, histogram in sorted(histograms.items()):
+        for bound, count in zip(DURATION_BUCKETS, histogram["buckets"]):
+            lines.append(f"diabetes_query_duration_seconds_bucket"
+                         f"{_format_labels(labels + (('le', bound),))} {count}")
+        lines.append(f"diabetes_query_duration_seconds_bucket"
+                     f"{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+        lines.append(f"diabetes_query_duration_seconds_sum{_format_labels(labels)} {histogram['sum']}")
+        lines.append(f"diabetes_query_duration_seconds_count{_format_labels(labels)} {histogram['count']}")
+
+    help_text = {
+        "diabetes_query_documents_returned_total": "Documents returned to the client",
+        "diabetes_query_documents_examined_total": "Documents examined, from explain() samples",
+        "diabetes_query_explained_total": "Calls explained to measure documents examined",
+        "diabetes_slow_queries_total": f"Calls slower than {SLOW_QUERY_MS:.0f} ms",
+        "diabetes_cache_requests_total": "Response and result cache lookups by result",
+    }
+    for metric, text in help_text.items():
+        series = sorted((labels, value) for (name, labels), value in counters.items() if name == metric)
+        if not series:
+            continue
+        lines.append(f"# HELP {metric} {text}")
+        lines.append(f"# TYPE {metric} counter")
+        for labels, value in series:
+            lines.append(f"{metric}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _explained.clear()
@@ -0,0 +1,245 @@
+"""
+Partitioned parallel execution of the advanced analyses
+Each pipeline runs as one partial aggregation per key range, concurrently, emitting counts and
+sums instead of averages; the partials are merged on the client into exactly the rows the
+single pipeline returns, so one analysis is no longer limited to one server-side thread
+"""
+import argparse
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+
+from advanced_analysis import AGE_GROUP_PIPELINE, MEDICATION_IMPACT_PIPELINE, READMISSION_RISK_PIPELINE
+from aggregation import final, finish_stages, merge, sort_documents
+from metrics import query_label
+from result_cache import CachedCollection, analysis_collection
+
+PARTITIONS_ENV = "DIABETES_PARTITIONS"
+WORKERS_ENV = "DIABETES_PARTITION_WORKERS"
+PARTITION_KEYS = ["_id", "encounter_id"]
+# Sampled keys per partition when choosing range boundaries
+OVERSAMPLE = 32
+# Stages that act on one document at a time, so they give the same rows per partition
+DOCUMENT_STAGES = {"$match", "$project", "$addFields", "$set", "$unset", "$unwind"}
+# Stages after the grouping, run on the merged groups
+FINAL_STAGES = {"$sort", "$limit", "$match"}
+TYPE_ALIASES = {ObjectId: "objectId", int: "number", float: "number", str: "string"}
+
+PIPELINES = {
+    "predict_readmission_risk": READMISSION_RISK_PIPELINE,
+    "analyze_medication_impact": MEDICATION_IMPACT_PIPELINE,
+    "age_group_analysis": AGE_GROUP_PIPELINE,
+}
+
+
+def _partial_output(output):
+    """Mergeable accumulators for a $group/$bucket output: $avg becomes a sum and a count"""
+    partial, accumulators = {}, []
+    for name, accumulator in output.items():
+        (operator, operand), = accumulator.items()
+        if operator == "$avg":
+            partial[f"{name}__sum"] = {"$sum": operand}
+            # $avg skips non-numeric values, so count only the numbers
+            partial[f"{name}__n"] = {"$sum": {"$cond": [{"$isNumber": operand}, 1, 0]}}
+        elif operator in ("$sum", "$min", "$max"):
+            partial[name] = accumulator
+        else:
+            raise ValueError(f"{operator} has no mergeable partial form")
+        accumulators.append((name, operator))
+    return partial, accumulators
+
+
+def split_pipeline(pipeline):
+    """(per-partition pipeline, grouping stage name, accumulators, stages to run after merging)"""
+    head, grouping, tail = [], None, []
+    for stage in pipeline:
+        (operator, spec), = stage.items()
+        if grouping is not None:
+            if operator not in FINAL_STAGES:
+                raise ValueError(f"{operator} after the grouping cannot run on merged partials")
+            tail.append((operator, spec))
+        elif operator in ("$group", "$bucket"):
+            grouping = (operator, spec)
+        elif operator in DOCUMENT_STAGES:
+            head.append(stage)
+        else:
+            raise ValueError(f"{operator} before the grouping cannot run per partition")
+    if grouping is None:
+        raise ValueError("Only pipelines with a $group or $bucket stage can be partitioned")
+
+    operator, spec = grouping
+    if operator == "$group":
+        spec = dict(spec)
+        group_id = spec.pop("_id")
+        partial, accumulators = _partial_output(spec)
+        stage = {"$group": {"_id": group_id, **partial}}
+    else:
+        partial, accumulators = _partial_output(spec.get("output", {"count": {"$sum": 1}}))
+        stage = {"$bucket": {**spec, "output": partial}}
+    return head + [stage], operator, accumulators, tail
+
+
+def _hashable(value):
+    """Group _id as a dict key; compound _ids are documents"""
+    if isinstance(value, dict):
+        return tuple((name, _hashable(item)) for name, item in value.items())
+    if isinstance(value, list):
+        return tuple(_hashable(item) for item in value)
+    return value
+
+
+def merge_partials(partials, grouping, accumulators, tail):
+    """Combine per-partition rows into the rows the whole pipeline returns"""
+    groups = {}
+    for rows in partials:
+        for row in rows:
+            states = [
+                [row[f"{name}__sum"], row[f"{name}__n"]] if operator == "$avg" else row[name]
+                for name, operator in accumulators
+            ]
+            key = _hashable(row["_id"])
+            if key not in groups:
+                groups[key] = (row["_id"], states)
+                continue
+            merged = groups[key][1]
+            for i, (_, operator) in enumerate(accumulators):
+                merged[i] = merge(operator, merged[i], states[i])
+
+    rows = []
+    for group_id, states in groups.values():
+        row = {"_id": group_id}
+        for (name, operator), state in zip(accumulators, states):
+            row[name] = final(operator, state)
+        rows.append(row)
+    if grouping == "$bucket":
+        # $bucket emits its buckets in boundary order
+        rows = sort_documents(rows, [("_id", 1)])
+    return list(finish_stages(rows, tail))
+
+
+def partition_filters(collection, partitions, key="_id"):
+    """Disjoint filters that together match every document exactly once
+
+    Range boundaries are quantiles of a $sample of the key, so partitions hold similar
+    numbers of documents however the key values are spread.
+    """
+    if partitions <= 1:
+        return [{}]
+    sample = collection.aggregate([
+        {"$sample": {"size": partitions * OVERSAMPLE}},
+        {"$project": {key: 1}},
+    ])
+    values = [doc.get(key) for doc in sample]
+    kinds = Counter(TYPE_ALIASES.get(type(value)) for value in values)
+    kinds.pop(None, None)
+    if not kinds:
+        return [{}]
+    kind = kinds.most_common(1)[0][0]
+    values = sorted({value for value in values if TYPE_ALIASES.get(type(value)) == kind})
+    bounds = sorted({values[len(values) * i // partitions] for i in range(1, partitions)})
+
+    filters = [{key: {"$lt": bounds[0]}}]
+    filters += [{key: {"$gte": low, "$lt": high}} for low, high in zip(bounds, bounds[1:])]
+    filters.append({key: {"$gte": bounds[-1]}})
+    # Range predicates only match values of the bounds' type; nulls, missing keys and
+    # other types make up one more partition
+    filters.append({key: {"$not": {"$type": kind}}})
+    return filters
+
+
+def _run_partition(collection, pipeline, match, label):
+    with query_label(f"{label}.partition"):
+        return list(collection.aggregate([{"$match": match}] + pipeline))
+
+
+def partitioned_aggregate(collection, pipeline, filters, workers=4, label="partitioned", targets=None):
+    """Run the pipeline once per filter on a thread pool and merge the partial results
+
+    `targets` are collections holding the same data (e.g. the collection read through
+    different secondaries); partitions are spread across them round-robin.
+    """
+    partial, grouping, accumulators, tail = split_pipeline(pipeline)
+    targets = targets or [collection]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [
+            pool.submit(_run_partition, targets[i % len(targets)], partial, match, label)
+            for i, match in enumerate(filters)
+        ]
+        partials = [future.result() for future in futures]
+    return merge_partials(partials, grouping, accumulators, tail)
+
+
+class PartitionedStore:
+    """AdvancedDiabetesAnalysis backend: every analysis split across key-range partitions"""
+
+    def __init__(self, collection, partitions=None, workers=None, key="_id", targets=None):
+        self.cache = collection if isinstance(collection, CachedCollection) else None
+        self.collection = collection.collection if self.cache else collection
+        self.workers = workers or int(os.environ.get(WORKERS_ENV, os.cpu_count() or 1))
+        self.partitions = partitions or int(os.environ.get(PARTITIONS_ENV, self.workers * 2))
+        self.key = key
+        self.targets = targets
+        self._filters = None
+
+    def filters(self):
+        """Chosen once, so every analysis of a report sees the same partitions"""
+        if self._filters is None:
+            self._filters = partition_filters(self.collection, self.partitions, self.key)
+        return self._filters
+
+    def aggregate(self, pipeline, label="partitioned"):
+        def compute():
+            return partitioned_aggregate(self.collection, pipeline, self.filters(), self.workers,
+                                         label, self.targets)
+        if self.cache is None:
+            return compute()
+        # The merged rows equal the whole pipeline's, so they share its result cache entry
+        return self.cache.memoize(("aggregate", pipeline), compute)
+
+    def predict_readmission_risk(self):
+        return self.aggregate(READMISSION_RISK_PIPELINE, "predict_readmission_risk")
+
+    def analyze_medication_impact(self):
+        return self.aggregate(MEDICATION_IMPACT_PIPELINE, "analyze_medication_impact")
+
+    def age_group_analysis(self):
+        return self.aggregate(AGE_GROUP_PIPELINE, "age_group_analysis")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each analysis as one pipeline and as merged partitions")
+    parser.add_argument("--partitions", type=int, default=None, help="default twice the workers")
+    parser.add_argument("--workers", type=int, default=None, help="default one per CPU")
+    parser.add_argument("--key", choices=PARTITION_KEYS, default="_id")
+    args = parser.parse_args()
+
+    # Both sides must really run, so bypass the result cache
+    os.environ["DIABETES_RESULT_CACHE"] = "off"
+    collection = analysis_collection()
+    store = PartitionedStore(collection, args.partitions, args.workers, args.key)
+    print(f"🧩 {len(store.filters())} partitions on {args.key}, {store.workers} workers")
+
+    mismatches = 0
+    for name, pipeline in PIPELINES.items():
+        started = time.perf_counter()
+        with query_label(name):
+            single = list(collection.aggregate(pipeline))
+        single_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        merged = store.aggregate(pipeline, name)
+        merged_s = time.perf_counter() - started
+
+        same = merged == single
+        mismatches += not same
+        print(f"   {name:<28} single {single_s * 1000:>8.1f} ms   partitioned {merged_s * 1000:>8.1f} ms"
+              f"   {single_s / merged_s if merged_s else 0:>5.2f}x   {'✅ identical' if same else '❌ differs'}")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Patient-level timeline index keyed by patient_nbr
+Each patient's encounters are kept in encounter order in patient_timelines and folded in
+incrementally, so unique-patient counts and per-patient lookups are single-document reads
+"""
+import argparse
+from collections import Counter
+
+from pymongo import UpdateOne
+
+from connection import get_collection
+from rollups import WINDOW_LAG_S, _delta_match, apply_once, refresh_window
+
+TIMELINE_ID = "patient_timelines"
+# Per-encounter fields copied into the timeline
+TIMELINE_FIELDS = [
+    "encounter_id", "age", "admission_type_id", "time_in_hospital", "num_medications",
+    "diag_1", "readmitted",
+]
+
+
+def _timeline_collection(collection):
+    return collection.database['patient_timelines']
+
+
+def _meta_collection(collection):
+    return collection.database['patient_stats']
+
+
+def timeline_pipeline(match):
+    """New encounters grouped per patient, already in encounter order"""
+    entry = {field: f"${field}" for field in TIMELINE_FIELDS}
+    return [
+        {"$match": match},
+        {"$sort": {"encounter_id": 1}},
+        {"$group": {"_id": "$patient_nbr", "encounters": {"$push": entry}}},
+    ]
+
+
+def _timeline_update(group, high):
+    return UpdateOne(
+        # Skipped (as a duplicate key) when a retry of the same window already reached this patient
+        {"_id": group["_id"], "window": {"$ne": high}},
+        {
+            # $sort keeps the timeline ordered when windows arrive out of order
+            "$push": {"encounters": {"$each": group["encounters"], "$sort": {"encounter_id": 1}}},
+            "$inc": {"count": len(group["encounters"])},
+            "$set": {"window": high},
+            # Marks the window that first saw the patient, to count new patients exactly
+            "$setOnInsert": {"first_window": high},
+        },
+        upsert=True,
+    )
+
+
+def refresh_timelines(collection, batch_size=1000, lag=WINDOW_LAG_S):
+    """Fold encounters inserted since the watermark into patient_timelines"""
+    timelines = _timeline_collection(collection)
+
+    def apply(watermark, high):
+        encounters = 0
+        batch = []
+        # The first build groups the whole collection, so let the $group spill to disk
+        # and write each batch as the cursor streams rather than holding every timeline
+        groups = collection.aggregate(timeline_pipeline(_delta_match(watermark, high)), allowDiskUse=True)
+        for group in groups:
+            if group["_id"] is None:
+                continue
+            batch.append(_timeline_update(group, high))
+            encounters += len(group["encounters"])
+            if len(batch) == batch_size:
+                apply_once(timelines, batch)
+                batch = []
+        apply_once(timelines, batch)
+        # Counted from the marker rather than upserts, so a re-applied window counts the same
+        timelines.create_index("first_window")
+        # Patients whose second encounter arrived in this window; marked once, so the
+        # repeat count is kept in the meta document instead of scanning the timelines
+        timelines.create_index([("repeat_window", 1), ("count", 1)])
+        timelines.update_many({"repeat_window": None, "count": {"$gt": 1}}, {"$set": {"repeat_window": high}})
+        return {
+            "patients": timelines.count_documents({"first_window": high}),
+            "repeat_patients": timelines.count_documents({"repeat_window": high}),
+            "encounters": encounters,
+        }
+
+    return refresh_window(collection, TIMELINE_ID, apply, lag=lag)
+
+
+def rebuild_timelines(collection):
+    """Drop every timeline and rebuild from scratch (needed after updates or deletes)"""
+    _timeline_collection(collection).drop()
+    # Keep counting versions up so readers notice the rebuild
+    _meta_collection(collection).update_one(
+        {"_id": TIMELINE_ID},
+        {"$set": {"watermark": None, "pending": None, "patients": 0, "repeat_patients": 0, "encounters": 0},
+         "$inc": {"version": 1}},
+        upsert=True,
+    )
+    # Rebuilds run once the writers are done, so fold in everything
+    return refresh_timelines(collection, lag=0)
+
+
+def timeline_meta(collection):
+    """The timelines' watermark, version and counters as last stored, without refreshing"""
+    return _meta_collection(collection).find_one({"_id": TIMELINE_ID}) or {}
+
+
+def unique_patients(meta):
+    """Distinct patients from timeline_meta(), or None until the first build has finished"""
+    if meta.get("watermark") is None:
+        return None
+    return meta.get("patients", 0)
+
+
+def readmission_chains(encounters):
+    """Runs of consecutive encounters joined by readmissions, as lists of encounter_ids"""
+    chains, current = [], []
+    for encounter in encounters:
+        current.append(encounter.get("encounter_id"))
+        # Both '<30' and '>30' mean this stay was followed by a readmission
+        if encounter.get("readmitted") in (None, "NO"):
+            if len(current) > 1:
+                chains.append(current)
+            current = []
+    if len(current) > 1:
+        chains.append(current)
+    return chains
+
+
+def patient_timeline(collection, patient_nbr):
+    """One patient's encounters and readmission chains from a single _id lookup"""
+    timeline = _timeline_collection(collection).find_one({"_id": patient_nbr})
+    if timeline is None:
+        return None
+    return {
+        "patient_nbr": patient_nbr,
+        "encounter_count": timeline["count"],
+        "encounters": timeline["encounters"],
+        "readmission_chains": readmission_chains(timeline["encounters"]),
+    }
+
+
+def patient_summary(collection, refresh=True):
+    """Unique and repeat patient counts from the maintained counters
+
+    With refresh=False the counters are read as stored (None before the first build).
+    """
+    meta = refresh_timelines(collection) if refresh else timeline_meta(collection)
+    patients = unique_patients(meta)
+    encounters = meta.get("encounters", 0)
+    return {
+        "unique_patients": patients,
+        "encounters": encounters,
+        "repeat_patients": None if patients is None else meta.get("repeat_patients", 0),
+        "encounters_per_patient": round(encounters / patients, 2) if patients else 0,
+    }
+
+
+def chain_lengths(collection):
+    """Counter of readmission chain lengths across every patient (reads the timelines only)"""
+    lengths = Counter()
+    projection = {"encounters.encounter_id": 1, "encounters.readmitted": 1}
+    for timeline in _timeline_collection(collection).find({"count": {"$gt": 1}}, projection):
+        lengths.update(len(chain) for chain in readmission_chains(timeline["encounters"]))
+    return lengths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the patient timeline index")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild every timeline from scratch")
+    parser.add_argument("--patient", type=int, default=None, help="print one patient's timeline")
+    args = parser.parse_args()
+
+    collection = get_collection()
+    if args.rebuild:
+        print("🔄 Rebuilding patient_timelines...")
+        rebuild_timelines(collection)
+
+    if args.patient is not None:
+        timeline = patient_timeline(collection, args.patient)
+        if timeline is None:
+            print(f"❌ No encounters for patient {args.patient}")
+            return
+        print(f"🧑 Patient {args.patient}: {timeline['encounter_count']} encounters")
+        for encounter in timeline["encounters"]:
+            print(f"   Encounter {encounter.get('encounter_id')}: {encounter.get('time_in_hospital')} days, "
+                  f"Readmitted: {encounter.get('readmitted', 'N/A')}")
+        for chain in timeline["readmission_chains"]:
+            print(f"   🔁 Readmission chain: {' -> '.join(str(e) for e in chain)}")
+        return
+
+    summary = patient_summary(collection)
+    print(f"👥 Unique patients: {summary['unique_patients']:,} "
+          f"({summary['encounters']:,} encounters, {summary['encounters_per_patient']} per patient)")
+    print(f"🔁 Patients with more than one encounter: {summary['repeat_patients']:,}")
+    print("📏 Readmission chain lengths:")
+    for length, count in sorted(chain_lengths(collection).items()):
+        print(f"   {length} encounters: {count:,} chains")
+
+
+if __name__ == "__main__":
+    main()
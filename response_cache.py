@@ -0,0 +1,227 @@
+"""
+HTTP response caching for the Flask API and the async (Quart) server
+Bounded in-process TTL store with ETag/304 and stale-while-revalidate
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import jsonify, request
+
+from metrics import record_cache
+from rollups import WINDOW_LAG_S, unsettled
+
+
+def data_version(collection):
+    """Cheap version stamp for a collection: newest _id plus the metadata count"""
+    newest = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    return _version(newest, collection.estimated_document_count())
+
+
+async def data_version_async(collection):
+    """data_version for an async (AsyncMongoClient) collection"""
+    newest, count = await asyncio.gather(
+        collection.find_one({}, {"_id": 1}, sort=[("_id", -1)]),
+        collection.estimated_document_count(),
+    )
+    return _version(newest, count)
+
+
+def _version(newest, count):
+    newest_id = newest["_id"] if newest else None
+    version = f"{newest_id}:{count}"
+    if unsettled(newest):
+        # Rollups hold back encounters inside the safety lag, so move the version on
+        # once per lag period until they settle and every rollup has folded them in
+        version += f":{int(time.time() // WINDOW_LAG_S)}"
+    return version
+
+
+class CacheEntry:
+    def __init__(self, payload, version, etag):
+        self.payload = payload
+        self.version = version
+        self.etag = etag
+        self.stored_at = time.monotonic()
+
+    def age(self):
+        return time.monotonic() - self.stored_at
+
+
+class ResponseCache:
+    # Per-key computation is serialised on a fixed pool of locks, so keys never leave
+    # locks behind; two keys sharing a stripe only wait for each other
+    LOCK_STRIPES = 64
+
+    def __init__(self, max_entries=128, ttl=10, stale_ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._refreshing = set()
+        # The async server's locks and revalidation tasks, on its event loop
+        self._async_key_locks = [asyncio.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._tasks = set()
+
+    def _key_lock(self, key):
+        return self._key_locks[hash(key) % self.LOCK_STRIPES]
+
+    def _async_key_lock(self, key):
+        return self._async_key_locks[hash(key) % self.LOCK_STRIPES]
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _make_etag(self, key, version, payload):
+        if version is None:
+            # No version available, fall back to hashing the body
+            version = json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.sha1(f"{key}|{version}".encode()).hexdigest()[:16]
+
+    def _unchanged(self, key, version):
+        """The current entry, marked fresh again, if it was computed at this data version"""
+        current = self._get(key)
+        if current is not None and version is not None and current.version == version:
+            current.stored_at = time.monotonic()
+            return current
+        return None
+
+    def _new_entry(self, key, version, payload):
+        entry = CacheEntry(payload, version, self._make_etag(key, version, payload))
+        self._store(key, entry)
+        return entry
+
+    def _refresh(self, key, compute, version_fn):
+        """Recompute an entry, skipping the work if the data version has not moved"""
+        version = version_fn() if version_fn else None
+        current = self._unchanged(key, version)
+        if current is not None:
+            return current
+        return self._new_entry(key, version, compute())
+
+    async def _refresh_async(self, key, compute, version_fn):
+        """_refresh with coroutine compute and version functions"""
+        version = await version_fn() if version_fn else None
+        current = self._unchanged(key, version)
+        if current is not None:
+            return current
+        return self._new_entry(key, version, await compute())
+
+    def _refresh_in_background(self, key, compute, version_fn):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                with self._key_lock(key):
+                    self._refresh(key, compute, version_fn)
+            except Exception as e:
+                print(f"❌ Background refresh failed for {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _lookup(self, key, label):
+        """(entry, stale) when the entry can be served, else (None, False) and a miss"""
+        entry = self._get(key)
+        if entry is not None and entry.age() < self.ttl + self.stale_ttl:
+            self.hits += 1
+            record_cache("response", label, hit=True)
+            return entry, entry.age() >= self.ttl
+        self.misses += 1
+        record_cache("response", label, hit=False)
+        return None, False
+
+    def get(self, key, compute, version_fn=None, label=None):
+        """Return a cache entry, computing it at most once across concurrent callers
+
+        label names the lookup in the metrics and defaults to key; pass one whenever
+        the key carries query parameters.
+        """
+        entry, stale = self._lookup(key, label or key)
+        if entry is not None:
+            if stale:
+                # Serve stale immediately and let a single background thread revalidate
+                self._refresh_in_background(key, compute, version_fn)
+            return entry
+
+        with self._key_lock(key):
+            # Another request may have filled the entry while we waited
+            entry = self._get(key)
+            if entry is not None and entry.age() < self.ttl:
+                return entry
+            return self._refresh(key, compute, version_fn)
+
+    async def get_async(self, key, compute, version_fn=None, label=None):
+        """get() for the async server: compute and version_fn are coroutine functions"""
+        entry, stale = self._lookup(key, label or key)
+        if entry is not None:
+            if stale:
+                # Revalidate in a single task, as get() does in a single thread
+                self._revalidate_in_background(key, compute, version_fn)
+            return entry
+
+        async with self._async_key_lock(key):
+            entry = self._get(key)
+            if entry is not None and entry.age() < self.ttl:
+                return entry
+            return await self._refresh_async(key, compute, version_fn)
+
+    def _revalidate_in_background(self, key, compute, version_fn):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        async def run():
+            try:
+                async with self._async_key_lock(key):
+                    await self._refresh_async(key, compute, version_fn)
+            except Exception as e:
+                print(f"❌ Background refresh failed for {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        # The loop keeps only weak references to tasks
+        task = asyncio.get_running_loop().create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def cache_control(self):
+        return f"max-age={self.ttl}, stale-while-revalidate={self.stale_ttl}"
+
+    def json_response(self, key, compute, version_fn=None):
+        """Build a conditional JSON response, answering If-None-Match with 304"""
+        # Labelled by Flask endpoint, since keys include the query string
+        entry = self.get(key, compute, version_fn, label=request.endpoint)
+        response = jsonify(entry.payload)
+        response.set_etag(entry.etag)
+        response.headers["Cache-Control"] = self.cache_control()
+        return response.make_conditional(request)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,263 @@
+"""
+On-disk memoization of aggregation results for the CLI analysis scripts
+Results are keyed by a hash of the query plus the collection's data version, so re-running
+a report on unchanged data reads files instead of running pipelines
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from bson import json_util
+
+from connection import get_collection
+from csv_engine import CsvCollection, csv_collection
+from metrics import record_cache
+from snapshot import SnapshotCollection, snapshot_collection
+
+CACHE_ENV = "DIABETES_RESULT_CACHE"
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "diabetes-analysis")
+DISABLED = ("0", "off", "false", "")
+MAX_BYTES = 64 * 1024 * 1024
+MAX_AGE = 7 * 24 * 3600
+# A wrapper re-reads the data version at most this often, so one report sees one version
+# but a long-lived process notices new writes
+VERSION_TTL_S = 5
+# Per-collection write counters, bumped by every tool that updates or deletes encounters
+WRITES_COLLECTION = "collection_writes"
+_MISSING = object()
+
+
+def _writes_id(collection):
+    return f"{collection.database.name}.{collection.name}"
+
+
+def note_writes(collection):
+    """Record that collection's documents changed in place, invalidating cached results"""
+    collection.database[WRITES_COLLECTION].update_one(
+        {"_id": _writes_id(collection)}, {"$inc": {"writes": 1}}, upsert=True
+    )
+
+
+def collection_version(collection):
+    """Identity plus a cheap change stamp: file size and mtime, or newest _id, document count
+    and write counter (new _ids and counts miss updates and deletes)"""
+    if isinstance(collection, (CsvCollection, SnapshotCollection)):
+        # Counting rows would mean reading the file
+        stat = os.stat(collection.path)
+        return f"{os.path.abspath(collection.path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    newest = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    newest_id = newest["_id"] if newest else None
+    name = _writes_id(collection)
+    counter = collection.database[WRITES_COLLECTION].find_one({"_id": name}) or {}
+    return f"{name}:{newest_id}:{collection.estimated_document_count()}:{counter.get('writes', 0)}"
+
+
+def query_key(kind, *parts):
+    """Canonical hash of a query; key order is kept, since $sort and $group depend on it"""
+    text = json_util.dumps([kind, *parts], separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ResultCache:
+    """Directory of <key>.json files, evicted by age and then least-recently-used by size"""
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=MAX_BYTES, max_age=MAX_AGE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key, default=None):
+        """Cached value, or default when missing or expired"""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json_util.loads(f.read())
+        except (OSError, ValueError):
+            return default
+        if time.time() - entry["stored_at"] > self.max_age:
+            self._remove(path)
+            return default
+        # mtime doubles as last use for LRU eviction
+        os.utime(path)
+        return entry["value"]
+
+    def put(self, key, value):
+        os.makedirs(self.directory, exist_ok=True)
+        data = json_util.dumps({"stored_at": time.time(), "value": value})
+        # Write then rename, so concurrent readers never see half a file
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(temp, self._path(key))
+        self.prune()
+
+    def memoize(self, key, compute, label="result"):
+        """Cached value for key, computing and storing it on a miss; None is a value too"""
+        value = self.get(key, _MISSING)
+        # Labelled by query kind, not key, so the metric has a handful of series
+        if value is not _MISSING:
+            self.hits += 1
+            record_cache("result", label, hit=True)
+            return value
+        self.misses += 1
+        record_cache("result", label, hit=False)
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def _entries(self):
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def prune(self):
+        """Drop entries unused for max_age, then the least recently used until under max_bytes"""
+        now = time.time()
+        entries = []
+        for used, size, path in self._entries():
+            if now - used > self.max_age:
+                self._remove(path)
+            else:
+                entries.append((used, size, path))
+        total = sum(size for _, size, _ in entries)
+        for used, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for _, _, path in self._entries():
+            self._remove(path)
+
+
+class CachedCursor:
+    """find() cursor whose results are memoized once a limit bounds them"""
+
+    def __init__(self, owner, filter, projection, kwargs):
+        self.owner = owner
+        self.filter = filter
+        self.projection = projection
+        self.kwargs = kwargs
+        self._sort = None
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None):
+        if isinstance(key_or_list, str):
+            key_or_list = [(key_or_list, direction or 1)]
+        self._sort = [list(item) for item in key_or_list]
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def _cursor(self):
+        cursor = self.owner.collection.find(self.filter, self.projection, **self.kwargs)
+        if self._sort:
+            cursor = cursor.sort([tuple(item) for item in self._sort])
+        if self._limit:
+            cursor = cursor.limit(self._limit)
+        return cursor
+
+    def __iter__(self):
+        if not self._limit:
+            # Unbounded finds (e.g. full loads for the numpy backend) stream through
+            return iter(self._cursor())
+        key = ("find", self.filter, self.projection, self._sort, self._limit)
+        return iter(self.owner.memoize(key, lambda: list(self._cursor())))
+
+
+class CachedCollection:
+    """Wraps a collection so aggregate, count_documents and limited finds hit the result cache"""
+
+    def __init__(self, collection, cache):
+        self.collection = collection
+        self.cache = cache
+        self._version = None
+        self._version_at = 0
+        self._lock = threading.Lock()
+
+    def version(self):
+        """Re-read at most every VERSION_TTL_S, so the queries of one report share a version"""
+        with self._lock:
+            if self._version is None or time.monotonic() - self._version_at > VERSION_TTL_S:
+                self._version = collection_version(self.collection)
+                self._version_at = time.monotonic()
+            return self._version
+
+    def memoize(self, query, compute):
+        """compute() memoized under a query tuple (kind first) at the current data version
+
+        For callers that answer a query some other way, e.g. merged partitions of a pipeline.
+        """
+        return self.cache.memoize(query_key(*query, self.version()), compute, label=query[0])
+
+    def aggregate(self, pipeline, **kwargs):
+        def compute():
+            return list(self.collection.aggregate(pipeline, **kwargs))
+        return iter(self.memoize(("aggregate", pipeline), compute))
+
+    def count_documents(self, filter, **kwargs):
+        return self.memoize(("count", filter), lambda: self.collection.count_documents(filter, **kwargs))
+
+    def find(self, filter=None, projection=None, **kwargs):
+        return CachedCursor(self, filter or {}, projection, kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def _directory():
+    """Cache directory from DIABETES_RESULT_CACHE (a path, or on/off), None when disabled"""
+    setting = os.environ.get(CACHE_ENV, "on")
+    if setting.lower() in DISABLED:
+        return None
+    return DEFAULT_DIRECTORY if setting.lower() in ("1", "on", "true") else setting
+
+
+def cached(collection):
+    """Wrap a collection in the on-disk result cache unless it is disabled"""
+    directory = _directory()
+    return collection if directory is None else CachedCollection(collection, ResultCache(directory))
+
+
+def clear_results():
+    """Forget every memoized result, e.g. after ingest.py rewrites the collection"""
+    directory = _directory()
+    if directory is not None:
+        ResultCache(directory).clear()
+
+
+def analysis_collection():
+    """The collection the analysis scripts read, behind the result cache
+
+    DIABETES_SNAPSHOT=<file.parquet> reads a Parquet snapshot instead of MongoDB and
+    DIABETES_CSV=<file.csv> streams a raw CSV extract; DIABETES_RESULT_CACHE=off always queries.
+    """
+    return cached(snapshot_collection() or csv_collection() or get_collection())
@@ -0,0 +1,306 @@
+"""
+Materialized rollup of patient_data for the dashboard
+Keeps totals, readmission counts and sum/count pairs in a summary collection
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from connection import get_collection
+
+SUMMARY_ID = "patient_data"
+MEASURES = {
+    "stay": "time_in_hospital",
+    "meds": "num_medications",
+    "labs": "num_lab_procedures",
+}
+NULL_KEY = "null"
+DUPLICATE_KEY = 11000
+# A claimed window that is not committed within this long is treated as abandoned
+WINDOW_LEASE_S = 300
+# _ids are generated before their insert commits, and concurrent writers commit out of
+# order, so watermarks only pass _ids older than this; the stats rollup reads the rest live
+WINDOW_LAG_S = float(os.environ.get("DIABETES_WINDOW_LAG_S", 10))
+
+
+def _summary_collection(collection):
+    """Rollups live next to the source collection"""
+    return collection.database['patient_stats']
+
+
+def _empty_summary():
+    summary = {"_id": SUMMARY_ID, "watermark": None, "total": 0, "readmitted": {}}
+    for name in MEASURES:
+        summary[f"sum_{name}"] = 0
+        summary[f"count_{name}"] = 0
+    return summary
+
+
+def _delta_pipeline(match):
+    """Aggregate only the encounters inside the (watermark, high] window"""
+    group = {"_id": "$readmitted", "count": {"$sum": 1}}
+    for name, field in MEASURES.items():
+        # $avg ignores non-numeric values, so the counts must do the same
+        group[f"sum_{name}"] = {"$sum": f"${field}"}
+        group[f"count_{name}"] = {"$sum": {"$cond": [{"$isNumber": f"${field}"}, 1, 0]}}
+    return [{"$match": match}, {"$group": group}]
+
+
+def _delta_match(watermark, high):
+    match = {"_id": {"$lte": high}}
+    if watermark is not None:
+        match["_id"]["$gt"] = watermark
+    return match
+
+
+def _tail_match(watermark):
+    """Everything past the watermark, including encounters still inside the lag"""
+    return {} if watermark is None else {"_id": {"$gt": watermark}}
+
+
+def lag_cutoff(lag=WINDOW_LAG_S):
+    """Smallest ObjectId generated `lag` seconds ago"""
+    return ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=lag))
+
+
+def _window_high(newest, watermark, lag):
+    """Upper bound of the next window, or None when there is nothing to fold in"""
+    if newest is None:
+        return None
+    high = newest["_id"]
+    if lag and isinstance(high, ObjectId):
+        # Ids newer than the cutoff may still have older ids committing below them
+        high = min(high, lag_cutoff(lag))
+    if watermark is not None and high <= watermark:
+        return None
+    return high
+
+
+def unsettled(newest, lag=WINDOW_LAG_S):
+    """True while the newest encounter is inside the lag, i.e. not yet behind every watermark"""
+    return bool(lag) and newest is not None and isinstance(newest["_id"], ObjectId) \
+        and newest["_id"] >= lag_cutoff(lag)
+
+
+def refresh_window(collection, meta_id, apply, lease=WINDOW_LEASE_S, lag=WINDOW_LAG_S):
+    """Fold the encounters inserted since meta_id's watermark into a multi-document summary
+
+    The window is recorded as pending before anything is written and the watermark only
+    moves once apply(watermark, high) has written every document. A crash leaves the window
+    pending, and after the lease the next refresh applies the same window again, so apply
+    must be idempotent for a given high. It may return $inc counters for the meta document.
+    Encounters younger than `lag` wait for a later refresh.
+    """
+    meta_collection = _summary_collection(collection)
+
+    while True:
+        meta = meta_collection.find_one({"_id": meta_id})
+        if meta is None:
+            meta_collection.update_one(
+                {"_id": meta_id}, {"$setOnInsert": {"watermark": None, "version": 0}}, upsert=True
+            )
+            continue
+
+        watermark, pending = meta.get("watermark"), meta.get("pending")
+        if pending is not None and time.time() - pending["claimed_at"] < lease:
+            # Another refresher is writing this window; readers keep the committed state
+            return meta
+        if pending is not None:
+            high = pending["high"]
+        else:
+            newest = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            high = _window_high(newest, watermark, lag)
+            if high is None:
+                return meta
+
+        # Claimed first, so concurrent refreshers do not apply overlapping windows
+        claim = {"high": high, "claimed_at": time.time()}
+        claimed = meta_collection.update_one(
+            {"_id": meta_id, "watermark": watermark, "pending": pending}, {"$set": {"pending": claim}}
+        )
+        if not claimed.matched_count:
+            continue
+
+        increments = apply(watermark, high) or {}
+        # Readers reload on version, which only moves once the window is fully written
+        committed = meta_collection.find_one_and_update(
+            {"_id": meta_id, "pending": claim},
+            {"$set": {"watermark": high, "pending": None}, "$inc": {"version": 1, **increments}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if committed is not None:
+            return committed
+        # The lease ran out and another refresher re-applied and committed the window
+
+
+def apply_once(target, updates):
+    """Unordered bulk write of window-guarded upserts; returns the number of upserts
+
+    Each update filters on {"window": {"$ne": high}}, so a document the window already
+    reached fails the upsert with a duplicate key instead of being counted twice.
+    """
+    if not updates:
+        return 0
+    try:
+        return target.bulk_write(updates, ordered=False).upserted_count
+    except BulkWriteError as e:
+        if any(err.get("code") != DUPLICATE_KEY for err in e.details.get("writeErrors", [])):
+            raise
+        return e.details.get("nUpserted", 0)
+
+
+def _increments(groups):
+    """Turn per-readmitted delta groups into a single $inc document"""
+    increments = {"total": 0}
+    for group in groups:
+        key = NULL_KEY if group["_id"] is None else str(group["_id"])
+        increments["total"] += group["count"]
+        increments[f"readmitted.{key}"] = increments.get(f"readmitted.{key}", 0) + group["count"]
+        for name in MEASURES:
+            increments[f"sum_{name}"] = increments.get(f"sum_{name}", 0) + group[f"sum_{name}"]
+            increments[f"count_{name}"] = increments.get(f"count_{name}", 0) + group[f"count_{name}"]
+    return increments
+
+
+def _with_tail(summary, groups):
+    """The summary plus the encounters past its watermark, counted live and not stored"""
+    increments = _increments(groups)
+    if not increments["total"]:
+        return summary
+    summary = dict(summary, readmitted=dict(summary.get("readmitted", {})))
+    for key, amount in increments.items():
+        if key.startswith("readmitted."):
+            name = key[len("readmitted."):]
+            summary["readmitted"][name] = summary["readmitted"].get(name, 0) + amount
+        else:
+            summary[key] = summary.get(key, 0) + amount
+    return summary
+
+
+def _refresh_steps(collection, lag):
+    """refresh_rollup as a generator of database calls, shared by the sync and async drivers
+
+    Each yield is a list of independent zero-argument calls; the driver runs them and sends
+    back their results in order, with aggregate cursors as lists. The summary is returned.
+    """
+    summary_collection = _summary_collection(collection)
+
+    while True:
+        # Pin the upper bound up front so inserts during the scan wait for the next refresh
+        summary, newest = yield [
+            lambda: summary_collection.find_one({"_id": SUMMARY_ID}),
+            lambda: collection.find_one({}, {"_id": 1}, sort=[("_id", -1)]),
+        ]
+        if summary is None:
+            yield [lambda: summary_collection.update_one(
+                {"_id": SUMMARY_ID}, {"$setOnInsert": _empty_summary()}, upsert=True
+            )]
+            continue
+
+        watermark = summary.get("watermark")
+        if newest is None:
+            return summary
+        # newest may predate a watermark another refresher just advanced
+        if watermark is not None and newest["_id"] <= watermark:
+            return summary
+        high = _window_high(newest, watermark, lag)
+        if high is not None:
+            groups, = yield [lambda: collection.aggregate(_delta_pipeline(_delta_match(watermark, high)))]
+            increments = _increments(groups)
+
+            # Only apply the delta if nobody else advanced the watermark meanwhile
+            result, = yield [lambda: summary_collection.update_one(
+                {"_id": SUMMARY_ID, "watermark": watermark},
+                {"$inc": increments, "$set": {"watermark": high}},
+            )]
+            if not result.matched_count:
+                continue
+            summary, = yield [lambda: summary_collection.find_one({"_id": SUMMARY_ID})]
+            watermark = high
+
+        if newest["_id"] == watermark:
+            return summary
+        groups, = yield [lambda: collection.aggregate(_delta_pipeline(_tail_match(watermark)))]
+        return _with_tail(summary, groups)
+
+
+def refresh_rollup(collection, lag=WINDOW_LAG_S):
+    """Fold encounters inserted since the last watermark into the summary
+
+    Encounters younger than `lag` are added to the returned summary but not stored, so a
+    late-committing insert below them is still counted on a later refresh.
+    """
+    steps = _refresh_steps(collection, lag)
+    try:
+        calls = next(steps)
+        while True:
+            calls = steps.send([call() for call in calls])
+    except StopIteration as done:
+        return done.value
+
+
+async def _resolve(result):
+    """Await an async driver call; aggregate() resolves to a cursor, read out as a list"""
+    result = await result
+    return await result.to_list(None) if hasattr(result, "to_list") else result
+
+
+async def refresh_rollup_async(collection, lag=WINDOW_LAG_S):
+    """refresh_rollup for an async (AsyncMongoClient) collection; independent calls run together"""
+    steps = _refresh_steps(collection, lag)
+    try:
+        calls = next(steps)
+        while True:
+            calls = steps.send(await asyncio.gather(*(_resolve(call()) for call in calls)))
+    except StopIteration as done:
+        return done.value
+
+
+def reset_rollup(collection):
+    """Drop the summary; the next refresh recomputes it from the whole collection"""
+    _summary_collection(collection).delete_one({"_id": SUMMARY_ID})
+
+
+def rebuild_rollup(collection):
+    """Drop the summary and recompute it from scratch (needed after updates or deletes)"""
+    reset_rollup(collection)
+    # Rebuilds run once the writers are done, so fold in everything
+    return refresh_rollup(collection, lag=0)
+
+
+def read_stats(summary):
+    """Shape a summary document like the /api/stats response"""
+    readmission_stats = [
+        {"_id": None if key == NULL_KEY else key, "count": count}
+        for key, count in summary.get("readmitted", {}).items()
+    ]
+
+    averages = {}
+    for name in MEASURES:
+        count = summary.get(f"count_{name}", 0)
+        total = summary.get(f"sum_{name}", 0)
+        averages[f"avg_{name}"] = round(total / count, 1) if count else 0
+
+    return {
+        "total_patients": summary.get("total", 0),
+        "readmission_stats": readmission_stats,
+        "averages": averages,
+    }
+
+
+def main():
+    """Rebuild the rollup from the full collection"""
+    collection = get_collection()
+
+    print("🔄 Rebuilding patient_stats rollup...")
+    summary = rebuild_rollup(collection)
+    print(f"✅ Rollup covers {summary['total']:,} encounters")
+
+
+if __name__ == "__main__":
+    main()
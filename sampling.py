@@ -0,0 +1,262 @@
+"""
+Approximate, progressively refined analytics
+Answers a few group-by analyses from a $sample first, then refines partition by partition
+until the estimate is exact, reporting a confidence interval for every number
+"""
+import argparse
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from advanced_analysis import READMITTED_VALUES
+from connection import get_collection
+from metrics import query_label
+from partitioned import OVERSAMPLE
+
+READMITTED_FLAG = {"$cond": [{"$in": ["$readmitted", READMITTED_VALUES]}, 1, 0]}
+
+# name -> group key, count field, {measure: expression averaged per group}, sort
+# Field names match the exact analyses so printed output lines up with theirs
+ESTIMATES = {
+    "age_group_analysis": {
+        "group": "$age",
+        "count": "total_patients",
+        "measures": {
+            "readmission_rate": READMITTED_FLAG,
+            "avg_medications": "$num_medications",
+            "avg_stay": "$time_in_hospital",
+        },
+        "sort": "_id",
+    },
+    "question_4_insulin_impact": {
+        "group": "$insulin",
+        "count": "total",
+        "measures": {"readmission_rate": READMITTED_FLAG},
+        "sort": "_id",
+    },
+    "question_5_race_analysis": {
+        "group": "$race",
+        "count": "count",
+        "measures": {
+            "avg_stay": "$time_in_hospital",
+            "avg_meds": "$num_medications",
+            "avg_labs": "$num_lab_procedures",
+        },
+        "sort": "count",
+    },
+}
+
+SAMPLE_SIZE = 2000
+PARTITION_FIELD = "encounter_id"
+
+
+def stats_pipeline(name):
+    """Per-group sufficient statistics: row count plus count, sum and sum of squares per measure"""
+    spec = ESTIMATES[name]
+    group = {"_id": spec["group"], "n": {"$sum": 1}}
+    for measure, expr in spec["measures"].items():
+        # $avg ignores non-numeric values, so count those separately to stay exact
+        group[f"{measure}_n"] = {"$sum": {"$cond": [{"$isNumber": expr}, 1, 0]}}
+        group[f"{measure}_sum"] = {"$sum": expr}
+        group[f"{measure}_sq"] = {"$sum": {"$multiply": [expr, expr]}}
+    return [{"$group": group}]
+
+
+def _z(confidence):
+    return statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+
+
+def _sort_key(spec):
+    if spec["sort"] == "_id":
+        return lambda row: (row["_id"] is not None, str(row["_id"]))
+    return lambda row: -row[spec["count"]]
+
+
+def _srs_groups(name, rows, sampled, population, z):
+    """Estimates from one simple random sample of `sampled` documents"""
+    spec = ESTIMATES[name]
+    fpc = max(0.0, 1 - sampled / population) if population else 0.0
+    groups = []
+    for row in rows:
+        share = row["n"] / sampled
+        estimate = {
+            "_id": row["_id"],
+            spec["count"]: population * share,
+            f"{spec['count']}_ci": z * population * (share * (1 - share) / sampled * fpc) ** 0.5,
+        }
+        for measure in spec["measures"]:
+            n, total, squares = row[f"{measure}_n"], row[f"{measure}_sum"], row[f"{measure}_sq"]
+            mean = total / n if n else None
+            variance = max(squares / n - mean * mean, 0.0) * n / (n - 1) if n > 1 else 0.0
+            estimate[measure] = mean
+            estimate[f"{measure}_ci"] = z * (variance / n * fpc) ** 0.5 if n else None
+        groups.append(estimate)
+    return groups
+
+
+def _cluster_groups(name, partials, done, partitions, z):
+    """Estimates from `done` of `partitions` similar-sized partitions taken in random order (cluster sampling)"""
+    spec = ESTIMATES[name]
+    scale = partitions / done
+    fpc = 1 - done / partitions
+    keys = {key for partial in partials for key in partial}
+    groups = []
+    for key in keys:
+        # A partition without the group contributes a zero row
+        rows = [partial.get(key) for partial in partials]
+        counts = [row["n"] if row else 0 for row in rows]
+        spread = statistics.variance(counts) if done > 1 else 0.0
+        estimate = {
+            "_id": key,
+            spec["count"]: scale * sum(counts),
+            f"{spec['count']}_ci": z * partitions * (fpc * spread / done) ** 0.5,
+        }
+        for measure in spec["measures"]:
+            ns = [row[f"{measure}_n"] if row else 0 for row in rows]
+            sums = [row[f"{measure}_sum"] if row else 0 for row in rows]
+            n = sum(ns)
+            mean = sum(sums) / n if n else None
+            ci = None
+            if n:
+                # Linearized variance of a ratio estimator
+                residuals = [s - mean * c for s, c in zip(sums, ns)]
+                spread = statistics.variance(residuals) if done > 1 else 0.0
+                ci = z * (fpc * spread / done) ** 0.5 / (n / done)
+            estimate[measure] = mean
+            estimate[f"{measure}_ci"] = ci
+        groups.append(estimate)
+    return groups
+
+
+def _finish(name, stage, fraction, groups, started):
+    spec = ESTIMATES[name]
+    groups.sort(key=_sort_key(spec))
+    # Widest interval relative to its estimate, across every count and mean
+    bounds = [
+        row[f"{field}_ci"] / abs(row[field])
+        for row in groups
+        for field in [spec["count"], *spec["measures"]]
+        if row[field] and row[f"{field}_ci"] is not None
+    ]
+    return {
+        "analysis": name,
+        "stage": stage,
+        "fraction": fraction,
+        "exact": fraction >= 1,
+        "error_bound": max(bounds, default=0.0),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "groups": groups,
+    }
+
+
+def sample_estimate(collection, name, sample_size=SAMPLE_SIZE, confidence=0.95):
+    """Fast first answer from a fixed-size $sample; its cost does not grow with the collection"""
+    started = time.perf_counter()
+    population = collection.estimated_document_count()
+    pipeline = [{"$sample": {"size": sample_size}}] + stats_pipeline(name)
+    with query_label(f"{name}.sample"):
+        rows = list(collection.aggregate(pipeline))
+    sampled = sum(row["n"] for row in rows)
+    if not sampled:
+        return _finish(name, "sample", 1.0, [], started)
+    groups = _srs_groups(name, rows, sampled, max(population, sampled), _z(confidence))
+    return _finish(name, "sample", min(1.0, sampled / max(population, 1)), groups, started)
+
+
+def partition_ranges(collection, partitions):
+    """encounter_id ranges holding similar numbers of encounters, each read through its index
+
+    Cut points are quantiles of a $sample of encounter_id, as in partitioned.py, so gaps
+    in the ids do not leave some partitions nearly empty and widen the intervals.
+    """
+    first = collection.find_one({}, {PARTITION_FIELD: 1}, sort=[(PARTITION_FIELD, 1)])
+    last = collection.find_one({}, {PARTITION_FIELD: 1}, sort=[(PARTITION_FIELD, -1)])
+    if not first or not last:
+        return []
+    low, high = first[PARTITION_FIELD], last[PARTITION_FIELD] + 1
+    sample = collection.aggregate([
+        {"$sample": {"size": partitions * OVERSAMPLE}},
+        {"$project": {PARTITION_FIELD: 1}},
+    ])
+    values = sorted(doc[PARTITION_FIELD] for doc in sample if isinstance(doc.get(PARTITION_FIELD), int))
+    cuts = {values[len(values) * i // partitions] for i in range(1, partitions)} if values else set()
+    bounds = [low, *sorted(cuts - {low}), high]
+    return [
+        {PARTITION_FIELD: {"$gte": start, "$lt": end}}
+        for start, end in zip(bounds, bounds[1:])
+    ]
+
+
+def _run_partition(collection, name, match):
+    with query_label(f"{name}.partition"):
+        rows = collection.aggregate([{"$match": match}] + stats_pipeline(name))
+        return {row["_id"]: row for row in rows}
+
+
+def progressive(collection, name, sample_size=SAMPLE_SIZE, partitions=16, workers=4,
+                confidence=0.95, seed=None):
+    """Yield a $sample estimate, then a tighter one each time a partition finishes
+
+    Partitions are visited in random order, so every prefix is a random cluster sample;
+    the last estimate covers every partition and equals the exact answer.
+    """
+    started = time.perf_counter()
+    z = _z(confidence)
+    if sample_size:
+        yield sample_estimate(collection, name, sample_size, confidence)
+
+    ranges = partition_ranges(collection, partitions)
+    random.Random(seed).shuffle(ranges)
+    partials = []
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [pool.submit(_run_partition, collection, name, match) for match in ranges]
+        for future in as_completed(futures):
+            partials.append(future.result())
+            done = len(partials)
+            groups = _cluster_groups(name, partials, done, len(ranges), z)
+            yield _finish(name, "partitions", done / len(ranges), groups, started)
+    finally:
+        # Stopping early (e.g. at a target error) abandons the partitions not yet started
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def print_estimate(estimate):
+    spec = ESTIMATES[estimate["analysis"]]
+    label = "exact" if estimate["exact"] else f"{estimate['fraction']:.0%} of data"
+    print(f"\n📐 {estimate['analysis']} ({estimate['stage']}, {label}, "
+          f"±{estimate['error_bound']:.1%} worst case, {estimate['elapsed_ms']:.0f} ms)")
+    for row in estimate["groups"]:
+        count = spec["count"]
+        print(f"   {row['_id']}: {row[count]:,.0f} ± {row[f'{count}_ci']:,.0f} patients")
+        for measure in spec["measures"]:
+            if row[measure] is None:
+                continue
+            scale = 100 if measure == "readmission_rate" else 1
+            unit = "%" if scale == 100 else ""
+            print(f"     {measure}: {row[measure] * scale:.1f}{unit} "
+                  f"± {row[f'{measure}_ci'] * scale:.1f}{unit}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Approximate analyses with confidence intervals")
+    parser.add_argument("analysis", choices=sorted(ESTIMATES))
+    parser.add_argument("--sample-size", type=int, default=SAMPLE_SIZE)
+    parser.add_argument("--partitions", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--target-error", type=float, default=0.0,
+                        help="stop once the worst relative interval is below this (0.01 = 1%%)")
+    args = parser.parse_args()
+
+    collection = get_collection()
+    for estimate in progressive(collection, args.analysis, args.sample_size, args.partitions,
+                                args.workers, args.confidence):
+        print_estimate(estimate)
+        if estimate["error_bound"] <= args.target_error:
+            break
+
+
+if __name__ == "__main__":
+    main()
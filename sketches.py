@@ -0,0 +1,354 @@
+"""
+Streaming quantile sketches for stay, medications and lab procedures
+Keeps a mergeable KLL sketch per measure for every group value in patient_sketches, so
+percentiles and equal-frequency buckets never sort patient_data
+"""
+import argparse
+import bisect
+import math
+import random
+import threading
+
+from pymongo.errors import DuplicateKeyError
+
+from connection import get_collection
+from rollups import MEASURES, WINDOW_LAG_S, _delta_match, refresh_window
+
+SKETCH_ID = "patient_sketches"
+# Sketches are kept for every value of these fields, plus one over all encounters
+GROUP_FIELDS = ["age", "race", "gender", "insulin", "readmitted"]
+ALL = "all"
+DEFAULT_PERCENTILES = [5, 25, 50, 75, 95]
+DEFAULT_BUCKETS = 4
+MAX_BUCKETS = 100
+
+_lock = threading.Lock()
+_loaded = None
+
+
+class KLLSketch:
+    """KLL quantile sketch (Karnin, Lang and Liberty, 2016)
+
+    Items sit in compactors, one per level; an item at level h stands for 2**h inputs.
+    A full compactor sorts itself and promotes every other item, so memory stays around
+    3k items while rank error stays around 1.7/k. Below k items the sketch is exact.
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.min = None
+        self.max = None
+        self.compactors = [[]]
+        self._random = random.Random(seed)
+
+    def _capacity(self, level):
+        # Lower levels shrink geometrically (c = 2/3) below the top one
+        depth = len(self.compactors) - level - 1
+        return int(math.ceil(self.k * (2 / 3) ** depth)) + 1
+
+    def _size(self):
+        return sum(len(items) for items in self.compactors)
+
+    def _max_size(self):
+        return sum(self._capacity(level) for level in range(len(self.compactors)))
+
+    def _compress(self):
+        for level, items in enumerate(self.compactors):
+            if len(items) < self._capacity(level):
+                continue
+            if level + 1 == len(self.compactors):
+                self.compactors.append([])
+            items.sort()
+            # An odd item out stays behind for the next compaction
+            leftover = [items.pop()] if len(items) % 2 else []
+            offset = self._random.randint(0, 1)
+            self.compactors[level + 1].extend(items[offset::2])
+            self.compactors[level] = leftover
+            if self._size() < self._max_size():
+                return
+
+    def update(self, value):
+        self.update_many([value])
+
+    def update_many(self, values):
+        values = list(values)
+        if not values:
+            return
+        self.n += len(values)
+        low, high = min(values), max(values)
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        # Feed k at a time so compactions interleave as they would item by item
+        for start in range(0, len(values), self.k):
+            self.compactors[0].extend(values[start:start + self.k])
+            while self._size() >= self._max_size():
+                self._compress()
+
+    def merge(self, other):
+        """Fold another sketch into this one; the result sketches both streams"""
+        if not other.n:
+            return self
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+        self.n += other.n
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        while self._size() >= self._max_size():
+            self._compress()
+        return self
+
+    def _weighted(self):
+        """Sorted items with cumulative weights"""
+        pairs = sorted(
+            (item, 1 << level) for level, items in enumerate(self.compactors) for item in items
+        )
+        items, cumulative, total = [], [], 0
+        for item, weight in pairs:
+            total += weight
+            items.append(item)
+            cumulative.append(total)
+        return items, cumulative
+
+    def rank(self, value):
+        """Approximate number of inputs strictly below value"""
+        items, cumulative = self._weighted()
+        position = bisect.bisect_left(items, value)
+        return cumulative[position - 1] if position else 0
+
+    def quantiles(self, fractions):
+        """Smallest stored value whose rank reaches each fraction of n"""
+        if not self.n:
+            return [None for _ in fractions]
+        items, cumulative = self._weighted()
+        results = []
+        for fraction in fractions:
+            if fraction <= 0:
+                results.append(self.min)
+            elif fraction >= 1:
+                results.append(self.max)
+            else:
+                position = bisect.bisect_left(cumulative, fraction * self.n)
+                results.append(items[min(position, len(items) - 1)])
+        return results
+
+    def quantile(self, fraction):
+        return self.quantiles([fraction])[0]
+
+    def to_document(self):
+        return {"k": self.k, "n": self.n, "min": self.min, "max": self.max, "compactors": self.compactors}
+
+    @classmethod
+    def from_document(cls, doc):
+        sketch = cls(doc["k"])
+        sketch.n = doc["n"]
+        sketch.min = doc["min"]
+        sketch.max = doc["max"]
+        sketch.compactors = [list(items) for items in doc["compactors"]] or [[]]
+        return sketch
+
+
+def _sketch_collection(collection):
+    return collection.database['patient_sketches']
+
+
+def _meta_collection(collection):
+    return collection.database['patient_stats']
+
+
+def _is_number(value):
+    # Same values $avg and $isNumber accept
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _feed(partials, pending):
+    for key, measures in pending.items():
+        group = partials.setdefault(key, {})
+        for name, measure_values in measures.items():
+            if name not in group:
+                group[name] = KLLSketch()
+            group[name].update_many(measure_values)
+
+
+def sketch_window(collection, match, batch_size=10000):
+    """{(field, value): {measure: KLLSketch}} for the encounters matching `match`"""
+    projection = {field: 1 for field in GROUP_FIELDS + list(MEASURES.values())}
+    projection["_id"] = 0
+
+    partials, pending = {}, {}
+    for count, doc in enumerate(collection.find(match, projection, batch_size=batch_size), 1):
+        keys = [(ALL, None)] + [(field, doc.get(field)) for field in GROUP_FIELDS]
+        for name, field in MEASURES.items():
+            value = doc.get(field)
+            if not _is_number(value):
+                continue
+            for key in keys:
+                pending.setdefault(key, {}).setdefault(name, []).append(value)
+        # Only one batch of raw values is held; the sketches stay O(k log n)
+        if count % batch_size == 0:
+            _feed(partials, pending)
+            pending = {}
+    _feed(partials, pending)
+    return partials
+
+
+def _merge_group(sketches, key, partial, high):
+    """Merge one group's partial sketches into its stored ones, retrying on a concurrent write"""
+    _id = {"field": key[0], "value": key[1]}
+    while True:
+        doc = sketches.find_one({"_id": _id})
+        if doc is not None and doc.get("window") == high:
+            # A retry of this window already merged the group
+            return
+        stored = doc["sketches"] if doc else {}
+        merged = {name: KLLSketch.from_document(stored[name]) for name in stored}
+        for name, sketch in partial.items():
+            merged[name] = merged[name].merge(sketch) if name in merged else sketch
+
+        replacement = {
+            "_id": _id,
+            "rev": (doc["rev"] + 1) if doc else 1,
+            "window": high,
+            "sketches": {name: sketch.to_document() for name, sketch in merged.items()},
+        }
+        if doc is None:
+            try:
+                sketches.insert_one(replacement)
+                return
+            except DuplicateKeyError:
+                continue
+        # A sketch is a whole document, so $inc cannot merge it; rev guards the rewrite
+        if sketches.replace_one({"_id": _id, "rev": doc["rev"]}, replacement).matched_count:
+            return
+
+
+def refresh_sketches(collection, lag=WINDOW_LAG_S):
+    """Fold encounters inserted since the sketches' watermark into patient_sketches"""
+    sketches = _sketch_collection(collection)
+
+    def apply(watermark, high):
+        for key, partial in sketch_window(collection, _delta_match(watermark, high)).items():
+            _merge_group(sketches, key, partial, high)
+
+    return refresh_window(collection, SKETCH_ID, apply, lag=lag)
+
+
+def rebuild_sketches(collection):
+    """Drop every sketch and rebuild from scratch (needed after updates or deletes)"""
+    _sketch_collection(collection).drop()
+    # Keep counting versions up so processes holding old sketches reload them
+    _meta_collection(collection).update_one(
+        {"_id": SKETCH_ID}, {"$set": {"watermark": None, "pending": None}, "$inc": {"version": 1}}, upsert=True
+    )
+    # Rebuilds run once the writers are done, so fold in everything
+    return refresh_sketches(collection, lag=0)
+
+
+def load_sketches(collection):
+    """{(field, value): {measure: KLLSketch}} from patient_sketches"""
+    return {
+        (doc["_id"]["field"], doc["_id"]["value"]): {
+            name: KLLSketch.from_document(sketch) for name, sketch in doc["sketches"].items()
+        }
+        for doc in _sketch_collection(collection).find()
+    }
+
+
+def current_sketches(collection):
+    """Bring the stored sketches up to date and return them, reloading only on change"""
+    global _loaded
+    meta = refresh_sketches(collection)
+    with _lock:
+        if _loaded is None or _loaded[0] != meta.get("version"):
+            _loaded = (meta.get("version"), load_sketches(collection))
+        return _loaded[1]
+
+
+def equal_frequency_buckets(sketch, buckets):
+    """Boundaries at the 1/b, 2/b, ... quantiles; each range is [from, to) except the last
+
+    Repeated values can make neighbouring boundaries equal; those buckets are merged, so
+    fewer than `buckets` may come back.
+    """
+    if not sketch.n:
+        return []
+    inner = sketch.quantiles([i / buckets for i in range(1, buckets)])
+    edges = sorted(set([sketch.min, sketch.max] + inner))
+    if len(edges) == 1:
+        return [{"from": edges[0], "to": edges[0], "count": sketch.n}]
+    ranks = [sketch.rank(edge) for edge in edges[:-1]] + [sketch.n]
+    return [
+        {"from": low, "to": high, "count": ranks[i + 1] - ranks[i]}
+        for i, (low, high) in enumerate(zip(edges, edges[1:]))
+    ]
+
+
+def parse_query(measure=None, by=None, percentiles=None, buckets=None):
+    """Validate query-string style arguments: one measure, one group field, comma-separated percentiles"""
+    measure = measure or "stay"
+    if measure not in MEASURES:
+        raise ValueError(f"Unknown measure {measure!r}, expected one of {list(MEASURES)}")
+    if by and by not in GROUP_FIELDS:
+        raise ValueError(f"Unknown group field {by!r}, expected one of {GROUP_FIELDS}")
+    try:
+        percentile_list = [float(p) for p in percentiles.split(",") if p] if percentiles else DEFAULT_PERCENTILES
+        bucket_count = int(buckets) if buckets else DEFAULT_BUCKETS
+    except ValueError:
+        raise ValueError("percentiles must be comma-separated numbers and buckets an integer")
+    if any(p < 0 or p > 100 for p in percentile_list):
+        raise ValueError("percentiles must be between 0 and 100")
+    if not 1 <= bucket_count <= MAX_BUCKETS:
+        raise ValueError(f"buckets must be between 1 and {MAX_BUCKETS}")
+    return measure, by or None, percentile_list, bucket_count
+
+
+def distribution(sketches, measure="stay", by=None, percentiles=DEFAULT_PERCENTILES, buckets=DEFAULT_BUCKETS):
+    """Percentiles and equal-frequency buckets of one measure, overall or per value of `by`"""
+    field = by or ALL
+    keys = sorted(
+        (key for key in sketches if key[0] == field and measure in sketches[key]),
+        key=lambda key: (key[1] is not None, str(key[1])),
+    )
+    groups = []
+    for key in keys:
+        sketch = sketches[key][measure]
+        values = sketch.quantiles([p / 100 for p in percentiles])
+        row = {"count": sketch.n, "min": sketch.min, "max": sketch.max}
+        if by:
+            row = {by: key[1], **row}
+        row["percentiles"] = {f"p{p:g}": value for p, value in zip(percentiles, values)}
+        row["buckets"] = equal_frequency_buckets(sketch, buckets)
+        groups.append(row)
+    return groups
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Percentiles and adaptive buckets from quantile sketches")
+    parser.add_argument("--measure", choices=list(MEASURES), default="stay")
+    parser.add_argument("--by", choices=GROUP_FIELDS, default=None)
+    parser.add_argument("--buckets", type=int, default=DEFAULT_BUCKETS)
+    parser.add_argument("--rebuild", action="store_true", help="rebuild every sketch from scratch")
+    args = parser.parse_args()
+
+    collection = get_collection()
+    if args.rebuild:
+        print("🔄 Rebuilding patient_sketches...")
+        rebuild_sketches(collection)
+
+    scope = f" by {args.by}" if args.by else ""
+    print(f"\n📐 {MEASURES[args.measure]} distribution{scope}:")
+    for row in distribution(current_sketches(collection), args.measure, args.by, buckets=args.buckets):
+        label = f"{row[args.by]}: " if args.by else ""
+        percentiles = ", ".join(f"{name}={value}" for name, value in row["percentiles"].items())
+        print(f"   {label}{row['count']:,} encounters, {percentiles}")
+        buckets = [f"[{b['from']}, {b['to']}): {b['count']:,}" for b in row["buckets"]]
+        if buckets:
+            buckets[-1] = buckets[-1].replace("):", "]:")
+        buckets = ", ".join(buckets)
+        print(f"      Buckets: {buckets}")
+
+
+if __name__ == "__main__":
+    main()
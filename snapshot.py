@@ -0,0 +1,294 @@
+"""
+Parquet/Arrow snapshots of patient_data
+Exports a typed, compressed snapshot and serves the analysis queries from it
+"""
+import argparse
+import os
+
+from aggregation import bson_sort_key, nested
+from connection import configure, get_collection
+from ingest import DATASET_FIELDS, INT_FIELDS, MISSING
+
+SNAPSHOT_ENV = "DIABETES_SNAPSHOT"
+
+
+def _schema():
+    import pyarrow as pa
+    return pa.schema([
+        (field, pa.int64() if field in INT_FIELDS else pa.string())
+        for field in DATASET_FIELDS
+    ])
+
+
+def _clean(field, value):
+    """Coerce a stored value to the snapshot type, mapping '?' to null"""
+    if value is None or value == MISSING:
+        return None
+    if field in INT_FIELDS:
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, (int, float)):
+            return int(value)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    return str(value)
+
+
+def export_snapshot(collection, path, batch_size=50000, compression="zstd"):
+    """Stream the collection into a Parquet file one record batch at a time"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _schema()
+    projection = {field: 1 for field in DATASET_FIELDS}
+    projection["_id"] = 0
+
+    rows = 0
+    columns = {field: [] for field in DATASET_FIELDS}
+    with pq.ParquetWriter(path, schema, compression=compression) as writer:
+        for doc in collection.find({}, projection, batch_size=batch_size):
+            for field in DATASET_FIELDS:
+                columns[field].append(_clean(field, doc.get(field)))
+            rows += 1
+            if rows % batch_size == 0:
+                writer.write_batch(pa.record_batch(columns, schema=schema))
+                columns = {field: [] for field in DATASET_FIELDS}
+        if columns[DATASET_FIELDS[0]]:
+            writer.write_batch(pa.record_batch(columns, schema=schema))
+    return rows
+
+
+def _field_refs(spec, refs):
+    """Collect every "$field" path referenced in a pipeline or filter"""
+    if isinstance(spec, str) and spec.startswith("$") and not spec.startswith("$$"):
+        refs.add(spec[1:].split(".")[0])
+    elif isinstance(spec, dict):
+        for value in spec.values():
+            _field_refs(value, refs)
+    elif isinstance(spec, list):
+        for item in spec:
+            _field_refs(item, refs)
+    return refs
+
+
+def _pipeline_fields(pipeline):
+    """Columns a pipeline reads: $field references plus $match keys"""
+    refs = set()
+    for stage in pipeline:
+        if "$match" in stage:
+            refs.update(field.split(".")[0] for field in stage["$match"])
+        _field_refs(stage, refs)
+    return sorted(refs)
+
+
+class SnapshotCursor:
+    """The subset of pymongo's Cursor API the analysis scripts use"""
+
+    def __init__(self, snapshot, projection):
+        self.snapshot = snapshot
+        self.projection = projection
+        self._sort = []
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None):
+        if isinstance(key_or_list, str):
+            key_or_list = [(key_or_list, direction or 1)]
+        self._sort = list(key_or_list)
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def __iter__(self):
+        import pyarrow.compute as pc
+
+        fields = [f for f, keep in (self.projection or {}).items() if keep and f != "_id"]
+        table = self.snapshot.table(fields or None)
+        if self._sort:
+            sort_keys = [(f, "descending" if d == -1 else "ascending") for f, d in self._sort]
+            # Nulls are the smallest BSON value, so they lead ascending and trail
+            # descending; Arrow already puts them at the end by default
+            if self._sort[0][1] == -1:
+                indices = pc.sort_indices(table, sort_keys=sort_keys)
+            else:
+                indices = pc.sort_indices(table, sort_keys=sort_keys, null_placement="at_start")
+            table = table.take(indices)
+        if self._limit:
+            table = table.slice(0, self._limit)
+        for batch in table.to_batches():
+            yield from batch.to_pylist()
+
+
+class SnapshotCollection:
+    """Read-only stand-in for patient_data backed by a memory-mapped Parquet file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+
+    def table(self, columns=None):
+        """Read only the requested columns; pages are memory-mapped, not copied"""
+        import pyarrow.parquet as pq
+        return pq.read_table(self.path, columns=columns, memory_map=True)
+
+    def estimated_document_count(self):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(self.path).metadata.num_rows
+
+    def count_documents(self, filter):
+        if not filter:
+            return self.estimated_document_count()
+        return self._match(self.table(_pipeline_fields([{"$match": filter}])), filter).num_rows
+
+    def find(self, filter=None, projection=None, **kwargs):
+        if filter:
+            raise ValueError("Snapshot find() only supports an empty filter")
+        return SnapshotCursor(self, projection)
+
+    def aggregate(self, pipeline, **kwargs):
+        table = self.table(_pipeline_fields(pipeline))
+        rows = None
+        for stage in pipeline:
+            (operator, spec), = stage.items()
+            if operator == "$match" and rows is None:
+                table = self._match(table, spec)
+            elif operator == "$group" and rows is None:
+                rows = self._group(table, spec)
+            elif operator == "$bucket" and rows is None:
+                rows = self._bucket(table, spec)
+            elif operator == "$sort" and rows is not None:
+                for path, direction in reversed(list(spec.items())):
+                    rows.sort(key=lambda r: bson_sort_key(nested(r, path)), reverse=direction == -1)
+            else:
+                raise ValueError(f"Snapshot mode does not support {operator} here")
+        return iter(rows if rows is not None else table.to_pylist())
+
+    def _match_expression(self, spec):
+        import pyarrow.compute as pc
+        import pyarrow as pa
+
+        mask = None
+        for field, condition in spec.items():
+            column = pc.field(field)
+            if isinstance(condition, dict) and set(condition) == {"$in"}:
+                expr = column.isin(pa.array(condition["$in"]))
+            elif isinstance(condition, dict):
+                raise ValueError(f"Snapshot mode does not support {condition}")
+            else:
+                expr = column == condition
+            mask = expr if mask is None else mask & expr
+        return mask
+
+    def _match(self, table, spec):
+        return table.filter(self._match_expression(spec))
+
+    def _expression(self, table, expr):
+        """Evaluate a $sum/$avg operand to an Arrow array"""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        if isinstance(expr, str) and expr.startswith("$"):
+            return table[expr[1:]]
+        if isinstance(expr, (int, float)):
+            return pa.repeat(pa.scalar(expr, pa.int64()), table.num_rows)
+        if isinstance(expr, dict) and "$cond" in expr:
+            test, if_true, if_false = expr["$cond"]
+            (field, values), = [test["$in"]]
+            hit = pc.is_in(table[field[1:]], value_set=pa.array(values))
+            return pc.if_else(pc.fill_null(hit, False), if_true, if_false)
+        raise ValueError(f"Snapshot mode does not support expression {expr}")
+
+    def _accumulate(self, table, keys, output):
+        """Group table by key columns and evaluate $sum/$avg accumulators"""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        columns = {key: table[key] for key in keys}
+        aggregations = []
+        for name, accumulator in output.items():
+            (operator, operand), = accumulator.items()
+            columns[name] = self._expression(table, operand)
+            if operator == "$sum":
+                # $sum of nothing is 0, not null
+                aggregations.append((name, "sum", pc.ScalarAggregateOptions(min_count=0)))
+            elif operator == "$avg":
+                aggregations.append((name, "mean"))
+            else:
+                raise ValueError(f"Snapshot mode does not support {operator}")
+
+        grouped = pa.table(columns).group_by(keys).aggregate(aggregations)
+        rows = []
+        for row in grouped.to_pylist():
+            result = {name: row[f"{name}_{function}"] for name, function, *_ in aggregations}
+            rows.append(({key: row[key] for key in keys}, result))
+        return rows
+
+    def _group(self, table, spec):
+        spec = dict(spec)
+        id_spec = spec.pop("_id")
+        if id_spec is None:
+            keys = []
+        elif isinstance(id_spec, str):
+            keys = [id_spec[1:]]
+        else:
+            keys = [path[1:] for path in id_spec.values()]
+
+        rows = []
+        for key_values, result in self._accumulate(table, keys, spec):
+            if id_spec is None:
+                group_id = None
+            elif isinstance(id_spec, str):
+                group_id = key_values[keys[0]]
+            else:
+                group_id = {name: key_values[path[1:]] for name, path in id_spec.items()}
+            rows.append({"_id": group_id, **result})
+        return rows
+
+    def _bucket(self, table, spec):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        values = table[spec["groupBy"][1:]]
+        boundaries = spec["boundaries"]
+        # Index of the bucket each value falls in, -1 for the default bucket
+        index = pa.array([-1] * table.num_rows, type=pa.int64())
+        for i in range(len(boundaries) - 1):
+            inside = pc.and_(pc.greater_equal(values, boundaries[i]), pc.less(values, boundaries[i + 1]))
+            index = pc.if_else(pc.fill_null(inside, False), i, index)
+        table = table.append_column("__bucket", index)
+
+        rows = []
+        for key_values, result in self._accumulate(table, ["__bucket"], spec["output"]):
+            i = key_values["__bucket"]
+            rows.append({"_id": spec["default"] if i == -1 else boundaries[i], **result})
+        rows.sort(key=lambda r: bson_sort_key(r["_id"]))
+        return rows
+
+
+def snapshot_collection():
+    """Return a SnapshotCollection when DIABETES_SNAPSHOT points at a snapshot"""
+    path = os.environ.get(SNAPSHOT_ENV)
+    return SnapshotCollection(path) if path else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export patient_data to a Parquet snapshot")
+    parser.add_argument("path", nargs="?", default="patient_data.parquet")
+    parser.add_argument("--uri", default=None, help="overrides DIABETES_MONGO_URI")
+    parser.add_argument("--batch-size", type=int, default=50000)
+    args = parser.parse_args()
+
+    configure(uri=args.uri)
+    collection = get_collection()
+
+    print(f"📦 Exporting patient_data to {args.path}...")
+    rows = export_snapshot(collection, args.path, args.batch_size)
+    print(f"✅ Wrote {rows:,} rows")
+    print(f"   Run any analysis against it with {SNAPSHOT_ENV}={args.path}")
+
+
+if __name__ == "__main__":
+    main()
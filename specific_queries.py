@@ -1,35 +1,74 @@
-from pymongo import MongoClient
+from metrics import labelled
+from result_cache import analysis_collection
 
-client = MongoClient('mongodb://localhost:27017/')
-db = client['diabetes_project']
-collection = db['patient_data']
+def data_collection():
+    """Looked up per call: importing does no database work, and nothing keeps a client
+    that connection.configure() has since closed"""
+    return analysis_collection()
 
-print("=== SPECIFIC DIABETES DATA QUERIES ===")
 
+LONG_STAY_PROJECTION = {"_id": 0, "patient_nbr": 1, "time_in_hospital": 1, "age": 1, "readmitted": 1}
+LONG_STAY_SORT = [("time_in_hospital", -1)]
+LONG_STAY_LIMIT = 10
+
+READMISSION_BY_AGE_PIPELINE = [
+    {"$group": {
+        "_id": {"age": "$age", "readmitted": "$readmitted"},
+        "count": {"$sum": 1}
+    }},
+    {"$sort": {"_id.age": 1}}
+]
+
+AVG_MEDICATIONS_PIPELINE = [
+    {"$group": {"_id": None, "avg_medications": {"$avg": "$num_medications"}}}
+]
+
+MEDICATION_DISTRIBUTION_PIPELINE = [
+    {"$bucket": {
+        "groupBy": "$num_medications",
+        "boundaries": [0, 10, 20, 30, 40, 50],
+        "default": "50+",
+        "output": {"count": {"$sum": 1}}
+    }}
+]
+
+INSULIN_READMISSION_PIPELINE = [
+    {"$group": {
+        "_id": {"insulin": "$insulin", "readmitted": "$readmitted"},
+        "count": {"$sum": 1}
+    }}
+]
+
+RACE_ANALYSIS_PIPELINE = [
+    {"$group": {
+        "_id": "$race",
+        "avg_stay": {"$avg": "$time_in_hospital"},
+        "avg_meds": {"$avg": "$num_medications"},
+        "avg_labs": {"$avg": "$num_lab_procedures"},
+        "count": {"$sum": 1}
+    }},
+    {"$sort": {"count": -1}}
+]
+
+@labelled
 def question_1_long_stay_patients():
     """Which patients stayed in hospital the longest?"""
     print("\n1. 🏥 PATIENTS WITH LONGEST HOSPITAL STAYS:")
     
-    # Find top 10 longest stays
-    longest_stays = collection.find().sort("time_in_hospital", -1).limit(10)
+    # Find top 10 longest stays, reading only the printed fields off the time_in_hospital index
+    longest_stays = list(data_collection().find({}, LONG_STAY_PROJECTION).sort(LONG_STAY_SORT).limit(LONG_STAY_LIMIT))
     
     for patient in longest_stays:
         print(f"   Patient {patient['patient_nbr']}: {patient['time_in_hospital']} days, "
               f"Age: {patient.get('age', 'N/A')}, Readmitted: {patient.get('readmitted', 'N/A')}")
+    return longest_stays
 
+@labelled
 def question_2_readmission_by_age():
     """What's the readmission rate by age group?"""
     print("\n2. 👴 READMISSION RATES BY AGE GROUP:")
     
-    pipeline = [
-        {"$group": {
-            "_id": {"age": "$age", "readmitted": "$readmitted"},
-            "count": {"$sum": 1}
-        }},
-        {"$sort": {"_id.age": 1}}
-    ]
-    
-    results = list(collection.aggregate(pipeline))
+    results = list(data_collection().aggregate(READMISSION_BY_AGE_PIPELINE))
     
     # Group by age
     age_groups = {}
@@ -47,44 +86,32 @@ def question_2_readmission_by_age():
         total = sum(stats.values())
         readmission_rate = (stats.get('YES', 0) + stats.get('>30', 0)) / total * 100
         print(f"   {age}: {readmission_rate:.1f}% readmission rate ({total} patients)")
+    return results
 
+@labelled
 def question_3_medication_analysis():
     """How many medications do patients typically take?"""
     print("\n3. 💊 MEDICATION ANALYSIS:")
     
     # Average medications
-    avg_meds = list(collection.aggregate([
-        {"$group": {"_id": None, "avg_medications": {"$avg": "$num_medications"}}}
-    ]))[0]['avg_medications']
+    avg_meds = list(data_collection().aggregate(AVG_MEDICATIONS_PIPELINE))[0]['avg_medications']
     
     print(f"   Average medications per patient: {avg_meds:.1f}")
     
     # Medication distribution
-    med_distribution = list(collection.aggregate([
-        {"$bucket": {
-            "groupBy": "$num_medications",
-            "boundaries": [0, 10, 20, 30, 40, 50],
-            "default": "50+",
-            "output": {"count": {"$sum": 1}}
-        }}
-    ]))
+    med_distribution = list(data_collection().aggregate(MEDICATION_DISTRIBUTION_PIPELINE))
     
     print("   Medication distribution:")
     for bucket in med_distribution:
         print(f"     {bucket['_id']} meds: {bucket['count']} patients")
+    return {"avg_medications": avg_meds, "distribution": med_distribution}
 
+@labelled
 def question_4_insulin_impact():
     """Does insulin usage affect readmission?"""
     print("\n4. 💉 INSULIN IMPACT ON READMISSION:")
     
-    pipeline = [
-        {"$group": {
-            "_id": {"insulin": "$insulin", "readmitted": "$readmitted"},
-            "count": {"$sum": 1}
-        }}
-    ]
-    
-    results = list(collection.aggregate(pipeline))
+    results = list(data_collection().aggregate(INSULIN_READMISSION_PIPELINE))
     
     insulin_stats = {}
     for result in results:
@@ -103,23 +130,14 @@ def question_4_insulin_impact():
         if stats["total"] > 0:
             rate = stats["readmitted"] / stats["total"] * 100
             print(f"   {insulin}: {rate:.1f}% readmission rate")
+    return results
 
+@labelled
 def question_5_race_analysis():
     """Are there differences in treatment by race?"""
     print("\n5. 🌍 RACE ANALYSIS:")
     
-    pipeline = [
-        {"$group": {
-            "_id": "$race",
-            "avg_stay": {"$avg": "$time_in_hospital"},
-            "avg_meds": {"$avg": "$num_medications"},
-            "avg_labs": {"$avg": "$num_lab_procedures"},
-            "count": {"$sum": 1}
-        }},
-        {"$sort": {"count": -1}}
-    ]
-    
-    results = list(collection.aggregate(pipeline))
+    results = list(data_collection().aggregate(RACE_ANALYSIS_PIPELINE))
     
     for result in results:
         if result["_id"]:  # Skip null/empty races
@@ -128,9 +146,11 @@ def question_5_race_analysis():
             print(f"     Avg stay: {result['avg_stay']:.1f} days")
             print(f"     Avg meds: {result['avg_meds']:.1f}")
             print(f"     Avg labs: {result['avg_labs']:.1f}")
+    return results
 
 # Run all questions
 if __name__ == "__main__":
+    print("=== SPECIFIC DIABETES DATA QUERIES ===")
     question_1_long_stay_patients()
     question_2_readmission_by_age()
     question_3_medication_analysis()
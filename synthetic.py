@@ -0,0 +1,167 @@
+"""
+Synthetic patient_data generator
+Produces documents with the fields and value distributions of the UCI diabetes dataset
+"""
+import argparse
+import csv
+import time
+
+import numpy as np
+
+from connection import configure, get_collection
+from ingest import DATASET_FIELDS, MEDICATION_FIELDS, MISSING
+
+# Category -> share of encounters, taken from diabetic_data.csv (101,766 rows)
+AGE = {
+    "[0-10)": 0.0016, "[10-20)": 0.0068, "[20-30)": 0.0163, "[30-40)": 0.0371,
+    "[40-50)": 0.0952, "[50-60)": 0.1696, "[60-70)": 0.2209, "[70-80)": 0.2562,
+    "[80-90)": 0.1690, "[90-100)": 0.0273,
+}
+READMITTED = {"NO": 0.539, ">30": 0.349, "<30": 0.112}
+INSULIN = {"No": 0.466, "Steady": 0.303, "Down": 0.120, "Up": 0.111}
+RACE = {"Caucasian": 0.748, "AfricanAmerican": 0.189, None: 0.022, "Hispanic": 0.020,
+        "Other": 0.015, "Asian": 0.006}
+GENDER = {"Female": 0.538, "Male": 0.462}
+A1C = {"None": 0.833, ">8": 0.081, "Norm": 0.049, ">7": 0.037}
+MAX_GLU = {"None": 0.947, "Norm": 0.026, ">200": 0.015, ">300": 0.012}
+ADMISSION_TYPE = {1: 0.531, 3: 0.185, 2: 0.182, 6: 0.052, 5: 0.047, 8: 0.003}
+METFORMIN = {"No": 0.804, "Steady": 0.180, "Up": 0.010, "Down": 0.006}
+# Every other drug column is almost always "No"
+OTHER_DRUG = {"No": 0.95, "Steady": 0.045, "Up": 0.003, "Down": 0.002}
+CHANGE = {"No": 0.538, "Ch": 0.462}
+DIABETES_MED = {"Yes": 0.770, "No": 0.230}
+# Most frequent ICD-9 codes across diag_1..diag_3, with the long tail folded in
+DIAGNOSES = {
+    "428": 0.11, "250": 0.10, "276": 0.07, "414": 0.07, "427": 0.06, "401": 0.06,
+    "786": 0.04, "599": 0.04, "496": 0.04, "403": 0.04, "486": 0.03, "410": 0.03,
+    "250.02": 0.03, "491": 0.03, "584": 0.03, "707": 0.02, "780": 0.02, "682": 0.02,
+    "V45": 0.02, "250.6": 0.02, "996": 0.02, "715": 0.02, "434": 0.02, "285": 0.02,
+    "E888": 0.01, "V57": 0.01, "820": 0.01, "574": 0.01, None: 0.01,
+}
+
+
+def _choice(rng, distribution, size):
+    labels = list(distribution)
+    weights = np.asarray(list(distribution.values()), dtype=np.float64)
+    picks = rng.choice(len(labels), size=size, p=weights / weights.sum())
+    return [labels[i] for i in picks]
+
+
+def _clipped(rng, mean, sd, low, high, size, skew=False):
+    if skew:
+        # Stay lengths are right-skewed: most encounters are 1-4 days
+        values = low + rng.gamma(2.0, (mean - low) / 2.0, size)
+    else:
+        values = rng.normal(mean, sd, size)
+    return np.clip(np.rint(values), low, high).astype(int).tolist()
+
+
+def generate_batch(rng, start, size, patients):
+    """Generate `size` encounters with ids starting at `start`"""
+    columns = {
+        "encounter_id": list(range(start, start + size)),
+        "patient_nbr": rng.integers(1, patients + 1, size).tolist(),
+        "race": _choice(rng, RACE, size),
+        "gender": _choice(rng, GENDER, size),
+        "age": _choice(rng, AGE, size),
+        "weight": [None] * size,
+        "admission_type_id": _choice(rng, ADMISSION_TYPE, size),
+        "discharge_disposition_id": rng.integers(1, 29, size).tolist(),
+        "admission_source_id": rng.integers(1, 26, size).tolist(),
+        "time_in_hospital": _clipped(rng, 4.4, 3.0, 1, 14, size, skew=True),
+        "payer_code": [None] * size,
+        "medical_specialty": [None] * size,
+        "num_lab_procedures": _clipped(rng, 43.1, 19.7, 1, 132, size),
+        "num_procedures": np.clip(rng.poisson(1.3, size), 0, 6).tolist(),
+        "num_medications": _clipped(rng, 16.0, 8.1, 1, 81, size),
+        "number_outpatient": np.clip(rng.poisson(0.37, size), 0, 42).tolist(),
+        "number_emergency": np.clip(rng.poisson(0.2, size), 0, 76).tolist(),
+        "number_inpatient": np.clip(rng.poisson(0.64, size), 0, 21).tolist(),
+        "diag_1": _choice(rng, DIAGNOSES, size),
+        "diag_2": _choice(rng, DIAGNOSES, size),
+        "diag_3": _choice(rng, DIAGNOSES, size),
+        "number_diagnoses": np.clip(rng.poisson(7.4, size), 1, 16).tolist(),
+        "max_glu_serum": _choice(rng, MAX_GLU, size),
+        "A1Cresult": _choice(rng, A1C, size),
+        "change": _choice(rng, CHANGE, size),
+        "diabetesMed": _choice(rng, DIABETES_MED, size),
+        "readmitted": _choice(rng, READMITTED, size),
+    }
+    for drug in MEDICATION_FIELDS:
+        if drug == "insulin":
+            distribution = INSULIN
+        elif drug == "metformin":
+            distribution = METFORMIN
+        else:
+            distribution = OTHER_DRUG
+        columns[drug] = _choice(rng, distribution, size)
+
+    return [{field: columns[field][i] for field in DATASET_FIELDS} for i in range(size)]
+
+
+def generate(rows, batch_size=10000, seed=42):
+    """Yield batches of synthetic encounters; the same seed gives the same data"""
+    rng = np.random.default_rng(seed)
+    # Drawing from a pool of 1.35x rows leaves ~70% distinct patient_nbr values,
+    # about the 71,518 patients over 101,766 encounters in the source data
+    patients = max(1, int(rows * 1.35))
+    for start in range(0, rows, batch_size):
+        yield generate_batch(rng, start + 1, min(batch_size, rows - start), patients)
+
+
+def seed_collection(collection, rows, batch_size=10000, seed=42, reset=False):
+    """Insert synthetic encounters and return the number inserted"""
+    if reset:
+        collection.drop()
+    inserted = 0
+    for batch in generate(rows, batch_size, seed):
+        collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    if reset:
+        # The rollup, cube, sketches, timelines and cached results still describe the
+        # dropped documents, and their watermarks would skip the new ones
+        from ingest import rebuild_derived
+        rebuild_derived(collection)
+    else:
+        # Appended encounters fold into the rollups incrementally; only the diagnosis
+        # groups are stored on the documents themselves
+        from diagnoses import index_diagnoses  # diagnoses imports the analysis modules
+        index_diagnoses(collection)
+    return inserted
+
+
+def write_csv(path, rows, batch_size=10000, seed=42):
+    """Write a diabetic_data.csv-shaped file, with '?' for missing values"""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(DATASET_FIELDS)
+        for batch in generate(rows, batch_size, seed):
+            for doc in batch:
+                writer.writerow([MISSING if doc[field] is None else doc[field] for field in DATASET_FIELDS])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic diabetes encounters")
+    parser.add_argument("--rows", type=int, default=100000, help="e.g. 100000, 1000000, 10000000")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--csv", default=None, help="write a CSV instead of inserting")
+    parser.add_argument("--reset", action="store_true", help="drop the collection first")
+    parser.add_argument("--uri", default=None, help="overrides DIABETES_MONGO_URI")
+    parser.add_argument("--collection", default=None, help="overrides DIABETES_COLLECTION")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.csv:
+        print(f"🧪 Writing {args.rows:,} synthetic encounters to {args.csv}...")
+        write_csv(args.csv, args.rows, args.batch_size, args.seed)
+    else:
+        configure(uri=args.uri, collection=args.collection)
+        collection = get_collection()
+        print(f"🧪 Inserting {args.rows:,} synthetic encounters into {collection.name}...")
+        seed_collection(collection, args.rows, args.batch_size, args.seed, args.reset)
+    print(f"✅ Done in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()